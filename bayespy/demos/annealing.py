@@ -91,12 +91,7 @@ def run(N=500, seed=42, maxiter=100, plot=True):
     # VB-EM with deterministic annealing
     #
     Q.load()
-    beta = 0.01
-    while beta < 1.0:
-        beta = min(beta*1.2, 1.0)
-        print("Set annealing to %.2f" % beta)
-        Q.set_annealing(beta)
-        Q.update(repeat=maxiter, tol=1e-4)
+    Q.anneal(repeat=maxiter, start=0.01)
 
     mu_anneal = mu.u[0].copy()
     L_anneal = Q.compute_lowerbound()
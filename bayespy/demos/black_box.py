@@ -28,6 +28,7 @@ Black-box variational inference
 
 import numpy as np
 import scipy
+import time
 
 import matplotlib.pyplot as plt
 import bayespy.plot as myplt
@@ -44,26 +45,25 @@ import bayespy.plot as bpplt
 from bayespy.demos import pca
 
 
-def run(M=10, N=100, D=5, seed=42, maxiter=100, plot=True):
+def run(M=10, N=100, D=5, seed=42, maxiter=100, samples=100, plot=True):
     """
-    Run deterministic annealing demo for 1-D Gaussian mixture.
+    Run black-box variational inference demo for logistic PCA.
     """
 
-    raise NotImplementedError("Black box variational inference not yet implemented, sorry")
-
     if seed is not None:
         np.random.seed(seed)
 
-    # Generate data
-    data = np.dot(np.random.randn(M,D),
-                  np.random.randn(D,N))
+    # Generate binary data
+    f = np.dot(np.random.randn(M,D),
+               np.random.randn(D,N))
+    data = np.random.rand(M,N) < 1 / (1 + np.exp(-f))
 
     # Construct model
-    C = GaussianARD(0, 1, shape=(2,), plates=(M,1), name='C')
-    X = GaussianARD(0, 1, shape=(2,), plates=(1,N), name='X')
+    C = GaussianARD(0, 1, shape=(D,), plates=(M,1), name='C')
+    X = GaussianARD(0, 1, shape=(D,), plates=(1,N), name='X')
     F = Dot(C, X)
 
-    # Some arbitrary log likelihood
+    # Logistic log likelihood
     def logpdf(y, f):
         """
         exp(f) / (1 + exp(f)) = 1/(1+exp(-f))
@@ -75,37 +75,42 @@ def run(M=10, N=100, D=5, seed=42, maxiter=100, plot=True):
         = 1 / (1 + exp(f))
         = -log(1+exp(f)) = -log(exp(0)+exp(f))
         """
-        return -np.logaddexp(0, -f * np.where(y, -1, +1))
+        return -np.logaddexp(0, -f * np.where(y, +1, -1))
         
-    Y = LogPDF(logpdf, F, samples=10, shape=())
-    #Y = GaussianARD(F, 1)
+    Y = LogPDF(logpdf, F, samples=samples, shape=())
 
     Y.observe(data)
 
+    # Break symmetry with random initialization of the means
+    C.initialize_from_parameters(np.random.randn(M,1,D), 1)
+    X.initialize_from_parameters(np.random.randn(1,N,D), 1)
+
     Q = VB(Y, C, X)
     Q.ignore_bound_checks = True
 
+    # The messages from Y are Monte Carlo estimates, thus take stochastic
+    # gradient steps with decreasing step lengths
     delay = 1
     forgetting_rate = 0.7
+    L = []
+    cputime = []
     for n in range(maxiter):
 
-        # Observe a mini-batch
-        #subset = np.random.choice(N, N_batch)
-        #Y.observe(data[subset,:])
-
-        # Learn intermediate variables
-        #Q.update(Z)
+        t = time.process_time()
 
         # Set step length
         step = (n + delay) ** (-forgetting_rate)
 
         # Stochastic gradient for the global variables
         Q.gradient_step(C, X, scale=step)
+
+        cputime.append(time.process_time() - t)
+        L.append(Q.compute_lowerbound())
     
     if plot:
-        bpplt.pyplot.plot(np.cumsum(Q.cputime), Q.L, 'r:')
+        bpplt.pyplot.plot(np.cumsum(cputime), L, 'r:')
         bpplt.pyplot.xlabel('CPU time (in seconds)')
-        bpplt.pyplot.ylabel('VB lower bound')
+        bpplt.pyplot.ylabel('VB lower bound (Monte Carlo estimate)')
 
     return
 
@@ -116,13 +121,13 @@ if __name__ == '__main__':
         opts, args = getopt.getopt(sys.argv[1:],
                                    "",
                                    ["n=",
-                                    "batch=",
+                                    "samples=",
                                     "seed=",
                                     "maxiter="])
     except getopt.GetoptError:
-        print('python stochastic_inference.py <options>')
+        print('python black_box.py <options>')
         print('--n=<INT>        Number of data points')
-        print('--batch=<INT>    Mini-batch size')
+        print('--samples=<INT>  Number of Monte Carlo samples')
         print('--maxiter=<INT>  Maximum number of VB iterations')
         print('--seed=<INT>     Seed (integer) for the random number generator')
         sys.exit(2)
@@ -135,8 +140,8 @@ if __name__ == '__main__':
             kwargs["seed"] = int(arg)
         elif opt in ("--n",):
             kwargs["N"] = int(arg)
-        elif opt in ("--batch",):
-            kwargs["N_batch"] = int(arg)
+        elif opt in ("--samples",):
+            kwargs["samples"] = int(arg)
 
     run(**kwargs)
 
@@ -31,6 +31,7 @@ Inference engines
    :toctree: generated/
 
    VB
+   run_restarts
 
 Parameter expansions
 --------------------
@@ -48,3 +49,4 @@ Parameter expansions
 """
 
 from .vmp.vmp import VB
+from .vmp.vmp import run_restarts
@@ -391,7 +391,11 @@ class GaussianProcess(EF.Node):
 
             
         
-    def lower_bound_contribution(self, gradient=False):
+    def lower_bound_contribution(self, gradient=False, ignore_masked=True,
+                                 replicates=False):
+        if replicates:
+            raise NotImplementedError("%s does not support replicates"
+                                      % self.__class__.__name__)
 
         # Get moment functions from parents
         m = self.parents[0].message_to_child(gradient=gradient)
@@ -66,7 +66,7 @@ class CategoricalMoments(MultinomialMoments):
             raise ValueError("Invalid category index")
 
         u0 = np.zeros((np.size(x), self.D))
-        u0[[np.arange(np.size(x)), np.ravel(x)]] = 1
+        u0[(np.arange(np.size(x)), np.ravel(x))] = 1
         u0 = np.reshape(u0, np.shape(x) + (self.D,))
 
         return [u0]
@@ -97,6 +97,7 @@ class CategoricalDistribution(MultinomialDistribution):
         if categories < 0:
             raise ValueError("Number of categoriess must be non-negative")
         self.D = categories
+        self.hard = False
         super().__init__(1)
         
 
@@ -117,7 +118,16 @@ class CategoricalDistribution(MultinomialDistribution):
     def compute_moments_and_cgf(self, phi, mask=True):
         """
         Compute the moments and :math:`g(\phi)`.
+
+        In the hard-assignment mode, the distribution is collapsed to its most
+        probable category. Then, :math:`g(\phi)` is such that the entropy
+        is zero.
         """
+        if self.hard:
+            x = np.argmax(phi[0], axis=-1)
+            u0 = np.identity(self.D)[x]
+            g = -np.take_along_axis(phi[0], x[...,None], axis=-1)[...,0]
+            return ([u0], g)
         return super().compute_moments_and_cgf(phi, mask=mask)
 
         
@@ -142,7 +152,7 @@ class CategoricalDistribution(MultinomialDistribution):
 
         # Form a binary matrix with only one non-zero (1) in the last axis
         u0 = np.zeros((np.size(x), self.D))
-        u0[[np.arange(np.size(x)), np.ravel(x)]] = 1
+        u0[(np.arange(np.size(x)), np.ravel(x))] = 1
         u0 = np.reshape(u0, np.shape(x) + (self.D,))
         u = [u0]
 
@@ -226,6 +236,21 @@ class Categorical(ExponentialFamily):
                 cls._parent_moments)
     
 
+    def set_hard_assignment(self, hard=True):
+        """
+        Use the most probable category instead of the full posterior.
+
+        In the hard-assignment mode, the posterior approximation collapses to
+        its most probable category, thus the moments are binary vectors. This
+        makes the updates of, for instance, mixture models cheaper and can be
+        used for initialization before switching back to the full posterior
+        with ``set_hard_assignment(False)``.
+        """
+        self._distribution.hard = hard
+        if not np.all(self.observed):
+            self._update_moments_and_cgf()
+
+
     def __str__(self):
         """
         Print the distribution using standard parameterization.
@@ -85,6 +85,7 @@ class CategoricalMarkovChainDistribution(ExponentialFamilyDistribution):
         """
         self.K = categories
         self.N = states
+        self.hard = False
 
     def compute_message_to_parent(self, parent, index, u, u_p0, u_P):
         """
@@ -124,6 +125,16 @@ class CategoricalMarkovChainDistribution(ExponentialFamilyDistribution):
         """
         logp0 = phi[0]
         logP = phi[1]
+        if self.hard:
+            # Collapse to the most probable state sequence
+            z = random.viterbi(logp0, logP)
+            z = np.identity(self.K)[z]
+            z0 = z[...,0,:]
+            zz = z[...,:-1,:,None] * z[...,1:,None,:]
+            # Zero entropy
+            cgf = -(np.sum(np.where(z0, logp0, 0), axis=-1) +
+                    np.sum(np.where(zz, logP, 0), axis=(-1,-2,-3)))
+            return ([z0, zz], cgf)
         (z0, zz, cgf) = random.alpha_beta_recursion(logp0, logP)
         u = [z0, zz]
         return (u, cgf)
@@ -137,8 +148,19 @@ class CategoricalMarkovChainDistribution(ExponentialFamilyDistribution):
     def compute_fixed_moments_and_f(self, x, mask=True):
         """
         Compute the moments and :math:`f(x)` for a fixed value.
+
+        `x` contains the state indices with shape (...,N).
         """
-        raise NotImplementedError()
+        x = np.asanyarray(x)
+        if not misc.isinteger(x):
+            raise ValueError("Values must be integers")
+        if np.any(x < 0) or np.any(x >= self.K):
+            raise ValueError("Invalid category index")
+        z = np.identity(self.K)[x]
+        u0 = z[...,0,:]
+        u1 = z[...,:-1,:,None] * z[...,1:,None,:]
+        f = 0
+        return ([u0, u1], f)
 
     def plates_to_parent(self, index, plates):
         """
@@ -180,29 +202,24 @@ class CategoricalMarkovChainDistribution(ExponentialFamilyDistribution):
         P = np.exp(phi[1] - misc.logsumexp(phi[1],
                                            axis=-1,
                                            keepdims=True))
-        # Explicit broadcasting
-        P = P * np.ones(plates)[...,None,None,None]
+        # Cumulative transition probabilities for all plates
+        P = np.cumsum(P, axis=-1)
+        P = np.broadcast_to(P, plates + np.shape(P)[-3:])
         # Allocate memory
-        Z = np.zeros(plates + (self.N,), dtype=np.int)
+        Z = np.zeros(plates + (self.N,), dtype=int)
         # Draw initial state
         Z[...,0] = random.categorical(p0, size=plates)
-        # Create [0,1,2,...,len(plate_axis)] indices for each plate axis and
-        # make them broadcast properly
-        nplates = len(plates)
-        plates_ind = [np.arange(plate)[(Ellipsis,)+(nplates-i-1)*(None,)]
-                      for (i, plate) in enumerate(plates)]
-        plates_ind = tuple(plates_ind)
-        # Draw next states iteratively
+        # Draw next states iteratively for all plates at once by using the
+        # inverse of the cumulative distribution function
+        x = np.random.rand(*(plates + (self.N-1,)))
         for n in range(self.N-1):
-            # Select the transition probabilities for the current state but take
-            # into account the plates.  This leads to complex NumPy
-            # indexing.. :)
+            # Select the transition probabilities for the current state
             time_ind = min(n, np.shape(P)[-3]-1)
-            ind = plates_ind + (time_ind, Z[...,n], Ellipsis)
-            p = P[ind]
+            p = np.take_along_axis(P[...,time_ind,:,:],
+                                   Z[...,n,None,None],
+                                   axis=-2)[...,0,:]
             # Draw next state
-            z = random.categorical(P[ind])
-            Z[...,n+1] = z
+            Z[...,n+1] = np.sum(p[...,:-1] < x[...,n,None], axis=-1)
             
         return Z
 
@@ -350,6 +367,20 @@ class CategoricalMarkovChain(ExponentialFamily):
                 moments, 
                 parent_moments)
 
+
+    def set_hard_assignment(self, hard=True):
+        """
+        Use the most probable state sequence instead of the full posterior.
+
+        In the hard-assignment mode, the posterior approximation collapses to
+        the most probable state sequence which is found by the Viterbi
+        algorithm. The full posterior is restored with
+        ``set_hard_assignment(False)``.
+        """
+        self._distribution.hard = hard
+        if not np.all(self.observed):
+            self._update_moments_and_cgf()
+
         
 class CategoricalMarkovChainToCategorical(Deterministic):
     """
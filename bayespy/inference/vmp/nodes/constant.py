@@ -23,6 +23,8 @@
 
 import numpy as np
 
+from bayespy.utils import linalg
+
 from .node import Node
 
 class Constant(Node):
@@ -34,7 +36,8 @@ class Constant(Node):
 
     def __init__(self, moments, x, **kwargs):
         self._moments = moments
-        x = np.asanyarray(x)
+        if not isinstance(x, linalg.DiagonalPlusLowRank):
+            x = np.asanyarray(x)
         # Compute moments
         self.u = self._moments.compute_fixed_moments(x)
         # Dimensions of the moments
@@ -73,7 +76,8 @@ class Constant(Node):
 
 
     def set_value(self, x):
-        x = np.asanyarray(x)
+        if not isinstance(x, linalg.DiagonalPlusLowRank):
+            x = np.asanyarray(x)
         shapes = [np.shape(ui) for ui in self.u]
         self.u = self._moments.compute_fixed_moments(x)
         for (i, shape) in enumerate(shapes):
@@ -81,7 +85,8 @@ class Constant(Node):
                 raise ValueError("Incorrect shape for the array")
 
 
-    def lower_bound_contribution(self, gradient=False, **kwargs):
+    def lower_bound_contribution(self, gradient=False, ignore_masked=True,
+                                 replicates=False):
         # Deterministic functions are delta distributions so the lower bound
-        # contribuion is zero.
+        # contribuion is zero, also for each replicate.
         return 0
@@ -154,9 +154,10 @@ class Deterministic(Node):
             for (ind, parent) in enumerate(self.parents):
                 parent._remove_child(self, ind)
 
-    def lower_bound_contribution(self, gradient=False, **kwargs):
+    def lower_bound_contribution(self, gradient=False, ignore_masked=True,
+                                 replicates=False):
         # Deterministic functions are delta distributions so the lower bound
-        # contribuion is zero.
+        # contribuion is zero, also for each replicate.
         return 0
 
 def tile(X, tiles):
@@ -21,11 +21,13 @@
 # along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
 ######################################################################
 
+import contextlib
 import warnings
 
 import numpy as np
 
 from bayespy.utils import misc
+from bayespy.utils import linalg
 
 from .node import ensureparents
 from .stochastic import Stochastic, Distribution
@@ -68,12 +70,20 @@ class ExponentialFamilyDistribution(Distribution):
         for (phi_i, u_i, ndims_i) in zip(phi, u, ndims):
             # Axes to sum (dimensions of the variable, not the plates)
             axis_sum = tuple(range(-ndims_i,0))
-            # Compute the term
-            # TODO/FIXME: Use einsum!
-            L = L + np.sum(phi_i * u_i, axis=axis_sum)
+            # Compute the term without forming the broadcasted product
+            if (isinstance(phi_i, (np.ndarray, np.number, float, int))
+                and isinstance(u_i, np.ndarray)):
+                L = L + misc.sum_multiply(phi_i, u_i, axis=axis_sum)
+            else:
+                L = L + np.sum(phi_i * u_i, axis=axis_sum)
         return L
 
 
+    # Cache of Cholesky factors of the natural parameters of the nodes (if
+    # any), keyed by the node and the version of its natural parameters
+    cholesky_cache = None
+
+
     def compute_gradient(self, g, u, phi):
         r"""
         Compute the standard gradient with respect to the natural parameters.
@@ -104,6 +114,36 @@ def useconstructor(__init__):
 
     return constructor_decorator
 
+
+def slice_plate_axis(x, axis, index):
+    """
+    Index the axis of an array unless the array is broadcast along it.
+
+    The axis is a negative index.  The array is returned as it is if it has
+    no such axis or if the length of the axis is one.
+    """
+    if np.ndim(x) < -axis or np.shape(x)[axis] == 1:
+        return x
+    return x[(Ellipsis, index) + (-axis-1) * (slice(None),)]
+
+
+class NaturalParameters(list):
+    """
+    List of the natural parameters of a node with a version counter.
+
+    The version is incremented whenever a parameter is set, so values
+    computed from the parameters can be cached for the version.
+    """
+
+    def __init__(self, phi, version=0):
+        super().__init__(phi)
+        self.version = version
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.version += 1
+
+
 class ExponentialFamily(Stochastic):
     """
     A base class for nodes using natural parameterization `phi`.
@@ -130,6 +170,35 @@ class ExponentialFamily(Stochastic):
     # Sub-classes should overwrite this
     _distribution = None
 
+    # Compute the moments only for the unobserved plates if their fraction is
+    # at most this
+    _max_compacted_fraction = 0.5
+
+    # Boolean array broadcastable to the plates. The plates which are False
+    # are kept fixed in the updates. None updates all plates.
+    _plates_to_update = None
+
+    @property
+    def phi(self):
+        return self._phi
+
+    @phi.setter
+    def phi(self, phi):
+        # Each write of the natural parameters gets a new version
+        old = getattr(self, '_phi', None)
+        version = 0 if old is None else old.version + 1
+        self._phi = NaturalParameters(phi, version=version)
+
+    def _cache_phi(self):
+        """
+        Return a context in which the distribution can cache values computed
+        from the current natural parameters.
+        """
+        cache = self._distribution.cholesky_cache
+        if cache is None:
+            return contextlib.nullcontext()
+        return cache.key(self, self._phi.version)
+
     @useconstructor
     def __init__(self, *parents, initialize=True, **kwargs):
 
@@ -183,8 +252,9 @@ class ExponentialFamily(Stochastic):
 
             # Update moments
             mask = np.logical_not(self.observed)
-            (u, g) = self._distribution.compute_moments_and_cgf(self.phi,
-                                                                mask=mask)
+            with self._cache_phi():
+                (u, g) = self._distribution.compute_moments_and_cgf(self.phi,
+                                                                    mask=mask)
             # TODO/FIXME/BUG: You should use observation mask in order to not
             # overwrite them!
             self._set_moments_and_cgf(u, g, mask=mask)
@@ -235,6 +305,7 @@ class ExponentialFamily(Stochastic):
         self.phi = list(self.phi)
         # Make sure phi has the correct number of axes. It makes life
         # a bit easier elsewhere.
+        validated = self._is_validated('phi')
         for i in range(len(self.phi)):
             axes = len(self.plates) + self.ndims[i] - np.ndim(self.phi[i])
             if axes > 0:
@@ -246,6 +317,8 @@ class ExponentialFamily(Stochastic):
                 sh = np.shape(self.phi[i])[first:]
                 self.phi[i] = np.reshape(self.phi[i], sh)
             # Check that the shape is correct
+            if validated:
+                continue
             if not misc.is_shape_subset(np.shape(self.phi[i]),
                                          self.get_shape(i)):
                 raise ValueError("Incorrect shape of phi[%d] in node class %s. "
@@ -255,11 +328,19 @@ class ExponentialFamily(Stochastic):
                                     self.__class__.__name__,
                                     np.shape(self.phi[i]),
                                     self.get_shape(i)))
+        self._set_validated('phi')
 
     def _set_moments_and_cgf(self, u, g, mask=True):
         self._set_moments(u, mask=mask)
 
-        self.g = np.where(mask, g, self.g)
+        if (self._buffers is not None
+            and isinstance(self.g, np.ndarray)
+            and np.shape(self.g) == misc.broadcasted_shape(np.shape(mask),
+                                                           np.shape(g),
+                                                           np.shape(self.g))):
+            np.copyto(self.g, g, where=mask)
+        else:
+            self.g = np.where(mask, g, self.g)
 
         return
 
@@ -295,7 +376,7 @@ class ExponentialFamily(Stochastic):
         Computes the Riemannian/natural gradient.
         """
         u_parents = self._message_from_parents()
-        m_children = self._message_from_children()
+        m_children = self._accumulate_messages_from_children()
         
         # TODO/FIXME: Put observed plates to zero?
         # Compute the gradient
@@ -378,31 +459,160 @@ class ExponentialFamily(Stochastic):
         return
 
 
+    def set_plates_to_update(self, mask):
+        """
+        Restrict the updates of the node to the given plates.
+
+        The natural parameters, moments and CGF of the plates that are False
+        in the mask are kept fixed.  If the mask is None, all plates are
+        updated.
+        """
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+            if not misc.is_shape_subset(np.shape(mask), self.plates):
+                raise ValueError("Shape of the mask %s is not broadcastable "
+                                 "to the plates %s"
+                                 % (np.shape(mask), self.plates))
+        self._plates_to_update = mask
+
     def _update_distribution_and_lowerbound(self, m_children, *u_parents):
 
+        phi_old = self.phi
+        freeze = (self._plates_to_update is not None and
+                  all(isinstance(phi, np.ndarray) for phi in phi_old))
+
         # Update phi first from parents..
         self._update_phi_from_parents(*u_parents)
         # .. then just add children's message
-        self.phi = [self.annealing * (phi + m)
-                    for (phi, m) in zip(self.phi, m_children)]
+        if self._buffers is None or freeze:
+            self.phi = [self.annealing * (phi + m)
+                        for (phi, m) in zip(self.phi, m_children)]
+        else:
+            self.phi = [self._add_to_buffer(('phi', i), phi, m)
+                        for (i, (phi, m)) in enumerate(zip(self.phi,
+                                                           m_children))]
+
+        # Keep the old parameters for the plates that are not updated
+        if freeze:
+            self.phi = [np.where(misc.add_trailing_axes(self._plates_to_update,
+                                                        ndim),
+                                 phi,
+                                 phi0)
+                        for (phi, phi0, ndim) in zip(self.phi,
+                                                     phi_old,
+                                                     self.ndims)]
 
         # Update u and g
         self._update_moments_and_cgf()
 
 
+    def _add_to_buffer(self, key, phi, m):
+        """
+        Compute annealing * (phi + m) in-place into a preallocated array.
+        """
+        if not (isinstance(phi, np.ndarray) and isinstance(m, np.ndarray)):
+            # Structured matrices do not support in-place operations
+            return self.annealing * (phi + m)
+        shape = misc.broadcasted_shape(np.shape(phi), np.shape(m))
+        out = self._get_buffer(key, shape)
+        np.add(phi, m, out=out)
+        if self.annealing != 1.0:
+            np.multiply(out, self.annealing, out=out)
+        return out
+
+
     def _update_moments_and_cgf(self):
         """
         Update moments and cgf based on current phi.
         """
         # Mask for plates to update (i.e., unobserved plates)
         update_mask = np.logical_not(self.observed)
+        if self._plates_to_update is not None:
+            update_mask = np.logical_and(update_mask, self._plates_to_update)
+
+        # If most of the plates are observed or some plates are frozen, compute
+        # only the plates to update
+        if np.ndim(update_mask) > 0:
+            update_mask = np.broadcast_to(update_mask, self.plates)
+            count = np.count_nonzero(update_mask)
+            frozen = (self._plates_to_update is not None
+                      and not np.all(self._plates_to_update))
+            if ((count <= self._max_compacted_fraction * update_mask.size
+                 or (frozen and count < update_mask.size))
+                and all(isinstance(phi, np.ndarray) for phi in self.phi)):
+                self._update_moments_and_cgf_compacted(update_mask)
+                return
 
         # Compute the moments (u) and CGF (g)...
-        (u, g) = self._distribution.compute_moments_and_cgf(self.phi,
-                                                            mask=update_mask)
+        with self._cache_phi():
+            (u, g) = self._distribution.compute_moments_and_cgf(
+                self.phi,
+                mask=update_mask
+            )
         # ... and store them
         self._set_moments_and_cgf(u, g, mask=update_mask)
             
+    def _update_moments_and_cgf_compacted(self, mask):
+        """
+        Update moments and cgf only for the plates in the mask.
+
+        The natural parameters are gathered into one plate axis only along the
+        plate axes in which they vary, so parameters shared over the plates
+        are not expanded.  The moments are computed for the gathered
+        parameters and the results are scattered into new arrays, or in-place
+        in the buffer-reuse mode.
+        """
+        plates = self.plates
+
+        # Plate shapes of the natural parameters aligned with the plates
+        plates_phi = [(1,) * (len(plates) - np.ndim(phi_i) + ndim)
+                      + np.shape(phi_i)[:np.ndim(phi_i)-ndim]
+                      for (phi_i, ndim) in zip(self.phi, self.ndims)]
+
+        # Reduce the mask over the plate axes in which the parameters do not
+        # vary, the moments are equal along them
+        shared = tuple(axis for axis in range(len(plates))
+                       if all(p[axis] == 1 for p in plates_phi))
+        mask_phi = np.any(mask, axis=shared, keepdims=True)
+        index = np.nonzero(mask_phi)
+
+        phi = []
+        for (phi_i, plates_i, ndim) in zip(self.phi, plates_phi, self.ndims):
+            dims = np.shape(phi_i)[np.ndim(phi_i)-ndim:]
+            phi_i = np.reshape(phi_i, plates_i + dims)
+            if all(n == 1 for n in plates_i):
+                phi.append(np.reshape(phi_i, (1,) + dims))
+            else:
+                phi.append(phi_i[tuple(ind if n != 1 else 0
+                                       for (ind, n) in zip(index, plates_i))])
+
+        (u, g) = self._distribution.compute_moments_and_cgf(phi)
+
+        # Rows of the computed moments for the plates in the mask
+        full = np.nonzero(mask)
+        if len(shared) > 0:
+            rows = np.zeros(np.shape(mask_phi), dtype=int)
+            rows[index] = np.arange(len(index[0]))
+            rows = rows[tuple(0 if axis in shared else ind
+                              for (axis, ind) in enumerate(full))]
+        else:
+            rows = slice(None)
+
+        def scatter(x, old, dims):
+            x = x if np.shape(x)[0] == 1 else x[rows]
+            # Write to a copy unless the arrays are owned buffers
+            if (self._buffers is None
+                or not isinstance(old, np.ndarray)
+                or np.shape(old) != plates + dims):
+                old = np.array(np.broadcast_to(old, plates + dims))
+            old[full] = x
+            return old
+
+        for ind in range(len(u)):
+            self.u[ind] = scatter(u[ind], self.u[ind], self.dims[ind])
+        self.g = scatter(g, self.g, ())
+
+
     def observe(self, x, *args, mask=True):
         """
         Fix moments, compute f and propagate mask.
@@ -433,14 +643,18 @@ class ExponentialFamily(Stochastic):
         self.observed = mask
         self._update_mask()
 
-    def lower_bound_contribution(self, gradient=False, ignore_masked=True):
+    def lower_bound_contribution(self, gradient=False, ignore_masked=True,
+                                 replicates=False):
         r"""Compute E[ log p(X|parents) - log q(X) ]
 
         If deterministic annealing is used, the term E[ -log q(X) ] is
         divided by the anneling coefficient.  That is, phi and cgf of q
         are multiplied by the temperature (inverse annealing
         coefficient).
-        
+
+        If `replicates` is True, the contribution is summed over all but the
+        leading plate axis, that is, an array of the contributions of each
+        replicate is returned.
         """
 
         # Annealing temperature
@@ -487,13 +701,30 @@ class ExponentialFamily(Stochastic):
             axis_sum = tuple(range(-len(dims),0))
 
             # Compute the term
-            phi_q = np.where(latent_mask_i, phi_q, 0)
+            if not np.all(latent_mask):
+                phi_q = np.where(latent_mask_i, phi_q, 0)
             # Apply annealing
             # TODO/FIXME: Use einsum here?
-            Z = np.sum((phi_p-T*phi_q) * u_q, axis=axis_sum)
+            phi_d = phi_p - T*phi_q
+            if (isinstance(phi_d, linalg.DiagonalPlusLowRank) or
+                isinstance(u_q, linalg.DiagonalPlusLowRank)):
+                # Keep structured matrices in the factored form
+                Z = linalg.inner(phi_d, u_q, ndim=len(dims))
+            else:
+                Z = np.sum(phi_d * u_q, axis=axis_sum)
 
             L = L + Z
 
+        if replicates:
+            if len(self.plates) == 0:
+                raise ValueError("Node %s has no plate axis for replicates"
+                                 % self.name)
+            if ignore_masked:
+                L = np.where(self.mask, L, 0)
+            L = np.reshape(np.broadcast_to(L, self.plates),
+                           (self.plates[0], -1))
+            return np.sum(L, axis=-1) * np.prod(self.plates_multiplier)
+
         if ignore_masked:
             return (np.sum(np.where(self.mask, L, 0))
                     * self.broadcasting_multiplier(self.plates,
@@ -529,6 +760,69 @@ class ExponentialFamily(Stochastic):
         Compute the probability density function of this node.
         """
         return np.exp(self.logpdf(X, mask=mask))
+
+
+    def get_predictive_logpdf(self, batch_size=None):
+        r"""
+        Return a function which scores new observations of this node.
+
+        The function computes the expected log-likelihood
+        :math:`\mathrm{E}_{q(\mathrm{parents})}[\log p(x|\mathrm{parents})]`
+        of new observations `x` under the current posterior approximation of
+        the parents.  The terms depending on the parents are computed once,
+        when this method is called, thus the function is not affected by
+        later changes of the posterior and the graph is not modified.  The
+        plates of `x` are matched with the plates of the node from the right.
+        If `batch_size` is given, `x` is scored in chunks of at most
+        `batch_size` elements along the leading axis, which must be a plate
+        axis, in order to bound the size of the intermediate arrays.  The
+        returned function accepts a `mask` and returns zero for masked plates.
+        """
+        logpdf = self._get_predictive_logpdf()
+        def predictive_logpdf(x, mask=True):
+            x = np.asanyarray(x)
+            if batch_size is None or np.ndim(x) == 0:
+                lpdf = logpdf(x)
+            else:
+                lpdf = np.concatenate(
+                    [logpdf(x[start:(start+batch_size)],
+                            slice(start, start+batch_size))
+                     for start in range(0, np.shape(x)[0], batch_size)],
+                    axis=0
+                )
+            return np.where(mask, lpdf, 0)
+        return predictive_logpdf
+
+
+    def _get_predictive_logpdf(self):
+        """
+        Return a function computing the expected log-likelihood of new
+        observations, given the current posterior of the parents.
+
+        The function takes the observations and the index of the chunk along
+        the leading plate axis of the observations.
+        """
+        u_parents = self._message_from_parents()
+        distribution = self._distribution
+        # Copy, because the arrays of the parents may be updated in-place
+        phi = [np.copy(phi_i) if isinstance(phi_i, np.ndarray) else phi_i
+               for phi_i in distribution.compute_phi_from_parents(*u_parents)]
+        g = np.copy(distribution.compute_cgf_from_parents(*u_parents))
+        ndims = [len(dims) for dims in self.dims]
+        def logpdf(x, index=slice(None)):
+            (u, f) = distribution.compute_fixed_moments_and_f(x)
+            # Select the chunk of the parameters varying along the leading
+            # plate axis of the observations
+            axis = ndims[0] - np.ndim(u[0])
+            return distribution.compute_logpdf(
+                u,
+                [slice_plate_axis(phi_i, axis-ndim, index)
+                 for (phi_i, ndim) in zip(phi, ndims)],
+                slice_plate_axis(g, axis, index),
+                f,
+                ndims
+            )
+        return logpdf
         
 
     def save(self, group):
@@ -565,4 +859,5 @@ class ExponentialFamily(Stochastic):
         """
         Draw a random sample from the distribution.
         """
-        return self._distribution.random(*(self.phi), plates=self.plates)
+        with self._cache_phi():
+            return self._distribution.random(*(self.phi), plates=self.plates)
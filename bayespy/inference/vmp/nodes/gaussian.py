@@ -349,6 +349,20 @@ class GaussianDistribution(ExponentialFamilyDistribution):
     """    
 
     
+    def __init__(self):
+        self.cholesky_cache = linalg.CholeskyCache()
+        super().__init__()
+
+
+    def _chol_precision(self, phi1):
+        """
+        Cholesky factor of the precision matrix, computed once per phi version.
+        """
+        return self.cholesky_cache.chol(
+            lambda: -2*misc.collapse_broadcast_axes(phi1, ndim=2)
+        )
+
+
     def compute_message_to_parent(self, parent, index, u, u_mu_Lambda):
         r"""
         Compute the message to a parent node.
@@ -426,8 +440,22 @@ class GaussianDistribution(ExponentialFamilyDistribution):
            \boldsymbol{\phi}_1
            + \frac{1}{2} \log | -2 \boldsymbol{\phi}_2 |
         """
+        if isinstance(phi[1], linalg.DiagonalPlusLowRank):
+            # Structured precision: use the Woodbury identity and the matrix
+            # determinant lemma instead of the Cholesky decomposition.  The
+            # second moment is the structured covariance plus a rank-one term.
+            Lambda = -2*phi[1]
+            u0 = Lambda.solve(phi[0])
+            u1 = Lambda.inv() + linalg.DiagonalPlusLowRank(np.zeros(np.shape(u0)),
+                                                          u0[...,None])
+            g = (-0.5 * np.einsum('...i,...i', u0, phi[0])
+                 + 0.5 * Lambda.logdet())
+            return ([u0, u1], g)
         # TODO: Compute -2*phi[1] and simplify the formulas
-        L = linalg.chol(-2*phi[1])
+        # The precision is often shared by all plates (e.g., no children give
+        # plate-specific messages), so factorize each distinct matrix only once
+        # and keep the covariance broadcastable
+        L = self._chol_precision(phi[1])
         k = np.shape(phi[0])[-1]
         # Moments
         u0 = linalg.chol_solve(L, phi[0])
@@ -554,11 +582,17 @@ class GaussianDistribution(ExponentialFamilyDistribution):
         # observed/fixed elements!
 
         # Note that phi[1] is -0.5*inv(Cov)
-        U = linalg.chol(-2*phi[1])
+        if isinstance(phi[1], linalg.DiagonalPlusLowRank):
+            # Perturb the information vector and solve: x = inv(Lambda) *
+            # (phi[0] + eta) where eta ~ N(0, Lambda)
+            Lambda = -2*phi[1]
+            eta = Lambda.random_normal(plates)
+            return Lambda.solve(phi[0] + eta)
+        U = self._chol_precision(phi[1])
         mu = linalg.chol_solve(U, phi[0])
         z = np.random.normal(0, 1, plates + np.shape(mu)[-1:])
-        # Compute mu + U'*z
-        z = misc.m_solve_triangular(U, z, trans='T', lower=False)
+        # Compute mu + inv(U)*z, because the precision is U'*U
+        z = linalg.solve_triangular(U, z, trans='N', lower=False)
         return mu + z
             
 
@@ -593,7 +627,19 @@ class GaussianARDDistribution(ExponentialFamilyDistribution):
         self.shape = shape
         self.ndim_mu = ndim_mu
         self.ndim = len(shape)
+        self.cholesky_cache = linalg.CholeskyCache()
         super().__init__()
+
+
+    def _chol_precision(self, phi1):
+        """
+        Cholesky factor of the precision matrix, computed once per phi version.
+        """
+        def precision():
+            D = int(np.prod(self.shape))
+            V = np.reshape(phi1, np.shape(phi1)[:-2*self.ndim] + (D,D))
+            return -2*misc.collapse_broadcast_axes(V, ndim=2)
+        return self.cholesky_cache.chol(precision)
     
     def compute_message_to_parent(self, parent, index, u, u_mu_alpha):
         r"""
@@ -717,8 +763,8 @@ class GaussianARDDistribution(ExponentialFamilyDistribution):
             phi0 = np.reshape(phi[0], phi[0].shape[:-self.ndim] + (D,))
             phi1 = np.reshape(phi[1], phi[1].shape[:-2*self.ndim] + (D,D))
 
-            # Compute the moments
-            L = linalg.chol(-2*phi1)
+            # Compute the moments (factorize a shared precision only once)
+            L = self._chol_precision(phi[1])
             Cov = linalg.chol_inv(L)
             u0 = linalg.chol_solve(L, phi0)
             u1 = linalg.outer(u0, u0) + Cov
@@ -837,19 +883,16 @@ class GaussianARDDistribution(ExponentialFamilyDistribution):
         else:
             N = np.prod(dims)
             dims_cov = dims + dims
-            # Reshape precision matrix
-            plates_cov = np.shape(phi[1])[:-2*D]
-            V = -2 * np.reshape(phi[1], plates_cov + (N,N))
-            # Compute Cholesky
-            U = linalg.chol(V)
+            # Compute Cholesky of the precision matrix
+            U = self._chol_precision(phi[1])
             # Reshape mean vector
             plates_phi0 = np.shape(phi[0])[:-D]
             phi0 = np.reshape(phi[0], plates_phi0 + (N,))
             mu = linalg.chol_solve(U, phi0)
-            # Compute mu + U'*z
+            # Compute mu + inv(U)*z, because the precision is U'*U
             z = np.random.normal(0, 1, plates + (N,))
             x = mu + linalg.solve_triangular(U, z,
-                                             trans='T', 
+                                             trans='N', 
                                              lower=False)
             x = np.reshape(x, plates + dims)
         return x
@@ -1123,8 +1166,12 @@ class Gaussian(ExponentialFamily):
     mu : Gaussian-like node or GaussianGammaISO-like node or GaussianWishart-like node or array
         Mean vector
 
-    Lambda : Wishart-like node or array
-        Precision matrix
+    Lambda : Wishart-like node or array or DiagonalPlusLowRank
+        Precision matrix.  A precision given as
+        :class:`bayespy.utils.linalg.DiagonalPlusLowRank` keeps its structure
+        in the messages so the posterior moments are computed using the
+        Woodbury identity and the second moment is kept in the same factored
+        form.
 
     See also
     --------
@@ -550,7 +550,11 @@ class NodeMultiGaussianProcess(Stochastic):
 
             
         
-    def lower_bound_contribution(self, gradient=False):
+    def lower_bound_contribution(self, gradient=False, ignore_masked=True,
+                                 replicates=False):
+        if replicates:
+            raise NotImplementedError("%s does not support replicates"
+                                      % self.__class__.__name__)
         m = self.parents[0].message_to_child(gradient=gradient)
         k = self.parents[1].message_to_child(gradient=gradient)
         ## m = self.parents[0].message_to_child(gradient=gradient)[0]
@@ -730,7 +734,11 @@ class NodeGaussianProcess(Stochastic):
 
             
         
-    def lower_bound_contribution(self, gradient=False):
+    def lower_bound_contribution(self, gradient=False, ignore_masked=True,
+                                 replicates=False):
+        if replicates:
+            raise NotImplementedError("%s does not support replicates"
+                                      % self.__class__.__name__)
         m = self.parents[0].message_to_child(gradient=gradient)
         k = self.parents[1].message_to_child(gradient=gradient)
         ## m = self.parents[0].message_to_child(gradient=gradient)[0]
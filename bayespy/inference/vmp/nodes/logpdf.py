@@ -23,9 +23,12 @@
 
 import numpy as np
 
+from bayespy.utils import misc
+
 from .expfamily import ExponentialFamily, useconstructor
 from .stochastic import Distribution
 from .node import Moments
+from .gaussian import GaussianMoments
 
 
 class LogPDFDistribution(Distribution):
@@ -35,12 +38,31 @@ class LogPDFDistribution(Distribution):
 class LogPDF(ExponentialFamily):
     """
     General node with arbitrary probability density function
+
+    The node must be observed.  The messages to the parents are estimated by
+    black-box variational inference: `samples` Monte Carlo samples of the
+    parents are drawn along a leading sample axis and the log density is
+    evaluated for them in batches of at most `batch_size` samples, thus
+    `logpdf(y, *x)` must broadcast over the leading axis.  The message to a
+    parent is the least-squares regression of the log density on the
+    sufficient statistics of the parent samples.  This is the score function
+    estimator of the gradient with respect to the moments of the parent using
+    the optimal linear control variate.  The number of samples should exceed
+    the number of sufficient statistics of each parent variable.
+
+    Stochastic parents are sampled from their posterior approximation and
+    deterministic parents with Gaussian moments from the Gaussian
+    distribution with the same moments.  Other deterministic parents cannot
+    be sampled, thus they are not supported.
     """
 
 
-    def __init__(self, logpdf, *parents, **kwargs):
+    def __init__(self, logpdf, *parents, samples=10, batch_size=None,
+                 **kwargs):
 
         self._logpdf = logpdf
+        self._samples = samples
+        self._batch_size = batch_size
 
         super().__init__(logpdf,
                          *parents,
@@ -49,7 +71,7 @@ class LogPDF(ExponentialFamily):
 
 
     @classmethod
-    def _constructor(cls, logpdf, *parents, approximation=None, shape=None, samples=10, **kwargs):
+    def _constructor(cls, logpdf, *parents, approximation=None, shape=None, **kwargs):
         r"""
         Constructs distribution and moments objects.
         """
@@ -65,6 +87,15 @@ class LogPDF(ExponentialFamily):
 
         _parent_moments = [Moments()] * len(parents)
 
+        for parent in parents:
+            if not (isinstance(parent, ExponentialFamily) or
+                    isinstance(parent._moments, GaussianMoments)):
+                raise ValueError("LogPDF cannot sample a parent of type %s: "
+                                 "only stochastic exponential family nodes "
+                                 "and deterministic nodes with Gaussian "
+                                 "moments are supported as parents"
+                                 % type(parent).__name__)
+
         parent_plates = [_distribution.plates_from_parent(i, parent.plates)
                          for (i, parent) in enumerate(parents)]
 
@@ -78,14 +109,93 @@ class LogPDF(ExponentialFamily):
                 _parent_moments)
 
 
-    def _get_message_and_mask_to_parent(self, index):
-        def logpdf_sampler(x):
-            inputs = [self.parents[j].random() if j != index
-                      else x
-                      for j in range(len(self.parents))]
-            return self._logpdf(self.random(), *inputs)
-        mask = self._distribution.compute_mask_to_parent(index, self.mask)
-        return (logpdf_sampler, mask)
+    def _sample_logpdf(self):
+        """
+        Yield batches of parent samples and the masked log density values.
+        """
+        batch_size = self._batch_size
+        if batch_size is None:
+            batch_size = self._samples
+        for start in range(0, self._samples, batch_size):
+            size = min(batch_size, self._samples - start)
+            # Align the plates of the parents with the plates of this node
+            x = [np.reshape(_random(parent, size),
+                            (size,) + self._plates_padding(parent)
+                            + parent.get_shape(0))
+                 for parent in self.parents]
+            lpdf = self._logpdf(*self.u, *x)
+            lpdf = np.where(self.mask, lpdf, 0)
+            yield (x, lpdf)
+
+
+    def _plates_padding(self, parent):
+        """
+        Return the unit plate axes missing from the parent.
+        """
+        return (1,) * (len(self.plates) - len(parent.plates))
+
+
+    def _message_to_parent(self, index):
+        parent = self.parents[index]
+        (plates_self, multiplier_parent, r) = self._get_edge_plan(index)
+        u_parent = parent.get_moments()
+        shapes = parent.dims
+        plates = parent.plates
+        padding = self._plates_padding(parent)
+
+        # Accumulate the statistics of the regression of the log density on
+        # the centered sufficient statistics of the parent
+        n = 0
+        (sum_v, sum_f, sum_vv, sum_vf) = (0, 0, 0, 0)
+        for (x, lpdf) in self._sample_logpdf():
+            size = np.shape(x[index])[0]
+            f = misc.sum_multiply_to_plates(
+                lpdf,
+                to_plates=(size,) + padding + plates,
+                from_plates=(size,) + plates_self
+            )
+            f = np.reshape(f, (size, -1))
+            u = parent._moments.compute_fixed_moments(x[index])
+            v = np.concatenate(
+                [np.reshape(u_i - u_parent_i, (size, -1, int(np.prod(shape))))
+                 for (u_i, u_parent_i, shape) in zip(u, u_parent, shapes)],
+                axis=-1)
+            n += size
+            sum_v = sum_v + np.sum(v, axis=0)
+            sum_f = sum_f + np.sum(f, axis=0)
+            sum_vv = sum_vv + np.matmul(np.transpose(v, (1, 2, 0)),
+                                        np.transpose(v, (1, 0, 2)))
+            sum_vf = sum_vf + np.einsum('spi,sp->pi', v, f)
+
+        mean_v = sum_v / n
+        cov_vv = sum_vv / n - mean_v[...,:,None] * mean_v[...,None,:]
+        cov_vf = sum_vf / n - mean_v * (sum_f / n)[...,None]
+        m = np.einsum('pij,pj->pi', np.linalg.pinv(cov_vv), cov_vf)
+
+        # Split the coefficients to the messages of the moments
+        msg = []
+        for shape in shapes:
+            d = int(np.prod(shape))
+            msg.append(r * np.reshape(m[...,:d], plates + shape))
+            m = m[...,d:]
+        return msg
+
+
+    def lower_bound_contribution(self, gradient=False, ignore_masked=True,
+                                 replicates=False):
+        """
+        Compute a Monte Carlo estimate of E[ log p(Y|parents) ]
+        """
+        (n, L) = (0, 0)
+        for (x, lpdf) in self._sample_logpdf():
+            size = np.shape(lpdf)[0]
+            lpdf = np.broadcast_to(lpdf, (size,) + self.plates)
+            n += size
+            L = L + np.sum(lpdf, axis=(0,) + tuple(range(2, np.ndim(lpdf))))
+        L = np.prod(self.plates_multiplier) * L / n
+        if replicates:
+            return L
+        return np.sum(L)
 
 
     def observe(self, x, *args, mask=True):
@@ -118,3 +228,33 @@ class LogPDF(ExponentialFamily):
         self.observed = mask
         self._update_mask()
 
+
+
+def _random(node, size):
+    """
+    Draw samples of a node along a leading sample axis.
+    """
+    plates = (size,) + node.plates
+    if isinstance(node, ExponentialFamily) and not np.all(node.observed):
+        return node._distribution.random(*node.phi, plates=plates)
+
+    if isinstance(node._moments, GaussianMoments):
+        # Sample from the Gaussian distribution with the same moments
+        u = node.get_moments()
+        ndim = node._moments.ndim
+        if ndim == 0:
+            std = np.sqrt(np.maximum(u[1] - u[0]**2, 0))
+            return u[0] + std * np.random.normal(0, 1, plates)
+        dims = np.shape(u[0])[-ndim:]
+        N = int(np.prod(dims))
+        mu = np.reshape(u[0], np.shape(u[0])[:-ndim] + (N,))
+        Cov = (np.reshape(u[1], np.shape(u[1])[:-2*ndim] + (N,N))
+               - mu[...,:,None] * mu[...,None,:])
+        (s, V) = np.linalg.eigh(Cov)
+        A = V * np.sqrt(np.maximum(s, 0))[...,None,:]
+        z = np.random.normal(0, 1, plates + (N,))
+        x = mu + np.einsum('...ij,...j->...i', A, z)
+        return np.reshape(x, plates + dims)
+
+    raise NotImplementedError("Sampling the parent %s is not supported"
+                              % node.name)
@@ -26,13 +26,15 @@ Module for the mixture distribution node.
 """
 
 import warnings
+import functools
 import numpy as np
 
 from bayespy.utils import misc
 
 from .expfamily import ExponentialFamily, \
                        ExponentialFamilyDistribution, \
-                       useconstructor
+                       useconstructor, \
+                       slice_plate_axis
                        
 from .categorical import Categorical, \
                          CategoricalMoments
@@ -44,15 +46,176 @@ class MixtureDistribution(ExponentialFamilyDistribution):
     
 
     def __init__(self, distribution, cluster_plate, n_clusters, ndims, 
-                 ndims_parents):
+                 ndims_parents, top_k=None, min_responsibility=None):
         """
         Create VMP formula node for a mixture variable
+
+        If `top_k` or `min_responsibility` is given, only the largest
+        responsibilities of each point are used when computing the natural
+        parameters and the messages to the cluster parameters.
         """
         self.distribution = distribution
         self.cluster_plate = cluster_plate
         self.ndims = ndims
         self.ndims_parents = ndims_parents
         self.K = n_clusters
+        self.top_k = top_k
+        self.min_responsibility = min_responsibility
+
+
+    def is_truncated(self):
+        """
+        Return True if the responsibilities are truncated.
+        """
+        return ((self.top_k is not None and self.top_k < self.K) or
+                self.min_responsibility is not None)
+
+
+    def truncate_responsibilities(self, P):
+        """
+        Truncate the responsibilities to a sparse representation.
+
+        Keeps the `top_k` largest responsibilities of each point, drops those
+        below `min_responsibility` (the largest one is always kept) and
+        renormalizes the remaining ones to sum to one.
+
+        Shape(P)       = [Nn,..,N0,K]
+        Shape(indices) = [Nn,..,N0,k]
+        Shape(weights) = [Nn,..,N0,k]
+        """
+        P = np.asanyarray(P)
+        K = np.shape(P)[-1]
+        k = K if self.top_k is None else min(self.top_k, K)
+        if self.min_responsibility is not None:
+            n_above = np.sum(P >= self.min_responsibility, axis=-1)
+            k = min(k, max(np.max(n_above, initial=0), 1))
+        if k < K:
+            # Copy the kept indices so that the full partition is freed
+            indices = np.argpartition(P, K-k, axis=-1)[...,K-k:].copy()
+        else:
+            indices = np.broadcast_to(np.arange(K), np.shape(P))
+        weights = np.take_along_axis(P, indices, axis=-1)
+        if self.min_responsibility is not None:
+            keep = ((weights >= self.min_responsibility) |
+                    (weights == np.max(weights, axis=-1, keepdims=True)))
+            weights = np.where(keep, weights, 0)
+        weights = weights / np.sum(weights, axis=-1, keepdims=True)
+        return (indices, weights)
+
+
+    def _sparse_responsibilities(self, P):
+        """
+        Return the responsibilities in the sparse form if possible.
+
+        The responsibilities are sparse if they are truncated or if they are
+        hard assignments (e.g., the cluster assignment node is in the
+        hard-assignment mode). Otherwise, returns None.
+        """
+        if self.is_truncated():
+            return self.truncate_responsibilities(P)
+        P = np.asanyarray(P)
+        if np.ndim(P) > 0 and np.all(np.amax(P, axis=-1) == 1):
+            indices = np.argmax(P, axis=-1)[...,None]
+            return (indices, np.ones(np.shape(indices)))
+        return None
+
+
+    def sum_sparse_message_to_parent(self, m, indices, weights, mask, plates,
+                                     shape, ndim):
+        """
+        Weigh the message with sparse responsibilities and sum to a parent.
+
+        Instead of weighing with a dense array of responsibilities, the
+        message of each point is gathered for its kept clusters only and the
+        weighted contributions are added to the clusters by their indices.
+
+        Shape(m)       = [Nn,..,K,..,N0,Dd,..,D0]
+        Shape(indices) = [Nn,..,N0,k]
+        Shape(weights) = [Nn,..,N0,k]
+        Shape(result)  = shape
+        """
+        if self.cluster_plate >= 0:
+            raise ValueError("Cluster plate axis must be negative")
+
+        # Nested mixtures may give the message as factors
+        if isinstance(m, tuple):
+            m = functools.reduce(np.multiply, m)
+
+        # The cluster axis in the plates of this node
+        axis = len(plates) + self.cluster_plate
+        dims = shape[len(shape)-ndim:]
+        plates_parent = shape[:len(shape)-ndim]
+        k = np.shape(indices)[-1]
+        plates_k = plates[:axis] + (k,) + plates[axis+1:]
+
+        # Move the axis of the kept clusters to the cluster axis:
+        # Shape(ind)    = [Nn,..,k,..,N0]
+        # Shape(w)      = [Nn,..,k,..,N0]
+        def to_cluster_axis(x):
+            x = misc.atleast_nd(x, abs(self.cluster_plate))
+            x = misc.moveaxis(x, -1, self.cluster_plate)
+            return np.broadcast_to(x, plates_k)
+        ind = to_cluster_axis(indices)
+        w = to_cluster_axis(weights)
+        mask = np.broadcast_to(mask, plates)
+        w = w * np.take_along_axis(mask, ind, axis=axis)
+
+        # Gather the messages of the kept clusters:
+        # Shape(m)      = [Nn,..,k,..,N0,Dd,..,D0]
+        m = np.broadcast_to(m, plates + dims)
+        m = np.take_along_axis(m,
+                               misc.add_trailing_axes(ind, ndim),
+                               axis=axis)
+        m = m * misc.add_trailing_axes(w, ndim)
+
+        # Flat index of the parent plate for each contribution
+        flat = 0
+        for (j, n) in enumerate(plates_parent):
+            a = len(plates) - len(plates_parent) + j
+            if a == axis:
+                i = ind
+            else:
+                i = np.arange(n)[(Ellipsis,) + (len(plates)-a-1)*(None,)]
+            flat = flat * n + (i if n > 1 else 0)
+        flat = np.ravel(np.broadcast_to(flat, plates_k))
+
+        # Add the contributions to the plates of the parent
+        size = int(np.prod(plates_parent))
+        m = np.reshape(m, (len(flat), -1))
+        result = np.stack([np.bincount(flat, weights=m[:,d], minlength=size)
+                           for d in range(np.shape(m)[-1])],
+                          axis=-1)
+        return np.reshape(result, shape)
+
+
+    def compute_cluster_message_to_parent(self, parent, index, u, *u_parents):
+        """
+        Compute the messages of all clusters to a cluster parameter parent.
+
+        The messages are not weighted by the responsibilities.
+
+        Shape(result) = [Nn,..,K,..,N0,Dd,..,D0]
+        """
+
+        # Parent index for the distribution used for the
+        # mixture.
+        index = index - 1
+
+        # Reshape u:
+        # Shape(u)      = [Nn,..1,..,N0,Dd,..,D0]
+        u_self = list()
+        for ind in range(len(u)):
+            if self.cluster_plate < 0:
+                cluster_axis = self.cluster_plate - self.ndims[ind]
+            else:
+                cluster_axis = self.cluster_plate
+            u_self.append(np.expand_dims(u[ind], axis=cluster_axis))
+
+        # Message from the mixed distribution
+        return self.distribution.compute_message_to_parent(parent,
+                                                           index,
+                                                           u_self,
+                                                           *(u_parents[1:]))
 
 
     def compute_message_to_parent(self, parent, index, u, *u_parents):
@@ -99,16 +262,9 @@ class MixtureDistribution(ExponentialFamilyDistribution):
                     if np.ndim(phi[ind]) >= abs(axis_to):
                         phi[ind] = np.expand_dims(phi[ind], axis=axis_to)
 
-            # Reshape u:
-            # Shape(u)      = [Nn,..,N0,1,Dd,..,D0]
-            u_self = list()
-            for ind in range(len(u)):
-                u_self.append(np.expand_dims(u[ind],
-                                             axis=(-1-self.ndims[ind])))
-
             # Compute logpdf:
             # Shape(L)      = [Nn,..,N0,K]
-            L = self.distribution.compute_logpdf(u_self, phi, g, 0, self.ndims)
+            L = self._compute_cluster_logpdf(u, phi, g)
 
             # Sum over other than the cluster dimensions? No!
             # Hmm.. I think the message passing method will do
@@ -120,27 +276,23 @@ class MixtureDistribution(ExponentialFamilyDistribution):
 
         elif index >= 1:
 
-            # Parent index for the distribution used for the
-            # mixture.
-            index = index - 1
-
-            # Reshape u:
-            # Shape(u)      = [Nn,..1,..,N0,Dd,..,D0]
-            u_self = list()
-            for ind in range(len(u)):
-                if self.cluster_plate < 0:
-                    cluster_axis = self.cluster_plate - self.ndims[ind]
-                else:
-                    cluster_axis = self.cluster_plate
-                u_self.append(np.expand_dims(u[ind], axis=cluster_axis))
-
             # Message from the mixed distribution
-            m = self.distribution.compute_message_to_parent(parent,
-                                                            index, 
-                                                            u_self, 
-                                                            *(u_parents[1:]))
-
-            # Weigh the messages with the responsibilities
+            m = self.compute_cluster_message_to_parent(parent,
+                                                       index,
+                                                       u,
+                                                       *u_parents)
+
+            # Responsibilities for clusters are the first parent's first
+            # moment. The Mixture node sums the messages with truncated
+            # responsibilities using sum_sparse_message_to_parent instead.
+            # Shape(P)      = [Nn,..,N0,K]
+            P = u_parents[0][0]
+
+            # Weigh the messages with the responsibilities. The product is
+            # not computed explicitly but returned as factors which are
+            # multiplied and summed to the plates of the parent in one go.
+            # This avoids computing the contributions of each data point for
+            # each cluster as an intermediate result.
             for i in range(len(m)):
 
                 # Shape(m)      = [Nn,..,K,..,N0,Dd,..,D0]
@@ -149,15 +301,11 @@ class MixtureDistribution(ExponentialFamilyDistribution):
 
                 # Number of axes for the variable dimensions for
                 # the parent message.
-                D = self.ndims_parents[index][i]
+                D = self.ndims_parents[index-1][i]
 
-                # Responsibilities for clusters are the first
-                # parent's first moment:
-                # Shape(p)      = [Nn,..,N0,K]
-                p = u_parents[0][0]
                 # Move the cluster axis to the proper place:
                 # Shape(p)      = [Nn,..,K,..,N0]
-                p = misc.atleast_nd(p, abs(self.cluster_plate))
+                p = misc.atleast_nd(P, abs(self.cluster_plate))
                 p = misc.moveaxis(p, -1, self.cluster_plate)
                 # Add axes for variable dimensions to the contributions
                 # Shape(p)      = [Nn,..,K,..,N0,1,..,1]
@@ -171,19 +319,69 @@ class MixtureDistribution(ExponentialFamilyDistribution):
                 # Shape(m)      = [Nn,..,1,..,N0,Dd,..,D0]
                 #m[i] = np.expand_dims(m[i], axis=cluster_axis)
 
-                #
-                # TODO: You could do summing here already so that
-                # you wouldn't compute huge matrices as
-                # intermediate result. Use einsum.
+                # Nested mixtures may give the message as factors
+                if isinstance(m[i], tuple):
+                    m[i] = functools.reduce(np.multiply, m[i])
 
-                # Compute the message contributions for each
-                # cluster:
+                # The message contributions for each cluster:
                 # Shape(result) = [Nn,..,K,..,N0,Dd,..,D0]
-                m[i] = m[i] * p
+                m[i] = (m[i], p)
 
             return m
 
         
+    def _compute_cluster_logpdf(self, u, phi, g):
+        """
+        Compute the log pdf of each data point for each cluster.
+
+        If the cluster parameters do not have other plate axes than the
+        cluster axis, the inner products are computed as one matrix product
+        between the data points and the clusters. Otherwise, the generic
+        broadcasting formula is used.
+
+        Shape(u)      = [Nn,..,N0,Dd,..,D0]
+        Shape(phi)    = [Nn,..,N0,K,Dd,..,D0]
+        Shape(g)      = [Nn,..,N0,K]
+        Shape(result) = [Nn,..,N0,K]
+        """
+
+        shared = all(np.ndim(phi_i) <= ndim + 1 or
+                     all(n == 1 for n in np.shape(phi_i)[:-(ndim+1)])
+                     for (phi_i, ndim) in zip(phi, self.ndims))
+
+        if not shared:
+            # Reshape u:
+            # Shape(u)      = [Nn,..,N0,1,Dd,..,D0]
+            u_self = list()
+            for ind in range(len(u)):
+                u_self.append(np.expand_dims(u[ind],
+                                             axis=(-1-self.ndims[ind])))
+            return self.distribution.compute_logpdf(u_self, phi, g, 0,
+                                                    self.ndims)
+
+        L = g
+        for (u_i, phi_i, ndim) in zip(u, phi, self.ndims):
+            # Shape(phi)    = [K,D]
+            phi_i = misc.atleast_nd(phi_i, ndim+1)
+            plates = np.shape(u_i)[:(np.ndim(u_i)-ndim)]
+            dims = misc.broadcasted_shape(np.shape(u_i)[len(plates):],
+                                          np.shape(phi_i)[-ndim:]
+                                          if ndim > 0 else ())
+            K = np.shape(phi_i)[-(ndim+1)]
+            D = int(np.prod(dims))
+            phi_i = np.reshape(
+                np.broadcast_to(np.reshape(phi_i,
+                                           np.shape(phi_i)[-(ndim+1):]),
+                                (K,) + dims),
+                (K, D)
+            )
+            # Shape(u)      = [N,D]
+            u_i = np.reshape(np.broadcast_to(u_i, plates + dims), (-1, D))
+            # Shape(L)      = [Nn,..,N0,K]
+            L = L + np.reshape(np.dot(u_i, phi_i.T), plates + (K,))
+        return L
+
+
     def compute_mask_to_parent(self, index, mask):
         """
         Maps the mask to the plates of a parent.
@@ -209,6 +407,13 @@ class MixtureDistribution(ExponentialFamilyDistribution):
         # Contributions/weights/probabilities
         P = u_parents[0][0]
 
+        # Sparse responsibilities:
+        # Shape(indices) = [Nn,..,N0,k]
+        # Shape(weights) = [Nn,..,N0,k]
+        sparse = self._sparse_responsibilities(P)
+        if sparse is not None:
+            (indices, weights) = sparse
+
         phi = list()
 
         nans = False
@@ -238,17 +443,33 @@ class MixtureDistribution(ExponentialFamilyDistribution):
             else:
                 phi.append(Phi[ind][...,None])
 
-            # Add axes to p:
-            # Shape(p)      = [Nn,..,N0,K,1,..,1]
-            p = misc.add_trailing_axes(P, self.ndims[ind])
-            # Move cluster axis to the last:
-            # Shape(p)      = [Nn,..,N0,1,..,1,K]
-            p = misc.moveaxis(p, -(self.ndims[ind]+1), -1)
-
-            # Now the shapes broadcast perfectly and we can sum
-            # p*phi over the last axis:
-            # Shape(result) = [Nn,..,N0,Dd,..,D0]
-            phi[ind] = misc.sum_product(p, phi[ind], axes_to_sum=-1)
+            if sparse is not None:
+                # Gather the parameters of the kept clusters only:
+                # Shape(phi)    = [Nn,..,N0,Dd,..,D0,k]
+                # Shape(w)      = [Nn,..,N0,1,..,1,k]
+                w = misc.moveaxis(misc.add_trailing_axes(weights,
+                                                         self.ndims[ind]),
+                                  -(self.ndims[ind]+1),
+                                  -1)
+                i = misc.moveaxis(misc.add_trailing_axes(indices,
+                                                         self.ndims[ind]),
+                                  -(self.ndims[ind]+1),
+                                  -1)
+                (phi[ind], i) = self._broadcast_for_gather(phi[ind], i)
+                phi[ind] = np.take_along_axis(phi[ind], i, axis=-1)
+                phi[ind] = misc.sum_product(w, phi[ind], axes_to_sum=-1)
+            else:
+                # Add axes to p:
+                # Shape(p)      = [Nn,..,N0,K,1,..,1]
+                p = misc.add_trailing_axes(P, self.ndims[ind])
+                # Move cluster axis to the last:
+                # Shape(p)      = [Nn,..,N0,1,..,1,K]
+                p = misc.moveaxis(p, -(self.ndims[ind]+1), -1)
+
+                # Now the shapes broadcast perfectly and we can sum
+                # p*phi over the last axis:
+                # Shape(result) = [Nn,..,N0,Dd,..,D0]
+                phi[ind] = misc.sum_product(p, phi[ind], axes_to_sum=-1)
             if np.any(np.isnan(phi[ind])):
                 nans = True
 
@@ -271,6 +492,12 @@ class MixtureDistribution(ExponentialFamilyDistribution):
         """
         return self.distribution.compute_moments_and_cgf(phi, mask=mask)
 
+
+    @property
+    def cholesky_cache(self):
+        # The factors are computed by the distribution of the clusters
+        return self.distribution.cholesky_cache
+
     
     def compute_cgf_from_parents(self, *u_parents):
         """
@@ -305,10 +532,34 @@ class MixtureDistribution(ExponentialFamilyDistribution):
         # axis and utilize broadcasting:
         # Shape(result) = [Nn,..,N0]
 
+        sparse = self._sparse_responsibilities(p)
+        if sparse is not None:
+            # Gather g of the kept clusters only
+            (indices, weights) = sparse
+            (g, indices) = self._broadcast_for_gather(g, indices)
+            g = np.take_along_axis(g, indices, axis=-1)
+            p = weights
+
         g = misc.sum_product(p, g, axes_to_sum=-1)
 
         return g
 
+
+    def _broadcast_for_gather(self, x, indices):
+        """
+        Broadcast the plate axes of the parameters and the cluster indices.
+
+        The last axis of `x` is the cluster axis which can have length one if
+        the parameters are shared between clusters.
+        """
+        shape = misc.broadcasted_shape(np.shape(x)[:-1],
+                                       np.shape(indices)[:-1])
+        if np.shape(x)[-1] == 1:
+            indices = np.zeros_like(indices)
+        x = np.broadcast_to(x, shape + np.shape(x)[-1:])
+        indices = np.broadcast_to(indices, shape + np.shape(indices)[-1:])
+        return (x, indices)
+
     
     def compute_fixed_moments_and_f(self, x, mask=True):
         """
@@ -414,6 +665,21 @@ class Mixture(ExponentialFamily):
         parameters when considering the plates for this node. By
         default, mix over the last plate axis.
 
+    top_k : int, optional
+
+        If given, use only the `top_k` largest responsibilities of each
+        point (renormalized to sum to one) when computing the parameters of
+        this node and the messages to the cluster parameters. This reduces
+        the cost when the number of clusters is large and most
+        responsibilities are negligible. The messages to `z` are not
+        affected. See :meth:`truncation_error`.
+
+    min_responsibility : float, optional
+
+        If given, ignore responsibilities smaller than this threshold (the
+        largest responsibility of each point is always kept). Can be used
+        together with `top_k`.
+
     See also
     --------
 
@@ -437,19 +703,24 @@ class Mixture(ExponentialFamily):
     """
 
 
-    def __init__(self, z, node_class, *params, cluster_plate=-1, **kwargs):
+    def __init__(self, z, node_class, *params, cluster_plate=-1, top_k=None,
+                 min_responsibility=None, **kwargs):
         self.cluster_plate = cluster_plate
         super().__init__(z, node_class, *params, cluster_plate=cluster_plate,
+                         top_k=top_k, min_responsibility=min_responsibility,
                          **kwargs)
         
 
     @classmethod
-    def _constructor(cls, z, node_class, *args, cluster_plate=-1, **kwargs):
+    def _constructor(cls, z, node_class, *args, cluster_plate=-1, top_k=None,
+                     min_responsibility=None, **kwargs):
         """
         Constructs distribution and moments objects.
         """
         if cluster_plate >= 0:
             raise ValueError("Cluster plate axis must be negative")
+        if top_k is not None and top_k < 1:
+            raise ValueError("top_k must be a positive integer")
         
         # Get the stuff for the mixed distribution
         (parents, _, dims, mixture_plates, distribution, moments, parent_moments) = \
@@ -483,7 +754,9 @@ class Mixture(ExponentialFamily):
                                            cluster_plate,
                                            K,
                                            ndims,
-                                           ndims_parents)
+                                           ndims_parents,
+                                           top_k=top_k,
+                                           min_responsibility=min_responsibility)
 
         # Add cluster assignments to parents
         parent_moments = [CategoricalMoments(K)] + list(parent_moments)
@@ -499,6 +772,119 @@ class Mixture(ExponentialFamily):
                 parent_moments)
     
 
+    def truncation_error(self):
+        """
+        Compute the error that truncating the responsibilities causes to the
+        lower bound term of this node.
+
+        Returns the difference between the truncated and the exact lower
+        bound contributions of this node given the current posterior
+        approximations. The terms of the other nodes are not affected by the
+        truncation. Returns zero if the responsibilities are not truncated.
+        """
+        if not self._distribution.is_truncated():
+            return 0.0
+        L_truncated = self.lower_bound_contribution()
+        (top_k, min_resp) = (self._distribution.top_k,
+                             self._distribution.min_responsibility)
+        self._distribution.top_k = None
+        self._distribution.min_responsibility = None
+        try:
+            L_exact = self.lower_bound_contribution()
+        finally:
+            self._distribution.top_k = top_k
+            self._distribution.min_responsibility = min_resp
+        return L_truncated - L_exact
+
+
+    def _message_to_parent(self, index):
+        """
+        Compute the message to a parent.
+
+        If the responsibilities are truncated or hard assignments, the
+        messages to the cluster parameters are added to the kept clusters of
+        each point directly, thus no dense array of the responsibilities is
+        formed.
+        """
+        if index == 0:
+            return super()._message_to_parent(index)
+
+        u_parents = self._message_from_parents(exclude=index)
+        sparse = self._distribution._sparse_responsibilities(u_parents[0][0])
+        if sparse is None:
+            return super()._message_to_parent(index)
+
+        parent = self.parents[index]
+        m = self._distribution.compute_cluster_message_to_parent(parent,
+                                                                 index,
+                                                                 self.u,
+                                                                 *u_parents)
+        mask = self._distribution.compute_mask_to_parent(index, self.mask)
+        (indices, weights) = sparse
+        (plates_self, _, r) = self._get_edge_plan(index)
+        for i in range(len(m)):
+            if m[i] is not None:
+                m[i] = r * self._distribution.sum_sparse_message_to_parent(
+                    m[i],
+                    indices,
+                    weights,
+                    mask,
+                    plates_self,
+                    parent.get_shape(i),
+                    len(parent.dims[i])
+                )
+        return m
+
+
+    def _get_predictive_logpdf(self):
+        r"""
+        Return a function computing the log-likelihood of new observations
+        with the cluster assignments integrated out.
+
+        The cluster probabilities of a new observation are
+        :math:`\propto \exp(\mathrm{E}[\log \pi])` given the posterior of
+        the parents of the cluster assignment node, thus the new
+        observations need not have assignment nodes in the graph.
+        """
+        z = self.parents[0]
+        if not isinstance(z, Categorical):
+            raise ValueError("The cluster assignments must be a Categorical "
+                             "node in order to compute predictive densities")
+        logp = z._distribution.compute_phi_from_parents(
+            *z._message_from_parents()
+        )[0]
+        logp = logp - misc.logsumexp(logp, axis=-1, keepdims=True)
+
+        u_parents = self._message_from_parents()
+        distribution = self._distribution.distribution
+        # Copy, because the arrays of the parents may be updated in-place
+        phi = [np.copy(phi_i)
+               for phi_i in distribution.compute_phi_from_parents(*u_parents[1:])]
+        g = np.copy(distribution.compute_cgf_from_parents(*u_parents[1:]))
+        ndims = self._distribution.ndims
+        cluster_plate = self.cluster_plate
+
+        def logpdf(x, index=slice(None)):
+            (u, f) = distribution.compute_fixed_moments_and_f(x)
+            # Select the chunk of the parameters varying along the leading
+            # plate axis of the observations, taking into account the cluster
+            # axis of the parameters of the clusters
+            axis = ndims[0] - np.ndim(u[0])
+            axis_phi = axis if axis > cluster_plate else axis - 1
+            phi_x = [slice_plate_axis(phi_i, axis_phi-ndim, index)
+                     for (phi_i, ndim) in zip(phi, ndims)]
+            g_x = slice_plate_axis(g, axis_phi, index)
+            logp_x = slice_plate_axis(logp, axis-1, index)
+            f = np.expand_dims(f, axis=cluster_plate)
+            u = [np.expand_dims(u_i, axis=cluster_plate-ndim)
+                 for (u_i, ndim) in zip(u, ndims)]
+            lpdf = distribution.compute_logpdf(u, phi_x, g_x, f, ndims)
+            lpdf = misc.moveaxis(lpdf, cluster_plate, -1)
+            return misc.logsumexp(lpdf + logp_x, axis=-1)
+
+        return logpdf
+
+
     def integrated_logpdf_from_parents(self, x, index):
 
         """ Approximates the posterior predictive pdf \int p(x|parents)
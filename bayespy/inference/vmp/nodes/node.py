@@ -25,6 +25,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 from bayespy.utils import misc
+from bayespy.utils import linalg
 
 """
 This module contains a sketch of a new implementation of the framework.
@@ -227,6 +228,30 @@ class Node():
 
     _id_counter = 0
 
+    # If True, the runtime shape checks of each kind are run only until they
+    # have passed once
+    validate_once = False
+    _validated = frozenset()
+
+    # Precomputed plate mappings of the edges to the parents (if compiled)
+    _edge_plans = None
+
+    # Preallocated arrays reused in the updates (if enabled)
+    _buffers = None
+
+    # The arguments given to the constructor, recorded only while building a
+    # template model (see VB.from_template)
+    _constructor_args = None
+    _record_constructor_args = False
+
+    def __new__(cls, *args, **kwargs):
+        # Store the arguments so that the node can be constructed again with
+        # different plates
+        self = super().__new__(cls)
+        if Node._record_constructor_args:
+            self._constructor_args = (args, kwargs)
+        return self
+
     @ensureparents
     def __init__(self, *parents, dims=None, plates=None, name="", 
                  notify_parents=True, plotter=None, plates_multiplier=None):
@@ -378,12 +403,14 @@ class Node():
            number.
         """
         self.children.add((child, index))
+        self._validated = frozenset()
 
     def _remove_child(self, child, index):
         """
         Remove a child node.
         """
         self.children.remove((child, index))
+        self._validated = frozenset()
 
     def get_mask(self):
         return self.mask
@@ -397,6 +424,8 @@ class Node():
         self.mask = mask
     
     def _update_mask(self):
+        # Observations may change the shapes, so validate them again
+        self._validated = frozenset()
         # Combine masks from children
         mask = np.array(False)
         for (child, index) in self.children:
@@ -472,9 +501,59 @@ class Node():
         return mask
     #return self._compute_mask_to_parent(index, self.get_mask())
 
+    def set_validate_once(self, validate_once=True):
+        """
+        Run the runtime shape checks only until they have passed once.
+
+        The shape checks in message passing are useful for finding bugs but
+        they are overhead in a debugged model.  If enabled, each check is
+        skipped after it has passed once.  The checks are run again if the
+        node gets new children or observations.
+        """
+        self.validate_once = validate_once
+        self._validated = frozenset()
+
+
+    def set_buffer_reuse(self, reuse=True):
+        """
+        Reuse preallocated arrays in the updates instead of allocating new ones.
+
+        The accumulated messages from the children and, for exponential family
+        nodes, the natural parameters are written in-place into arrays that are
+        allocated once.  This reduces memory traffic for nodes with large
+        plates, but references to those arrays held elsewhere change on each
+        update.  The messages returned by `_message_from_children` are copies
+        of the reused arrays.
+        """
+        self._buffers = {} if reuse else None
+
+
+    def _get_buffer(self, key, shape):
+        """
+        Return the preallocated array of the given shape for the key.
+        """
+        buf = self._buffers.get(key)
+        if buf is None or buf.shape != shape:
+            buf = np.empty(shape)
+            self._buffers[key] = buf
+        return buf
+
+
+    def _is_validated(self, check):
+        return self.validate_once and check in self._validated
+
+
+    def _set_validated(self, check):
+        if self.validate_once:
+            self._validated = self._validated | {check}
+
+
     def _message_to_child(self):
 
         u = self.get_moments()
+
+        if self._is_validated('moments'):
+            return u
         
         # Debug: Check that the message has appropriate shape
         for (ui, dim) in zip(u, self.dims):
@@ -512,8 +591,51 @@ class Node():
                            np.shape(ui),
                            self.plates,
                            self.name))
+        self._set_validated('moments')
         return u
                 
+    def _compute_edge_plan(self, index):
+        """
+        Compute the static plate quantities of the edge to parent[index].
+        """
+        plates_self = self._plates_to_parent(index)
+        multiplier_parent = self._plates_multiplier_from_parent(index)
+        try:
+            r = self.broadcasting_multiplier(self.plates_multiplier,
+                                             multiplier_parent)
+        except:
+            raise ValueError("The plate multipliers are incompatible. "
+                             "This node (%s) has %s and parent[%d] "
+                             "(%s) has %s"
+                             % (self.name,
+                                self.plates_multiplier,
+                                index,
+                                self.parents[index].name,
+                                multiplier_parent))
+        return (plates_self, multiplier_parent, r)
+
+
+    def _get_edge_plan(self, index):
+        if self._edge_plans is None:
+            return self._compute_edge_plan(index)
+        return self._edge_plans[index]
+
+
+    def _compile(self):
+        """
+        Freeze the plate mappings of the edges to the parents.
+
+        The graph structure must not change after compilation.  Use
+        `_decompile` to return to computing the mappings dynamically.
+        """
+        self._edge_plans = [self._compute_edge_plan(index)
+                            for index in range(len(self.parents))]
+
+
+    def _decompile(self):
+        self._edge_plans = None
+
+
     def _message_to_parent(self, index):
 
         # Compute the message, check plates, apply mask and sum over some plates
@@ -530,35 +652,9 @@ class Node():
         # The parent we're sending the message to
         parent = self.parents[index]
 
-        # Plates with respect to the parent
-        plates_self = self._plates_to_parent(index)
-
-        # Plate multiplier of the parent
-        multiplier_parent = self._plates_multiplier_from_parent(index)
-
-        # Check if m is a logpdf function (for black-box variational inference)
-        if callable(m):
-            def m_function(*args):
-                lpdf = m(*args)
-                # Log pdf only contains plate axes!
-                plates_m = np.shape(lpdf)
-                r = (self.broadcasting_multiplier(plates_self,
-                                                  plates_m,
-                                                  plates_mask,
-                                                  parent.plates) *
-                     self.broadcasting_multiplier(self.plates_multiplier,
-                                                  multiplier_parent))
-                axes_msg = misc.axes_to_collapse(plates_m, parent.plates)
-                m[i] = misc.sum_multiply(mask_i, m[i], r,
-                                         axis=axes_msg,
-                                         keepdims=True)
-
-                # Remove leading singular plates if the parent does not have
-                # those plate axes.
-                m[i] = misc.squeeze_to_dim(m[i], len(shape_parent))
-
-            return m_function
-            raise NotImplementedError()
+        # Plates with respect to the parent, plate multiplier of the parent
+        # and the multiplier of the message
+        (plates_self, multiplier_parent, r) = self._get_edge_plan(index)
 
         # Compact the message to a proper shape
         for i in range(len(m)):
@@ -566,33 +662,44 @@ class Node():
             # Empty messages are given as None. We can ignore those.
             if m[i] is not None:
 
-                try:
-                    r = self.broadcasting_multiplier(self.plates_multiplier,
-                                                     multiplier_parent)
-                except:
-                    raise ValueError("The plate multipliers are incompatible. "
-                                     "This node (%s) has %s and parent[%d] "
-                                     "(%s) has %s"
-                                     % (self.name,
-                                        self.plates_multiplier,
-                                        index,
-                                        parent.name,
-                                        multiplier_parent))
+                # The message may be given as a tuple of factors whose
+                # product is the actual message. The product is then not
+                # computed explicitly but summed to the plates of the parent
+                # directly.
+                if isinstance(m[i], tuple):
+                    factors = m[i]
+                else:
+                    factors = (m[i],)
+                shape_m = misc.broadcasted_shape(*[np.shape(f)
+                                                   for f in factors])
 
                 ndim = len(parent.dims[i])
                 # Source and target shapes
                 if ndim > 0:
-                    dims = misc.broadcasted_shape(np.shape(m[i])[-ndim:],
+                    dims = misc.broadcasted_shape(shape_m[-ndim:],
                                                   parent.dims[i])
                     from_shape = plates_self + dims
                 else:
                     from_shape = plates_self
                 to_shape = parent.get_shape(i)
+                # A structured matrix message is only scaled if no plates
+                # need to be summed over, otherwise it is made dense
+                if (len(factors) == 1
+                    and isinstance(factors[0], linalg.DiagonalPlusLowRank)):
+                    if (np.all(mask)
+                        and not misc.axes_to_collapse(shape_m, to_shape)):
+                        s = misc.broadcasting_multiplier(from_shape,
+                                                         shape_m,
+                                                         to_shape)
+                        shape_m = shape_m[-len(to_shape):]
+                        m[i] = (r*s) * factors[0].reshape(shape_m)
+                        continue
+                    factors = (np.asarray(factors[0]),)
                 # Add variable axes to the mask
                 mask_i = misc.add_trailing_axes(mask, ndim)
                 # Apply mask and sum plate axes as necessary (and apply plate
                 # multiplier)
-                m[i] = r * misc.sum_multiply_to_plates(m[i], mask_i,
+                m[i] = r * misc.sum_multiply_to_plates(*factors, mask_i,
                                                        to_plates=to_shape,
                                                        from_plates=from_shape,
                                                        ndim=0)
@@ -600,20 +707,53 @@ class Node():
         return m
 
     def _message_from_children(self):
-        msg = [np.zeros(shape) for shape in self.dims]
+        msg = self._accumulate_messages_from_children()
+        if self._buffers is not None:
+            # Do not give out the accumulators because the next call
+            # overwrites them
+            msg = [m.copy() if isinstance(m, np.ndarray) else m
+                   for m in msg]
+        return msg
+
+    def _accumulate_messages_from_children(self):
+        """
+        Sum the messages from the children.
+
+        In the buffer-reuse mode, the sums are written into arrays that the
+        next call overwrites, thus the result must be used before that.
+        """
+        if self._buffers is None:
+            msg = [np.zeros(shape) for shape in self.dims]
+        else:
+            # Reuse the accumulators of the previous call
+            msg = [self._buffers.get(('message', i)) for i in range(len(self.dims))]
+            msg = [np.zeros(shape) if m is None else m
+                   for (m, shape) in zip(msg, self.dims)]
+            for m in msg:
+                m.fill(0)
+        validated = self._is_validated('messages')
         #msg = [np.array(0.0) for i in range(len(self.dims))]
         for (child,index) in self.children:
             m = child._message_to_parent(index)
             for i in range(len(self.dims)):
                 if m[i] is not None:
                     # Check broadcasting shapes
-                    sh = misc.broadcasted_shape(self.get_shape(i), np.shape(m[i]))
+                    if not validated:
+                        misc.broadcasted_shape(self.get_shape(i),
+                                               np.shape(m[i]))
                     try:
                         # Try exploiting broadcasting rules
                         msg[i] += m[i]
-                    except ValueError:
+                    except (ValueError, TypeError):
+                        # Shapes need broadcasting or the message is a
+                        # structured matrix
                         msg[i] = msg[i] + m[i]
 
+        self._set_validated('messages')
+        if self._buffers is not None:
+            for (i, m) in enumerate(msg):
+                if isinstance(m, np.ndarray):
+                    self._buffers[('message', i)] = m
         return msg
 
     def _message_from_parents(self, exclude=None):
@@ -24,6 +24,7 @@
 import numpy as np
 
 from bayespy.utils import misc
+from bayespy.utils import linalg
 
 from .node import Node
 
@@ -184,11 +185,34 @@ class Stochastic(Node):
     def _set_moments(self, u, mask=True):
         # Store the computed moments u but do not change moments for
         # observations, i.e., utilize the mask.
+        validated = self._is_validated('set_moments')
         for ind in range(len(u)):
+            # Structured moments are kept in the factored form if all plates
+            # are set, otherwise the moments are stored as dense arrays
+            if isinstance(u[ind], linalg.DiagonalPlusLowRank):
+                if np.all(mask):
+                    shape = self.get_shape(ind)
+                    ndim_u = np.ndim(u[ind])
+                    if len(shape) > ndim_u:
+                        u[ind] = u[ind].reshape((1,) * (len(shape) - ndim_u)
+                                                + np.shape(u[ind]))
+                    self.u[ind] = u[ind]
+                    continue
+            if isinstance(self.u[ind], linalg.DiagonalPlusLowRank):
+                # The old moments are needed only for the plates not set
+                self.u[ind] = (np.zeros(()) if np.all(mask) else
+                               self.u[ind].dense())
+
             # Add axes to the mask for the variable dimensions (mask
             # contains only axes for the plates).
             u_mask = misc.add_trailing_axes(mask, self.ndims[ind])
 
+            # If the shapes have been checked and the moments array already
+            # has its full shape, copy directly
+            if validated and np.shape(self.u[ind]) == self.get_shape(ind):
+                np.copyto(self.u[ind], u[ind], where=u_mask)
+                continue
+
             # Enlarge self.u[ind] as necessary so that it can store the
             # broadcasted result.
             sh = misc.broadcasted_shape_from_arrays(self.u[ind], u[ind], u_mask)
@@ -229,13 +253,21 @@ class Stochastic(Node):
                        self.plates,
                        self.dims[ind]))
 
+        self._set_validated('set_moments')
+
                 
     def update(self, annealing=1.0):
         if not np.all(self.observed):
             u_parents = self._message_from_parents()
-            m_children = self._message_from_children()
+            m_children = self._accumulate_messages_from_children()
             if annealing != 1.0:
-                m_children = [annealing * m for m in m_children]
+                if self._buffers is None:
+                    m_children = [annealing * m for m in m_children]
+                else:
+                    m_children = [np.multiply(m, annealing, out=m)
+                                  if isinstance(m, np.ndarray) else
+                                  annealing * m
+                                  for m in m_children]
             self._update_distribution_and_lowerbound(m_children, *u_parents)
 
 
@@ -254,6 +286,13 @@ class Stochastic(Node):
         # Sub-class should implement this
         raise NotImplementedError()
 
+    def lower_bound_contribution(self, gradient=False, ignore_masked=True,
+                                 replicates=False):
+        # Sub-class should implement this, also for each replicate separately
+        # if replicates is True
+        raise NotImplementedError("Lower bound contribution not implemented "
+                                  "for %s" % self.__class__.__name__)
+
     def _update_distribution_and_lowerbound(self, m_children, *u_parents):
         # Sub-classes should implement this
         raise NotImplementedError()
@@ -241,3 +241,38 @@ class TestCategorical(TestCase):
                                  [0, 0, 1]])
         
         pass
+
+
+    def test_hard_assignment(self):
+        """
+        Test the hard-assignment mode of categorical nodes
+        """
+
+        Z = Categorical([[0.2, 0.5, 0.3],
+                         [0.6, 0.1, 0.3]])
+        Z.set_hard_assignment()
+        u = Z._message_to_child()
+        self.assertAllClose(u[0],
+                            [[0, 1, 0],
+                             [1, 0, 0]])
+        self.assertAllClose(Z.lower_bound_contribution(ignore_masked=False),
+                            np.log(0.5) + np.log(0.6))
+
+        # Return to the full posterior
+        Z.set_hard_assignment(False)
+        u = Z._message_to_child()
+        self.assertAllClose(u[0],
+                            [[0.2, 0.5, 0.3],
+                             [0.6, 0.1, 0.3]])
+
+        # Mixture uses only the assigned clusters
+        Z = Categorical([0.2, 0.5, 0.3],
+                        plates=(2,))
+        X = Mixture(Z, Gamma, [1, 2, 3], 1)
+        Z.set_hard_assignment()
+        X.update()
+        u = X._message_to_child()
+        self.assertAllClose(u[0] * np.ones(2),
+                            [2, 2])
+
+        pass
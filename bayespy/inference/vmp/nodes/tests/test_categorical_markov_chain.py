@@ -220,3 +220,32 @@ class TestCategoricalMarkovChain(misc.TestCase):
             self.assertAllClose(z, [0, 1, 1, 0])
         
         pass
+
+
+    def test_hard_assignment(self):
+        """
+        Test the hard-assignment mode of categorical Markov chain
+        """
+
+        p0 = [0.6, 0.4]
+        P = [[0.3, 0.7],
+             [0.9, 0.1]]
+        Z = CategoricalMarkovChain(p0, P, states=3)
+        Z.set_hard_assignment()
+        u = Z._message_to_child()
+        # The most probable path is 0 -> 1 -> 0
+        self.assertAllClose(u[0], [1, 0])
+        self.assertAllClose(u[1], [[[0, 1],
+                                    [0, 0]],
+                                   [[0, 0],
+                                    [1, 0]]])
+        # The entropy of the collapsed posterior is zero
+        self.assertAllClose(Z.lower_bound_contribution(ignore_masked=False),
+                            np.log(0.6) + np.log(0.7) + np.log(0.9))
+
+        # Return to the full posterior
+        Z.set_hard_assignment(False)
+        u = Z._message_to_child()
+        self.assertAllClose(u[0], p0)
+
+        pass
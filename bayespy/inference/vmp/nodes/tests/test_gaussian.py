@@ -142,6 +142,92 @@ class TestGaussianFunctions(TestCase):
         pass
 
     
+class TestGaussianDistribution(TestCase):
+
+    def test_shared_precision(self):
+        """
+        Test moments when the precision matrix is shared by the plates
+        """
+        D = 3
+        N = 4
+        distribution = gaussian.GaussianDistribution()
+        Lambda = random.covariance(D)
+        phi0 = np.random.randn(N, D)
+        phi1 = np.broadcast_to(-0.5 * Lambda, (N,D,D))
+        (u, g) = distribution.compute_moments_and_cgf([phi0, phi1])
+        self.assertEqual(np.shape(u[1]), (N,D,D))
+        Cov = np.linalg.inv(Lambda)
+        x = np.einsum('ij,nj->ni', Cov, phi0)
+        self.assertAllClose(u[0], x)
+        self.assertAllClose(u[1]*np.ones((N,1,1)),
+                            x[:,:,None]*x[:,None,:] + Cov)
+        self.assertAllClose(g*np.ones(N),
+                            -0.5*np.einsum('ni,ni->n', x, phi0)
+                            + 0.5*np.linalg.slogdet(Lambda)[1])
+
+        pass
+
+
+    def test_cholesky_cache(self):
+        """
+        Test that the precision is factorized once per update
+        """
+        D = 3
+        X = Gaussian(np.zeros(D), random.covariance(D), plates=(4,))
+        Y = Gaussian(X, np.identity(D))
+        Y.observe(np.random.randn(4, D))
+        cache = X._distribution.cholesky_cache
+        X.update()
+        info = cache.cache_info()
+        x = X.random()
+        self.assertEqual(np.shape(x), (4, D))
+        self.assertEqual(cache.cache_info().hits, info.hits + 1)
+        self.assertEqual(cache.cache_info().misses, info.misses)
+
+        # Writing the natural parameters in-place invalidates the factor
+        X.phi[1] = 2*X.phi[1]
+        X.random()
+        self.assertEqual(cache.cache_info().misses, info.misses + 1)
+
+        pass
+
+
+    def test_diagonal_plus_low_rank(self):
+        """
+        Test a structured precision matrix
+        """
+        D = 4
+        d = np.array([1.0, 2.0, 0.5, 1.5])
+        U = np.random.randn(D, 2)
+        Lambda = linalg.DiagonalPlusLowRank(d, U)
+        V = linalg.DiagonalPlusLowRank(np.ones(D), np.random.randn(D, 1))
+        mu = np.random.randn(D)
+        y = np.random.randn(D)
+
+        # Structured model
+        X = Gaussian(mu, Lambda)
+        Y = Gaussian(X, V)
+        Y.observe(y)
+        X.update()
+        self.assertIsInstance(X.phi[1], linalg.DiagonalPlusLowRank)
+        self.assertIsInstance(X.u[1], linalg.DiagonalPlusLowRank)
+
+        # Dense model
+        Xd = Gaussian(mu, Lambda.dense())
+        Yd = Gaussian(Xd, V.dense())
+        Yd.observe(y)
+        Xd.update()
+
+        self.assertAllClose(X.u[0], Xd.u[0])
+        self.assertAllClose(X.u[1], Xd.u[1])
+        self.assertAllClose(X.lower_bound_contribution(),
+                            Xd.lower_bound_contribution())
+        self.assertAllClose(Y.lower_bound_contribution(),
+                            Yd.lower_bound_contribution())
+
+        pass
+
+
 class TestGaussianARD(TestCase):
 
     def test_init(self):
@@ -912,7 +998,111 @@ class TestGaussianARD(TestCase):
         X.initialize_from_random()
 
         pass
-        
+
+
+    def test_partially_observed(self):
+        """
+        Test that only the unobserved plates of GaussianARD are computed
+        """
+
+        def update(compacted):
+            np.random.seed(1)
+            X = GaussianARD(np.random.randn(2), np.random.rand(2),
+                            shape=(2,), plates=(4,10))
+            Y = GaussianARD(X, 1)
+            Y.observe(np.random.randn(4,10,2))
+            mask = np.random.rand(4,10) < 0.8
+            X.observe(np.random.randn(4,10,2), mask=mask)
+            if not compacted:
+                X._max_compacted_fraction = 0
+            X.update()
+            return (X, mask)
+
+        (X, mask) = update(True)
+        (Z, _) = update(False)
+        self.assertAllClose(X.u[0], Z.u[0])
+        self.assertAllClose(X.u[1], Z.u[1])
+        self.assertAllClose(X.g[~mask], Z.g[~mask])
+        self.assertAllClose(X.lower_bound_contribution(),
+                            Z.lower_bound_contribution())
+
+        # Shared parameters are not expanded and the previous moments are not
+        # modified in-place
+        np.random.seed(1)
+        V = np.random.randn(3, 3)
+        mu = np.random.randn(10, 3)
+        Lambda = V @ V.T + np.identity(3)
+        X = Gaussian(mu, Lambda)
+        mask = np.arange(10) < 7
+        X.observe(np.random.randn(10, 3), mask=mask)
+        (u0, u1, g) = (np.copy(X.u[0]), np.copy(X.u[1]), np.copy(X.g))
+        (v0, v1) = (X.u[0], X.u[1])
+        shapes = []
+        compute = X._distribution.compute_moments_and_cgf
+        def record(phi, mask=True):
+            shapes.append([np.shape(phi_i) for phi_i in phi])
+            return compute(phi, mask=mask)
+        X._distribution.compute_moments_and_cgf = record
+        X.update()
+        self.assertEqual(shapes, [[(3, 3), (1, 3, 3)]])
+        self.assertAllClose(v0, u0)
+        self.assertAllClose(v1, u1)
+        self.assertAllClose(X.u[0][mask], u0[mask])
+        self.assertAllClose(X.g[mask], g[mask])
+        X._distribution.compute_moments_and_cgf = compute
+        Z = Gaussian(mu, Lambda)
+        Z.update()
+        self.assertAllClose(X.u[0][~mask], Z.u[0][~mask])
+        self.assertAllClose(X.u[1][~mask], Z.u[1][~mask])
+        self.assertAllClose(X.g[~mask], Z.g[~mask])
+
+        pass
+
+
+    def test_get_predictive_logpdf(self):
+        """
+        Test scoring new observations of GaussianARD node
+        """
+
+        np.random.seed(1)
+        Mu = GaussianARD(np.random.randn(), 2)
+        Alpha = Gamma(3, 2)
+        X = GaussianARD(Mu, Alpha, plates=(10,))
+        X.observe(np.random.randn(10))
+        logpdf = X.get_predictive_logpdf(batch_size=3)
+
+        (mu, mumu) = Mu.get_moments()
+        (alpha, logalpha) = Alpha.get_moments()
+        x = np.random.randn(7)
+        self.assertAllClose(logpdf(x),
+                            random.gaussian_logpdf(alpha*(x**2 - 2*x*mu + mumu),
+                                                   0,
+                                                   0,
+                                                   logalpha,
+                                                   1))
+
+        # The function is not affected by later changes of the posterior
+        lpdf = logpdf(x)
+        Mu.update()
+        self.assertAllClose(logpdf(x), lpdf)
+        self.assertEqual(len(Mu.children), 1)
+
+        # Parents varying along the plates are scored in chunks
+        X = GaussianARD(GaussianARD(np.arange(10.), 1, plates=(10,)),
+                        1,
+                        plates=(10,))
+        x = np.zeros(10)
+        self.assertAllClose(X.get_predictive_logpdf(batch_size=4)(x),
+                            X.get_predictive_logpdf()(x))
+        self.assertAllClose(X.get_predictive_logpdf(batch_size=4)(x),
+                            random.gaussian_logpdf(np.arange(10.)**2 + 1,
+                                                   0,
+                                                   0,
+                                                   0,
+                                                   1))
+
+        pass
+
 
 class TestGaussianGammaISO(TestCase):
     """
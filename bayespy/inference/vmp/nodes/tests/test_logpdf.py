@@ -0,0 +1,135 @@
+######################################################################
+# Copyright (C) 2015 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for `logpdf` module.
+"""
+
+import warnings
+warnings.simplefilter("error")
+
+import numpy as np
+
+from bayespy.nodes import (GaussianARD,
+                           Gamma,
+                           Categorical,
+                           Gate,
+                           SumMultiply,
+                           LogPDF)
+
+from bayespy.utils.misc import TestCase
+
+
+class TestLogPDF(TestCase):
+    """
+    Unit tests for the black-box messages of LogPDF
+    """
+
+
+    def test_message_to_parent(self):
+        """
+        Test the message from LogPDF to its parents
+        """
+
+        # A log density which is linear in the sufficient statistics of the
+        # parent is regressed exactly, thus the messages equal the messages of
+        # the conjugate node
+
+        # Gaussian parent
+        np.random.seed(1)
+        y = np.random.randn(5)
+        X = GaussianARD(2, 3, plates=(4,1))
+        Y = LogPDF(lambda y, x: -0.5*(y-x)**2,
+                   X,
+                   shape=(),
+                   plates=(4,5))
+        Y.observe(y * np.ones((4,5)))
+        m = X._message_from_children()
+        self.assertAllClose(m[0], np.sum(y) * np.ones((4,1)))
+        self.assertAllClose(m[1], -0.5*5 * np.ones((4,1)))
+
+        # Gamma parent, evaluated in batches
+        tau = Gamma(2, 3)
+        Y = LogPDF(lambda y, tau: 0.5*np.log(tau) - 0.5*tau*y**2,
+                   tau,
+                   shape=(),
+                   plates=(5,),
+                   samples=20,
+                   batch_size=7)
+        Y.observe(y)
+        m = tau._message_from_children()
+        self.assertAllClose(m[0], -0.5*np.sum(y**2))
+        self.assertAllClose(m[1], 0.5*5)
+
+        # Deterministic parent with Gaussian moments
+        C = GaussianARD(np.random.randn(3,1,2), 1, shape=(2,), plates=(3,1))
+        X = GaussianARD(np.random.randn(1,4,2), 1, shape=(2,), plates=(1,4))
+        F = SumMultiply('i,i', C, X)
+        y = np.random.randn(3,4)
+        Y = LogPDF(lambda y, f: -0.5*(y-f)**2, F, shape=(), samples=20)
+        Y.observe(y)
+        m = Y._message_to_parent(0)
+        self.assertAllClose(m[0], y)
+        self.assertAllClose(m[1], -0.5*np.ones((3,4)))
+
+        # Masked plates do not send messages
+        X = GaussianARD(2, 3, plates=(4,))
+        Y = LogPDF(lambda y, x: -0.5*(y-x)**2, X, shape=(), plates=(4,))
+        Y.observe(np.ones(4), mask=[True, False, True, False])
+        m = X._message_from_children()
+        self.assertAllClose(m[0], [1, 0, 1, 0])
+        self.assertAllClose(m[1], [-0.5, 0, -0.5, 0])
+
+        # Deterministic parents without Gaussian moments cannot be sampled
+        tau = Gate(Categorical([0.5, 0.5]), Gamma(2, 3, plates=(2,)))
+        self.assertRaises(ValueError,
+                          LogPDF,
+                          lambda y, tau: -0.5*tau*y**2,
+                          tau,
+                          shape=())
+
+        pass
+
+
+    def test_lower_bound_contribution(self):
+        """
+        Test the Monte Carlo estimate of the lower bound term of LogPDF
+        """
+
+        np.random.seed(1)
+        y = np.random.randn(5)
+        X = GaussianARD(2, 3)
+        Y = LogPDF(lambda y, x: -0.5*np.log(2*np.pi) - 0.5*(y-x)**2,
+                   X,
+                   shape=(),
+                   plates=(5,),
+                   samples=100000,
+                   batch_size=10000)
+        Y.observe(y)
+        Z = GaussianARD(X, 1, plates=(5,))
+        Z.observe(y)
+        self.assertAllClose(Y.lower_bound_contribution(),
+                            Z.lower_bound_contribution(),
+                            rtol=1e-2)
+
+        pass
@@ -28,9 +28,12 @@ Unit tests for mixture module.
 import warnings
 warnings.simplefilter("error")
 
+
 import numpy as np
 
 from bayespy.nodes import (GaussianARD,
+                           Gaussian,
+                           Wishart,
                            Gamma,
                            Mixture,
                            Categorical,
@@ -227,6 +230,59 @@ class TestMixture(TestCase):
         pass
 
 
+    def test_gaussian_mixture(self):
+        """
+        Test the messages of Gaussian mixture
+        """
+
+        N = 5
+        K = 3
+        D = 2
+        np.random.seed(42)
+        z = Categorical(np.random.dirichlet(np.ones(K), size=N))
+        Mu = Gaussian(np.random.randn(K,D), np.identity(D), plates=(K,))
+        Lambda = Wishart(D+1, np.identity(D), plates=(K,))
+        X = Mixture(z, Gaussian, Mu, Lambda)
+        x = np.random.randn(N,D)
+        X.observe(x)
+        p = z._message_to_child()[0]
+        (mu, mumu) = Mu._message_to_child()
+        (L, logdet_L) = Lambda._message_to_child()
+        L = L * np.ones((K,D,D))
+        logdet_L = logdet_L * np.ones(K)
+
+        # Message to the cluster assignments
+        m = z._message_from_children()
+        self.assertAllClose(m[0],
+                            np.einsum('ni,kij,kj->nk', x, L, mu)
+                            - 0.5 * np.einsum('ni,kij,nj->nk', x, L, x)
+                            - 0.5 * np.einsum('kij,kij->k', L, mumu)
+                            + 0.5 * logdet_L)
+
+        # Message to the cluster means
+        m = Mu._message_from_children()
+        self.assertAllClose(m[0],
+                            np.einsum('nk,kij,nj->ki', p, L, x))
+        self.assertAllClose(m[1],
+                            -0.5 * np.einsum('nk,kij->kij', p, L))
+
+        # Message to the cluster precisions
+        m = Lambda._message_from_children()
+        xx = x[:,:,None] * x[:,None,:]
+        xmu = x[:,None,:,None] * mu[None,:,None,:]
+        self.assertAllClose(m[0],
+                            -0.5 * np.einsum('nk,nkij->kij',
+                                             p,
+                                             xx[:,None]
+                                             - xmu
+                                             - np.swapaxes(xmu, -1, -2)
+                                             + mumu[None]))
+        self.assertAllClose(m[1],
+                            0.5 * np.sum(p, axis=0))
+
+        pass
+
+
     def test_lowerbound(self):
         """
         Test log likelihood lower bound for Mixture node
@@ -298,8 +354,10 @@ class TestMixture(TestCase):
             p1 = [1.0, 0.0]
             X = Mixture(0, Multinomial, 10, [p0, p1])
             u = X._message_to_child()
+            # Hard assignments only use the parameters of the assigned
+            # cluster, thus 0*(-inf) does not produce nans
             self.assertAllClose(u[0],
-                                np.nan*np.ones(2))
+                                [1, 9])
 
         
         pass
@@ -319,3 +377,200 @@ class TestMixture(TestCase):
 
         pass
 
+
+    def test_top_k(self):
+        """
+        Test truncated responsibilities in Mixture node
+        """
+
+        K = 4
+        p = np.array([[0.1, 0.6, 0.25, 0.05],
+                      [0.5, 0.2, 0.15, 0.15]])
+        mu = np.array([-2.0, 0.0, 1.0, 3.0])
+
+        # Keeping all clusters equals the full mixture
+        X = Mixture(Categorical(p), GaussianARD, mu, 1)
+        Y = Mixture(Categorical(p), GaussianARD, mu, 1, top_k=K)
+        X.observe([1, 2])
+        Y.observe([1, 2])
+        self.assertAllClose(X.lower_bound_contribution(),
+                            Y.lower_bound_contribution())
+        self.assertAllClose(Y.truncation_error(), 0)
+
+        # Keep two clusters per point
+        X = Mixture(Categorical(p), GaussianARD, mu, 1, top_k=2)
+        (x, xx) = X._message_to_child()
+        self.assertAllClose(x,
+                            [(0.6*0.0 + 0.25*1.0) / 0.85,
+                             (0.5*(-2.0) + 0.2*0.0) / 0.7])
+
+        # Threshold
+        X = Mixture(Categorical(p), GaussianARD, mu, 1, min_responsibility=0.22)
+        (x, xx) = X._message_to_child()
+        self.assertAllClose(x,
+                            [(0.6*0.0 + 0.25*1.0) / 0.85,
+                             -2.0])
+
+        # Messages to the cluster parameters use the truncated weights
+        Mu = GaussianARD(0, 1, plates=(K,))
+        X = Mixture(Categorical(p), GaussianARD, Mu, 1, top_k=2)
+        X.observe([1, 2])
+        m = Mu._message_from_children()
+        self.assertAllClose(m[0],
+                            [0.5/0.7*2, 0.6/0.85*1 + 0.2/0.7*2, 0.25/0.85*1, 0])
+        self.assertAllClose(m[1],
+                            -0.5 * np.array([0.5/0.7,
+                                             0.6/0.85 + 0.2/0.7,
+                                             0.25/0.85,
+                                             0]))
+
+        # Messages with masks, plates and a non-last cluster plate axis equal
+        # the sums over the truncated responsibilities
+        np.random.seed(1)
+        p = np.random.dirichlet(np.ones(K), size=(3,5))
+        y = np.random.randn(3,5)
+        mask = np.random.rand(3,5) > 0.3
+        Mu = GaussianARD(0, 1, plates=(K,1))
+        Tau = Gamma(1, 1, plates=(3,K,1))
+        X = Mixture(Categorical(p), GaussianARD, Mu, Tau,
+                    cluster_plate=-2, top_k=2)
+        X.observe(y, mask=mask)
+        w = np.zeros((3,5,K))
+        np.put_along_axis(w,
+                          *X._distribution.truncate_responsibilities(p),
+                          axis=-1)
+        w = w * mask[...,None]
+        tau = Tau.u[0][...,0]
+        (m_mu, m_mumu) = (Mu.u[0][:,0], Mu.u[1][:,0])
+        m = Mu._message_from_children()
+        self.assertAllClose(m[0][:,0],
+                            np.einsum('ink,ik,in->k', w, tau, y))
+        self.assertAllClose(m[1][:,0],
+                            -0.5 * np.einsum('ink,ik->k', w, tau))
+        t = Tau._message_from_children()
+        self.assertAllClose(t[0][...,0],
+                            -0.5 * np.einsum('ink,ink->ik',
+                                             w,
+                                             y[...,None]**2
+                                             - 2*y[...,None]*m_mu
+                                             + m_mumu))
+        self.assertAllClose(t[1][...,0],
+                            0.5 * np.sum(w, axis=1))
+
+        # Large number of clusters
+        (N, K) = (10000, 500)
+        p = np.random.dirichlet(np.ones(K), size=N)
+        Mu = GaussianARD(0, 1, plates=(K,))
+        X = Mixture(Categorical(p), GaussianARD, Mu, 1, top_k=2)
+        X.observe(np.random.randn(N))
+        m = X._message_to_parent(1)
+        p_truncated = np.zeros((N, K))
+        np.put_along_axis(p_truncated,
+                          *X._distribution.truncate_responsibilities(p),
+                          axis=-1)
+        y = X.u[0]
+        self.assertAllClose(m[0], np.sum(p_truncated * y[:,None], axis=0))
+        self.assertAllClose(m[1], -0.5 * np.sum(p_truncated, axis=0))
+
+        # Messages to the cluster assignments are not truncated
+        K = 4
+        p = np.array([[0.1, 0.6, 0.25, 0.05],
+                      [0.5, 0.2, 0.15, 0.15]])
+        z = Categorical(p)
+        X = Mixture(z, GaussianARD, mu, 1, top_k=1)
+        X.observe([1, 2])
+        m = z._message_from_children()
+        self.assertAllClose(m[0],
+                            -0.5*(np.array([[1], [2]]) - mu)**2)
+
+        # Bound error
+        X = Mixture(Categorical(p), GaussianARD, mu, 1, top_k=2)
+        X.observe([1, 2])
+        L_truncated = X.lower_bound_contribution()
+        X_full = Mixture(Categorical(p), GaussianARD, mu, 1)
+        X_full.observe([1, 2])
+        L_full = X_full.lower_bound_contribution()
+        self.assertAllClose(X.truncation_error(),
+                            L_truncated - L_full)
+        self.assertAllClose(X.lower_bound_contribution(),
+                            L_truncated)
+
+        pass
+
+
+    def test_hard_assignment(self):
+        """
+        Test messages from Mixture node with hard cluster assignments
+        """
+
+        np.random.seed(42)
+        (N, K) = (200, 5)
+        z = Categorical(np.random.dirichlet(np.ones(K), size=N))
+        Mu = GaussianARD(0, 1, plates=(K,))
+        X = Mixture(z, GaussianARD, Mu, 1)
+        y = np.random.randn(N)
+        X.observe(y)
+        z.set_hard_assignment()
+        z.update()
+        self.assertAllClose(np.amax(z.u[0], axis=-1), np.ones(N))
+
+        # The dense messages of all clusters are not weighted and summed
+        def fail(*args, **kwargs):
+            raise AssertionError("Dense message formed")
+        X._distribution.compute_message_to_parent = fail
+        m = X._message_to_parent(1)
+        self.assertAllClose(m[0], np.einsum('nk,n->k', z.u[0], y))
+        self.assertAllClose(m[1], -0.5 * np.sum(z.u[0], axis=0))
+
+        # Soft assignments use the dense messages
+        del X._distribution.compute_message_to_parent
+        z.set_hard_assignment(False)
+        z.update()
+        X._distribution.compute_message_to_parent = fail
+        self.assertRaises(AssertionError, X._message_to_parent, 1)
+
+        pass
+
+
+    def test_get_predictive_logpdf(self):
+        """
+        Test scoring new observations of Mixture node
+        """
+
+        np.random.seed(1)
+        K = 3
+        alpha = np.random.rand(K) + 1
+        mu = np.random.randn(K)
+        tau = np.random.rand(K) + 1
+        z = Categorical(np.ones(K)/K, plates=(5,))
+        X = Mixture(z, GaussianARD, mu, tau)
+        z.update()
+        z_parent = z.parents[0]
+        children = set(z_parent.children)
+
+        # The cluster assignments of the new observations are integrated out
+        x = np.random.randn(6)
+        logpdf = X.get_predictive_logpdf(batch_size=4)
+        self.assertAllClose(logpdf(x),
+                            np.log(np.sum(np.exp(random.gaussian_logpdf(
+                                tau*(x[:,None] - mu)**2,
+                                0,
+                                0,
+                                np.log(tau),
+                                1)) / K, axis=-1)))
+
+        # The graph is not modified
+        self.assertEqual(set(z_parent.children), children)
+
+        # Masked plates are zero
+        self.assertAllClose(logpdf(x, mask=[True, False]*3)[1::2], np.zeros(3))
+
+        # Cluster parameters and assignments varying along the plates
+        mu = np.random.randn(6, K)
+        p = np.random.dirichlet(np.ones(K), size=6)
+        X = Mixture(Categorical(p), GaussianARD, mu, 1)
+        self.assertAllClose(X.get_predictive_logpdf(batch_size=4)(x),
+                            X.get_predictive_logpdf()(x))
+
+        pass
+
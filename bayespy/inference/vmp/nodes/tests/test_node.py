@@ -443,6 +443,51 @@ class TestNode(misc.TestCase):
         pass
 
 
+    def test_validate_once(self):
+        """
+        Test skipping the shape checks after they have passed
+        """
+
+        from bayespy.nodes import GaussianARD
+
+        X = GaussianARD(0, 1, plates=(3,))
+        Y = GaussianARD(X, 1)
+        Y.observe(np.random.randn(3))
+        Q = VB(Y, X)
+        Q.set_validate_once()
+        self.assertTrue(X.validate_once)
+        self.assertFalse(X._is_validated('moments'))
+
+        X.update()
+        X._message_to_child()
+        self.assertTrue(X._is_validated('moments'))
+        self.assertTrue(X._is_validated('messages'))
+        self.assertTrue(X._is_validated('phi'))
+        self.assertTrue(X._is_validated('set_moments'))
+
+        # Validated moments are copied into the same array
+        u = X.u[0]
+        X.update()
+        self.assertIs(X.u[0], u)
+        X2 = GaussianARD(0, 1, plates=(3,))
+        Y2 = GaussianARD(X2, 1)
+        Y2.observe(Y.get_moments()[0])
+        X2.update()
+        self.assertAllClose(X.u[0], X2.u[0])
+        self.assertAllClose(X.u[1], X2.u[1])
+
+        # New children require validating again
+        Z = GaussianARD(X, 1)
+        self.assertFalse(X._is_validated('messages'))
+
+        # Without the mode, checks are always run
+        X.set_validate_once(False)
+        X._message_to_child()
+        self.assertFalse(X._is_validated('moments'))
+
+        pass
+
+
 class TestSlice(misc.TestCase):
 
     def test_init(self):
@@ -52,6 +52,8 @@ class WishartMoments(Moments):
 
     def compute_fixed_moments(self, Lambda):
         """ Compute moments for fixed x. """
+        if isinstance(Lambda, linalg.DiagonalPlusLowRank):
+            return [Lambda, Lambda.logdet()]
         ldet = linalg.chol_logdet(linalg.chol(Lambda))
         u = [Lambda,
              ldet]
@@ -87,6 +89,10 @@ class WishartDistribution(ExponentialFamilyDistribution):
     """
 
 
+    def __init__(self):
+        self.cholesky_cache = linalg.CholeskyCache()
+        super().__init__()
+
     def compute_message_to_parent(self, parent, index, u_self, *u_parents):
         raise NotImplementedError()
 
@@ -121,7 +127,7 @@ class WishartDistribution(ExponentialFamilyDistribution):
             \\
             g(\phi) = \phi_2 \log|-\phi_1| - \log \Gamma_k(\phi_2)
         """
-        U = linalg.chol(-phi[0])
+        U = self.cholesky_cache.chol(lambda: -phi[0])
         k = np.shape(phi[0])[-1]
         #k = self.dims[0][0]
         logdet_phi0 = linalg.chol_logdet(U)
@@ -28,6 +28,8 @@ Unit tests for `transformations` module.
 import warnings
 warnings.simplefilter("error")
 
+import threading
+
 import numpy as np
 
 from bayespy.inference.vmp.nodes.gaussian import GaussianARD
@@ -35,12 +37,15 @@ from bayespy.inference.vmp.nodes.gaussian import Gaussian
 from bayespy.inference.vmp.nodes.gamma import Gamma
 from bayespy.inference.vmp.nodes.wishart import Wishart
 from bayespy.inference.vmp.nodes.dot import SumMultiply
+from bayespy.inference.vmp.vmp import VB
 from bayespy.inference.vmp.nodes.gaussian_markov_chain import GaussianMarkovChain
 
 from bayespy.utils import linalg
 from bayespy.utils import random
 from bayespy.utils import optimize
 
+from ..transformations import RotationOptimizer
+from ..transformations import RotateMultiple
 from ..transformations import RotateGaussianARD
 from ..transformations import RotateGaussianMarkovChain
 from ..transformations import RotateVaryingMarkovChain
@@ -64,7 +69,7 @@ class TestRotateGaussianARD(TestCase):
                  mu=3):
 
             if plate_axis is not None:
-                precomputes = [False, True]
+                precomputes = [False, True, None]
             else:
                 precomputes = [False]
                 
@@ -322,7 +327,7 @@ class TestRotateGaussianARD(TestCase):
                  mu=3):
             
             if plate_axis is not None:
-                precomputes = [False, True]
+                precomputes = [False, True, None]
             else:
                 precomputes = [False]
                 
@@ -1205,3 +1210,92 @@ class TestRotateVaryingMarkovChain(TestCase):
 
         pass
 
+
+class TestRotationOptimizer(TestCase):
+
+    def test_warm_start(self):
+        """
+        Test rotation optimization with curvature kept between calls
+        """
+
+        np.random.seed(42)
+        (M, N, D) = (4, 10, 2)
+        alpha = Gamma(1e-3, 1e-3, plates=(D,))
+        X = GaussianARD(0, 1, shape=(D,), plates=(1,N))
+        W = GaussianARD(0, alpha, shape=(D,), plates=(M,1))
+        Y = GaussianARD(SumMultiply('d,d', W, X), 10)
+        Y.observe(np.random.randn(M,N))
+        Q = VB(Y, W, X, alpha)
+        X.initialize_from_random()
+        R = RotationOptimizer(RotateGaussianARD(W, alpha),
+                              RotateGaussianARD(X),
+                              D,
+                              warm_start=True)
+        self.assertRaises(ValueError,
+                          RotationOptimizer,
+                          RotateGaussianARD(W, alpha),
+                          RotateGaussianARD(X),
+                          D,
+                          method='CG',
+                          warm_start=True)
+        for i in range(3):
+            Q.update(repeat=1, verbose=False)
+            L0 = Q.compute_lowerbound()
+            R.rotate(maxiter=10)
+            L1 = Q.compute_lowerbound()
+            self.assertGreaterEqual(L1, L0 - 1e-8)
+            self.assertEqual(np.shape(R.H), (D*D, D*D))
+        R.reset()
+        self.assertIsNone(R.H)
+
+        pass
+
+
+class TestRotateMultiple(TestCase):
+
+    def test_threads(self):
+        """
+        Test that threaded rotation blocks give the serial results
+        """
+
+        np.random.seed(42)
+        D = 3
+
+        def blocks():
+            rotators = []
+            for plates in [(4,), (5,2), (6,)]:
+                alpha = Gamma(2, 3, plates=plates[-1:]+(D,))
+                X = GaussianARD(0, alpha, shape=(D,), plates=plates)
+                Y = GaussianARD(X, 1)
+                Y.observe(np.random.randn(*(plates+(D,))))
+                X.update()
+                alpha.update()
+                rotators.append(RotateGaussianARD(X, alpha))
+            return rotators
+
+        R = random.covariance(D) + np.random.randn(D,D)
+        invR = np.linalg.inv(R)
+        logdetR = np.linalg.slogdet(R)[1]
+
+        np.random.seed(1)
+        serial = RotateMultiple(*blocks())
+        serial.setup()
+        (b0, db0) = serial.bound(R, logdet=logdetR, inv=invR)
+        serial.rotate(R, logdet=logdetR, inv=invR)
+        u0 = [rotator.node_X.u[0] for rotator in serial.rotators]
+
+        np.random.seed(1)
+        threaded = RotateMultiple(*blocks(), n_threads=2)
+        threaded.setup()
+        n = threading.active_count()
+        (b1, db1) = threaded.bound(R, logdet=logdetR, inv=invR)
+        self.assertEqual(threading.active_count(), n)
+        threaded.rotate(R, logdet=logdetR, inv=invR)
+        u1 = [rotator.node_X.u[0] for rotator in threaded.rotators]
+
+        self.assertEqual(b0, b1)
+        self.assertArrayEqual(db0, db1)
+        for (x0, x1) in zip(u0, u1):
+            self.assertArrayEqual(x0, x1)
+
+        pass
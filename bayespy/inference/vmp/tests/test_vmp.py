@@ -0,0 +1,535 @@
+######################################################################
+# Copyright (C) 2015 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for `vmp` module.
+"""
+
+import warnings
+warnings.simplefilter("error")
+
+import os
+import numpy as np
+
+from bayespy.nodes import (GaussianARD,
+                           Gaussian,
+                           Wishart,
+                           Gamma,
+                           Dirichlet,
+                           Categorical,
+                           CategoricalMarkovChain,
+                           Mixture)
+
+from ..vmp import VB
+from ..vmp import run_restarts
+
+from bayespy.utils.misc import TestCase
+
+
+class TestVB(TestCase):
+
+    def test_random(self):
+        """
+        Test joint sampling of models
+        """
+
+        # Latent nodes are sampled from the posterior approximation and
+        # observed nodes from the conditional distribution
+        np.random.seed(42)
+        mu = GaussianARD(0, 1e-6, plates=(2,))
+        mu.initialize_from_parameters([-10, 10], 1e6)
+        tau = Gamma(1e5, 1e1)
+        Z = Categorical([0.5, 0.5], plates=(3,))
+        Y = Mixture(Z, GaussianARD, mu, tau)
+        Y.observe([1, 2, 3])
+        Q = VB(Y, Z, mu, tau)
+        (y, z, m) = Q.random(Y, Z, mu, samples=1000)
+        self.assertEqual(np.shape(y), (1000, 3))
+        self.assertEqual(np.shape(z), (1000, 3))
+        self.assertEqual(np.shape(m), (1000, 2))
+        self.assertAllClose(np.mean(z, axis=0), [0.5, 0.5, 0.5], atol=0.1)
+        self.assertAllClose(y, np.array([-10, 10])[z], atol=0.05)
+        self.assertAllClose(m, np.ones((1000, 1)) * [-10, 10], atol=0.05)
+
+        # All stochastic nodes by default
+        x = Q.random(samples=5)
+        self.assertEqual(len(x), 4)
+
+        # Partly observed nodes: latent plates from the posterior
+        # approximation, observed plates from the conditional distribution
+        mu = GaussianARD(0, 1e-6)
+        mu.initialize_from_parameters(10, 1e6)
+        Y = GaussianARD(mu, 1e6, plates=(3,))
+        Y.observe([0, 0, 0], mask=[True, False, True])
+        Y.initialize_from_parameters(-10, 1e6)
+        Q = VB(Y, mu)
+        (y, m) = Q.random(Y, mu, samples=100)
+        self.assertEqual(np.shape(y), (100, 3))
+        self.assertAllClose(m, 10*np.ones(100), atol=0.05)
+        self.assertAllClose(y[:,0], 10*np.ones(100), atol=0.05)
+        self.assertAllClose(y[:,1], -10*np.ones(100), atol=0.05)
+        self.assertAllClose(y[:,2], 10*np.ones(100), atol=0.05)
+
+        # Markov chain
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            Z = CategoricalMarkovChain([1, 0],
+                                       [[0, 1],
+                                        [1, 0]],
+                                       states=4)
+            Y = Mixture(Z, GaussianARD, [-10, 10], 1e6)
+            Y.observe(np.zeros(4))
+            Q = VB(Y, Z)
+            (y, z) = Q.random(Y, Z, samples=2)
+        self.assertArrayEqual(z, [[0, 1, 0, 1],
+                                  [0, 1, 0, 1]])
+        self.assertAllClose(y, [[-10, 10, -10, 10],
+                                [-10, 10, -10, 10]],
+                            atol=0.05)
+
+        pass
+
+
+    def test_compile(self):
+        """
+        Test the compiled update schedule of VB
+        """
+
+        def model():
+            np.random.seed(1)
+            mu = GaussianARD(0, 1e-3, name='mu')
+            tau = Gamma(1e-3, 1e-3, name='tau')
+            X = GaussianARD(mu, tau, plates=(10,), name='X')
+            Y = GaussianARD(X, 1, name='Y')
+            Y.observe(np.random.randn(10))
+            return (Y, X, tau, mu)
+
+        # The order of the model
+        (Y, X, tau, mu) = model()
+        Q = VB(Y, X, tau, mu)
+        Q.compile()
+        self.assertEqual(Q._schedule, [Y, X, tau, mu])
+        self.assertIs(Q['X'], X)
+
+        # Explicit order
+        Q.compile('X', mu)
+        self.assertEqual(Q._schedule, [X, mu])
+
+        # Compiled iterations give the same result as dynamic ones
+        Q.compile()
+        Q.update(repeat=5, verbose=False)
+        Q.decompile()
+        self.assertIsNone(X._edge_plans)
+        (Y, X, tau, mu) = model()
+        R = VB(Y, X, tau, mu)
+        R.update(repeat=5, verbose=False)
+        self.assertAllClose(Q.L[:5], R.L[:5])
+
+        pass
+
+
+    def test_set_buffer_reuse(self):
+        """
+        Test in-place updates with preallocated arrays
+        """
+
+        def run(reuse):
+            np.random.seed(3)
+            mu = Gaussian(np.zeros(2), 1e-3*np.identity(2),
+                          plates=(3,), name='mu')
+            Lambda = Wishart(2, np.identity(2), plates=(3,), name='Lambda')
+            Z = Categorical(np.ones(3)/3, plates=(20,), name='Z')
+            Y = Mixture(Z, Gaussian, mu, Lambda, name='Y')
+            Y.observe(np.random.randn(20, 2))
+            Z.initialize_from_random()
+            Q = VB(Y, mu, Lambda, Z)
+            Q.set_buffer_reuse(reuse)
+            Q.update(repeat=2, verbose=False)
+            phi = mu.phi[1]
+            Q.set_annealing(0.9)
+            Q.update(repeat=3, verbose=False)
+            return (Q, phi is mu.phi[1])
+
+        (Q, reused) = run(False)
+        self.assertFalse(reused)
+        (R, reused) = run(True)
+        self.assertTrue(reused)
+        self.assertAllClose(R.L[:5], Q.L[:5])
+        self.assertAllClose(R['mu'].u[1], Q['mu'].u[1])
+
+        # The returned messages are not overwritten by the next call
+        mu = R['mu']
+        m = mu._message_from_children()
+        m0 = [np.copy(m_i) for m_i in m]
+        R['Z'].initialize_from_random()
+        self.assertFalse(np.allclose(mu._message_from_children()[0], m0[0]))
+        self.assertAllClose(m[0], m0[0])
+        self.assertAllClose(m[1], m0[1])
+
+        pass
+
+
+    def test_update_accelerate(self):
+        """
+        Test SQUAREM accelerated updates
+        """
+
+        def model():
+            np.random.seed(2)
+            mu = GaussianARD(0, 1e-3, name='mu')
+            tau = Gamma(1e-3, 1e-3, name='tau')
+            Y = GaussianARD(mu, tau, plates=(100,), name='Y')
+            Y.observe(3 + 0.1*np.random.randn(100))
+            return VB(Y, mu, tau)
+
+        Q = model()
+        Q.update(repeat=200, tol=1e-12, verbose=False)
+        R = model()
+        R.update(repeat=20, tol=1e-12, verbose=False, accelerate=True)
+
+        # The bound does not decrease and the same optimum is found faster
+        L = R.L[:R.iter+1]
+        self.assertTrue(np.all(np.diff(L) > -1e-8))
+        self.assertLess(R.iter, Q.iter)
+        self.assertAllClose(L[-1], Q.L[Q.iter])
+        self.assertAllClose(R['mu'].u[0], Q['mu'].u[0])
+
+        # Failed decompositions reject the extrapolation but other errors
+        # propagate
+        R = model()
+        schedule = R._compute_schedule(R.model)
+        R._squarem_step(schedule)
+        set_parameters = R.set_parameters
+        calls = []
+        def failing(p, *nodes):
+            calls.append(p)
+            if len(calls) == 1:
+                raise np.linalg.LinAlgError()
+            set_parameters(p, *nodes)
+        R.set_parameters = failing
+        R._squarem_step(schedule)
+        self.assertGreater(len(calls), 1)
+        def failing(p, *nodes):
+            raise KeyError()
+        R.set_parameters = failing
+        self.assertRaises(KeyError, R._squarem_step, schedule)
+
+        pass
+
+
+    def test_parameter_vector(self):
+        """
+        Test the flat parameter vector and optimization with scipy
+        """
+
+        def model():
+            np.random.seed(4)
+            mu = GaussianARD(0, 1e-3, shape=(2,), name='mu')
+            tau = Gamma(1e-3, 1e-3, plates=(2,), name='tau')
+            Y = GaussianARD(mu, tau, plates=(50,), shape=(2,), name='Y')
+            Y.observe([3, -1] + np.random.randn(50, 2))
+            Q = VB(Y, mu, tau)
+            Q.update(repeat=1, verbose=False)
+            return Q
+
+        # Offset table and zero-copy views
+        Q = model()
+        mu = Q['mu']
+        phi = [np.copy(phi_i) for phi_i in mu.phi]
+        P = Q.get_parameter_vector('mu', 'tau')
+        self.assertEqual(P.size, 2 + 4 + 2 + 2)
+        self.assertEqual(P.offsets[0], [(0, 2, (2,)), (2, 6, (2, 2))])
+        self.assertTrue(np.shares_memory(mu.phi[1], P.x))
+        self.assertAllClose(P.x[:6], np.concatenate([np.ravel(p) for p in phi]))
+        x = P.get()
+        x[:2] = 0
+        P.set(x)
+        self.assertAllClose(mu.phi[0], np.zeros(2))
+        self.assertAllClose(mu.u[0], np.zeros(2))
+
+        # Gradient matches the gradients in the list format
+        (rg, g) = Q.get_gradients('mu', 'tau', euclidian=True)
+        self.assertAllClose(P.gradients(euclidian=True)[1],
+                            np.concatenate([np.ravel(g_ij)
+                                            for g_i in g for g_ij in g_i]))
+
+        # Optimization with a scipy solver finds the VB optimum
+        Q = model()
+        Q.update(repeat=1000, tol=1e-12, verbose=False)
+        R = model()
+        R.optimize('mu', collapsed=['tau'], method='L-BFGS-B', maxiter=100,
+                   tol=1e-12, verbose=False)
+        self.assertAllClose(R.compute_lowerbound(), Q.compute_lowerbound())
+        self.assertAllClose(R['mu'].u[0], Q['mu'].u[0], atol=1e-2)
+
+        pass
+
+
+    def test_replicates(self):
+        """
+        Test replicating a model along the leading plate axis
+        """
+
+        (K, N, C, D) = (3, 10, 2, 2)
+        np.random.seed(42)
+        y = np.random.randn(K, N, D) + 3*np.random.randn(K, 1, D)
+        mu0 = np.random.randn(K, C, D)
+
+        def model(y, mu0, plates=()):
+            alpha = Dirichlet(np.ones(C), plates=plates+(1,))
+            z = Categorical(alpha, plates=plates+(N,), name='z')
+            Lambda = Wishart(D, np.identity(D), plates=plates+(1,C))
+            mu = Gaussian(np.zeros(D), 1e-2*np.identity(D),
+                          plates=plates+(1,C))
+            mu.initialize_from_value(mu0)
+            tau = Gamma(1, 1, plates=plates+(1,C,D))
+            x = GaussianARD(0, tau, shape=(D,), plates=plates+(1,C))
+            Y = Mixture(z, Gaussian, mu, Lambda)
+            Y.observe(y)
+            return [Y, z, mu, Lambda, alpha, x, tau]
+
+        # All stochastic nodes must have the replicate axis
+        nodes = model(y, mu0[:,None], plates=(K,))
+        self.assertRaises(ValueError,
+                          VB,
+                          *nodes,
+                          Gamma(1, 1),
+                          replicates=K)
+
+        Q = VB(*nodes, replicates=K, tol=1e-6)
+        Q.update(repeat=100, verbose=False)
+        self.assertTrue(Q.converged)
+        self.assertFalse(np.any(Q.active_replicates))
+        L = Q.L_replicates[Q.iter]
+        self.assertAllClose(np.sum(L), Q.L[Q.iter])
+        self.assertAllClose(Q.compute_lowerbound(replicates=True), L)
+
+        # Each replicate gives the same result as a separate model
+        for k in range(K):
+            Qk = VB(*model(y[k], mu0[k]), tol=1e-6)
+            Qk.update(repeat=100, verbose=False)
+            self.assertAllClose(Qk.L[Qk.iter], L[k])
+            self.assertAllClose(nodes[1].u[0][k], Qk['z'].u[0])
+
+        # Replicate a template model
+        def template():
+            alpha = Dirichlet(np.ones(C))
+            z = Categorical(alpha, plates=(N,), name='z')
+            Lambda = Wishart(D, np.identity(D), plates=(C,))
+            mu = Gaussian(np.zeros(D), 1e-2*np.identity(D), plates=(C,),
+                          name='mu')
+            tau = Gamma(1, 1, plates=(C,D))
+            x = GaussianARD(0, tau, shape=(D,), plates=(C,))
+            Y = Mixture(z, Gaussian, mu, Lambda, name='Y')
+            return [Y, z, mu, Lambda, alpha, x, tau]
+        Q2 = VB.from_template(template, replicates=K, tol=1e-6)
+        self.assertEqual(Q2['Y'].plates, (K, N))
+        self.assertEqual(Q2['mu'].plates, (K, 1, C))
+        self.assertEqual(Q2['z'].plates, (K, N))
+        Q2['Y'].observe(y)
+        Q2['mu'].initialize_from_value(mu0[:,None])
+        Q2.update(repeat=100, verbose=False)
+        self.assertAllClose(Q2.L_replicates[Q2.iter], L)
+
+        # The arguments are recorded only for the template
+        self.assertIsNone(Gamma(1, 1)._constructor_args)
+        tau = Gamma(1, 1)
+        self.assertRaises(ValueError,
+                          VB.from_template,
+                          lambda: GaussianARD(0, tau, name='x'),
+                          replicates=K)
+
+        # The template needs replicates
+        self.assertRaises(ValueError, VB.from_template, template)
+
+        pass
+
+
+    def test_run_restarts(self):
+        """
+        Test running random restarts in parallel processes
+        """
+
+        np.random.seed(42)
+        (N, D, K) = (30, 2, 3)
+        y = np.random.randn(N, D) + 5*np.random.randn(K, D)[np.arange(N)%K]
+
+        def factory():
+            alpha = Dirichlet(np.ones(K), name='alpha')
+            z = Categorical(alpha, plates=(N,), name='z')
+            mu = Gaussian(np.zeros(D), 1e-3*np.identity(D), plates=(K,),
+                          name='mu')
+            Lambda = Wishart(D, np.identity(D), plates=(K,), name='Lambda')
+            Y = Mixture(z, Gaussian, mu, Lambda, name='Y')
+            Y.observe(y)
+            z.initialize_from_random()
+            return VB(Y, mu, Lambda, z, alpha)
+
+        (Q, L, best) = run_restarts(factory, 4, processes=2, seed=1,
+                                    early_stop=None)
+        self.assertEqual(len(L), 4)
+        self.assertEqual(best, np.argmax([l[-1] for l in L]))
+        self.assertAllClose(Q.compute_lowerbound(), L[best][-1])
+
+        # The same seed gives the same restarts
+        (Q, L2, best2) = run_restarts(factory, 4, processes=1, seed=1,
+                                      early_stop=None)
+        self.assertEqual(best, best2)
+        for (l, l2) in zip(L, L2):
+            self.assertAllClose(l, l2)
+
+        # Errors in the workers are raised
+        pid = os.getpid()
+        def fail():
+            if os.getpid() != pid:
+                raise ValueError()
+            return factory()
+        self.assertRaises(RuntimeError, run_restarts, fail, 2, processes=2)
+
+        pass
+
+
+    def test_anneal(self):
+        """
+        Test adaptive deterministic annealing
+        """
+
+        np.random.seed(42)
+        N = 100
+        z = np.random.rand(N) < 0.3
+
+        def model():
+            mu = GaussianARD(0, 1, plates=(2,), name='mu')
+            Z = Categorical([0.3, 0.7], plates=(N,), name='z')
+            Y = Mixture(Z, GaussianARD, mu, 1, name='y')
+            Y.observe(np.where(z, 4.0, -4.0))
+            # Initialize close to the local optimum with swapped means
+            mu.initialize_from_value([0, 6])
+            return (VB(Y, Z, mu), mu)
+
+        # Standard VB finds the inferior local optimum
+        (Q, mu) = model()
+        Q.update(repeat=100, verbose=False)
+        L_vb = Q.compute_lowerbound()
+        self.assertGreater(mu.u[0][1], 0)
+
+        # Annealing finds the global optimum
+        (Q, mu) = model()
+        Q.anneal(repeat=100, verbose=False)
+        self.assertTrue(Q.converged)
+        self.assertLess(Q.iter+1, 100)
+        for node in Q.model:
+            self.assertEqual(node.annealing, 1)
+        self.assertAllClose(mu.u[0], [4, -4], atol=0.2)
+        self.assertGreater(Q.compute_lowerbound(), L_vb)
+
+        # If the levels do not converge, the annealing is finished with a
+        # warning before the iterations run out
+        (Q, mu) = model()
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            Q.anneal(repeat=30, tol=1e-12, patience=2, verbose=False)
+        self.assertTrue(any("Annealing reached only" in str(wi.message)
+                            for wi in w))
+        self.assertLessEqual(Q.iter+1, 30)
+        for node in Q.model:
+            self.assertEqual(node.annealing, 1)
+
+        pass
+
+
+    def test_set_update_skipping(self):
+        """
+        Test skipping the updates of converged nodes
+        """
+
+        def model():
+            np.random.seed(42)
+            (N, D, K) = (50, 2, 3)
+            y = (np.random.randn(N, D)
+                 + 5*np.random.randn(K, D)[np.arange(N)%K])
+            alpha = Dirichlet(np.ones(K))
+            z = Categorical(alpha, plates=(N,))
+            mu = Gaussian(np.zeros(D), 1e-3*np.identity(D), plates=(K,))
+            Lambda = Wishart(D, np.identity(D), plates=(K,))
+            Y = Mixture(z, Gaussian, mu, Lambda)
+            Y.observe(y)
+            z.initialize_from_random()
+            nodes = [Y, z, mu, Lambda, alpha]
+            # Independent sub-models which converge quickly
+            for k in range(3):
+                m = GaussianARD(0, 1e-3)
+                tau = Gamma(1e-3, 1e-3)
+                X = GaussianARD(m, tau, plates=(100,))
+                X.observe(np.random.randn(100) + k)
+                nodes += [X, m, tau]
+            return VB(*nodes, tol=1e-8)
+
+        Q = model()
+        Q.update(repeat=200, verbose=False)
+        L = Q.compute_lowerbound()
+        self.assertTrue(np.all(Q.skipped_updates == 0))
+
+        Q = model()
+        Q.set_update_skipping(1e-4)
+        Q.update(repeat=200, verbose=False)
+        self.assertTrue(Q.converged)
+        self.assertGreater(np.sum(Q.skipped_updates), 0)
+        self.assertAllClose(Q.compute_lowerbound(), L)
+
+        # Disable skipping
+        Q.set_update_skipping(None)
+        Q.update(verbose=False)
+        self.assertEqual(Q.skipped_updates[Q.iter], 0)
+
+        pass
+
+
+    def test_update_residual(self):
+        """
+        Test residual-priority update scheduling
+        """
+
+        def model():
+            np.random.seed(42)
+            nodes = []
+            for k in range(3):
+                m = GaussianARD(0, 1e-3)
+                tau = Gamma(1e-3, 1e-3)
+                X = GaussianARD(m, tau, plates=(10*(k+1),))
+                X.observe(np.random.randn(10*(k+1)) + k)
+                nodes += [X, m, tau]
+            return VB(*nodes, tol=1e-12)
+
+        Q = model()
+        Q.update(repeat=100, verbose=False)
+        L = Q.compute_lowerbound()
+
+        Q = model()
+        Q.update_residual(repeat=100, residual_tol=1e-4, verbose=False)
+        self.assertTrue(Q.converged)
+        self.assertAllClose(Q.compute_lowerbound(), L)
+        # Some updates of the converged nodes are skipped
+        self.assertGreater(np.sum(Q.skipped_updates[:Q.iter+1]), 0)
+
+        pass
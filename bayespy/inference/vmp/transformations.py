@@ -24,6 +24,7 @@
 import numpy as np
 import warnings
 import scipy
+import concurrent.futures
 
 from bayespy.utils import optimize
 from bayespy.utils import random
@@ -58,6 +59,20 @@ class RotationOptimizer():
 
         Dimensionality of the latent space
 
+    method : str (optional)
+
+        Optimization method for SciPy's `minimize`.  By default, nonlinear
+        conjugate gradient 'CG' is used.
+
+    warm_start : bool (optional)
+
+        If True, the rotation is optimized with BFGS and the inverse Hessian
+        approximation is kept between successive calls of `rotate`.  The
+        previous optimal rotation has already been applied to the model, thus
+        each optimization starts from identity but the curvature is mapped
+        through the previous rotation.  Late in the VB iteration, the
+        rotation then converges in a few evaluations.
+
     References
     ----------
 
@@ -65,10 +80,23 @@ class RotationOptimizer():
 
     """
 
-    def __init__(self, block1, block2, D):
+    def __init__(self, block1, block2, D, method=None, warm_start=False):
         self.block1 = block1
         self.block2 = block2
         self.D = D
+        if warm_start and method not in (None, 'BFGS'):
+            raise ValueError("Warm start is supported only for BFGS")
+        if method is None:
+            method = 'BFGS' if warm_start else 'CG'
+        self.method = method
+        self.warm_start = warm_start
+        self.H = None
+
+    def reset(self):
+        """
+        Forget the curvature information of the previous rotations.
+        """
+        self.H = None
 
     def rotate(self, 
                maxiter=10, 
@@ -181,7 +209,16 @@ class RotationOptimizer():
             true_bound_terms_begin = get_true_bound_terms()
 
         # Run optimization
-        r = optimize.minimize(cost, r0, maxiter=maxiter, verbose=verbose)
+        if self.warm_start:
+            (r, H) = optimize.bfgs(cost, r0,
+                                   H=self.H,
+                                   maxiter=maxiter,
+                                   verbose=verbose)
+        else:
+            r = optimize.minimize(cost, r0,
+                                  maxiter=maxiter,
+                                  verbose=verbose,
+                                  method=self.method)
 
         (cost_end, _) = cost(r)
         if check_bound:
@@ -194,6 +231,13 @@ class RotationOptimizer():
         self.block1.rotate(R, inv=invR, logdet=logdetR)
         self.block2.rotate(invR.T, inv=R.T, logdet=-logdetR)
 
+        if self.warm_start:
+            # The next rotation S of the rotated model corresponds to the
+            # rotation S*R of the current model, thus map the curvature
+            # through vec(S*R) = kron(I, R.T) * vec(S)
+            J_inv = np.kron(I, invR.T)
+            self.H = dot(J_inv, H, J_inv.T)
+
         # Check that the cost function and the true lower bound changed equally
         cost_change = cost_end - cost_begin
         
@@ -405,14 +449,17 @@ class RotateGaussianARD():
     Requirements:
     * X and alpha do not contain any observed values
     """
-    def __init__(self, X, *alpha, axis=-1, precompute=False, subset=None):
+    def __init__(self, X, *alpha, axis=-1, precompute=None, subset=None):
         """
         Precompute tells whether to compute some moments once in the setup
         function instead of every time in the bound function.  However, they are
         computed a bit differently in the bound function so it can be useful
         too. Precomputation is probably beneficial only when there are large
         axes that are not rotated (by R nor Q) and they are not contained in the
-        plates of alpha, and the dimensions for R and Q are quite small.
+        plates of alpha, and the dimensions for R and Q are quite small.  If
+        None, the moments are precomputed whenever they take less memory than
+        the moments of X, so that the cost of the bound function does not
+        depend on the number of the plates that are summed over.
         """
         
         self.precompute = precompute
@@ -616,7 +663,16 @@ class RotateGaussianARD():
             mu2 = mu2 * np.ones(np.shape(X)[-2:])
             self.mu2 = sum_to_alpha(mu2, ndim=1)
 
-            if self.precompute:
+            precompute = self.precompute
+            if precompute is None:
+                # Precompute if the statistics are smaller than X itself
+                size_X_X = (np.prod(plates_alpha[:-2], dtype=int) *
+                            np.prod(np.shape(X)[-2:], dtype=int)**2)
+                precompute = (self.subset is None and
+                              size_X_X < np.size(X))
+            self._precomputed = precompute
+
+            if precompute:
                 # Precompute some stuff for the gradient of plate rotation
                 #
                 # NOTE: These terms may require a lot of memory if alpha has the
@@ -636,6 +692,7 @@ class RotateGaussianARD():
                 self.mu = mu
                     
         else:
+            self._precomputed = False
             # Sum axes that are not in the plates of alpha
             self.XX = sum_to_alpha(XX)
             self.mu2 = sum_to_alpha(mu2, ndim=1)
@@ -654,7 +711,7 @@ class RotateGaussianARD():
 
         # Take only a subset of the matrix for rotation
         if self.subset is not None:
-            if self.precompute:
+            if self._precomputed:
                 raise NotImplementedError("Precomputation not implemented when "
                                           "using a subset")
             # from X
@@ -738,7 +795,7 @@ class RotateGaussianARD():
             QCovQ = sumQ[:,None,None]**2 * self.CovX
             
             # Rotate plates
-            if self.precompute:
+            if self._precomputed:
                 QX_QX = np.einsum('...kalb,...ik,...il->...iab', self.X_X, Q, Q)
                 XX = QX_QX + QCovQ
                 XX = sum_to_plates(XX,
@@ -982,7 +1039,7 @@ class RotateGaussianARD():
                             self.CovX,
                             R, 
                             sumQ)
-        if self.precompute:
+        if self._precomputed:
             Xr_rX = np.einsum('...abcd,...jb,...jd->...jac', 
                                self.X_X, 
                                R, 
@@ -1239,6 +1296,7 @@ class RotateGaussianMarkovChain():
         
         self.X0 = X[...,0,:]
         self.X0X0 = XnXn[...,0,:,:]
+        self.plates_X0X0 = self.X_node.plates
         #self.XnXn = np.sum(XnXn[...,1:,:,:], axis=-3)
         self.XnXn = sum_to_plates(XnXn[...,1:,:,:],
                                   (),
@@ -1248,6 +1306,14 @@ class RotateGaussianMarkovChain():
         # Get moments of the fixed parameter nodes
         mu = self.X_node.parents[0].get_moments()[0]
         self.Lambda = self.X_node.parents[1].get_moments()[0]
+        if np.ndim(self.Lambda) == 2:
+            # The precision matrix is shared by all plates, thus sum the
+            # initial state moments over the plates already here
+            self.X0X0 = sum_to_plates(self.X0X0,
+                                      (),
+                                      plates_from=self.X_node.plates,
+                                      ndim=2)
+            self.plates_X0X0 = ()
         self.Lambda_mu_X0 = linalg.outer(np.einsum('...ik,...k->...i',
                                                    self.Lambda,
                                                    mu),
@@ -1301,7 +1367,7 @@ class RotateGaussianMarkovChain():
         
         Lambda_R_X0X0 = sum_to_plates(dot(self.Lambda, R, self.X0X0),
                                       (),
-                                      plates_from=self.X_node.plates,
+                                      plates_from=self.plates_X0X0,
                                       ndim=2)
         R_XnXn = dot(R, self.XnXn)
         RA_XpXp_A = dot(R, self.A_XpXp_A)
@@ -1594,10 +1660,20 @@ class RotateMultiple():
     
     Performs the same rotation for multiple nodes and combines the cost
     effect.
+
+    If `n_threads` is larger than one, the bounds of the rotators are
+    evaluated in a pool of that many threads, which is created for each
+    evaluation.  This is useful when the blocks are dominated by large NumPy
+    operations, which release the GIL.  The bound evaluation only reads the
+    nodes, whereas the setup and the rotation modify them and are thus run
+    serially.  The partial bounds and gradients are summed in the order of
+    the rotators, thus the result does not depend on the scheduling of the
+    threads.
     """
 
-    def __init__(self, *rotators):
+    def __init__(self, *rotators, n_threads=1):
         self.rotators = rotators
+        self.n_threads = n_threads
 
     def nodes(self):
         return [node
@@ -1615,9 +1691,17 @@ class RotateMultiple():
     def bound(self, R, logdet=None, inv=None):
         bound = 0
         dbound = 0
-        
-        for rotator in self.rotators:
-            (b, db) = rotator.bound(R, logdet=logdet, inv=inv)
+
+        def compute_bound(rotator):
+            return rotator.bound(R, logdet=logdet, inv=inv)
+        if self.n_threads > 1 and len(self.rotators) > 1:
+            with concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.n_threads) as executor:
+                bounds = list(executor.map(compute_bound, self.rotators))
+        else:
+            bounds = [compute_bound(rotator) for rotator in self.rotators]
+
+        for (b, db) in bounds:
             bound = bound + b
             dbound = dbound + db
 
@@ -29,10 +29,18 @@ import h5py
 import datetime
 import tempfile
 import scipy
+import os
+import queue
+import heapq
+import traceback
+import multiprocessing
 
 from bayespy.utils import misc
 
 from bayespy.inference.vmp.nodes.node import Node
+from bayespy.inference.vmp.nodes.stochastic import Stochastic
+from bayespy.inference.vmp.nodes.deterministic import Deterministic
+from bayespy.inference.vmp.nodes.expfamily import ExponentialFamily
 
 class VB():
     r"""
@@ -63,6 +71,18 @@ class VB():
 
         Function which is called after each update iteration step
 
+    replicates : int, optional
+
+        Number of independent replicates of the model.  The leading plate
+        axis of every stochastic node must be the replicate axis of this
+        length, thus also the hyperparameter nodes must be replicated.  As
+        plates are aligned from the right, the nodes need singleton plate
+        axes between the replicate axis and their own plates.  The lower
+        bound and the convergence are tracked for each replicate
+        separately (see `L_replicates` and `active_replicates`), and the
+        converged replicates are not updated anymore.  The iteration
+        converges when all replicates have converged.
+
     """
 
     def __init__(self,
@@ -70,7 +90,8 @@ class VB():
                  tol=1e-5, 
                  autosave_filename=None,
                  autosave_iterations=0, 
-                 callback=None):
+                 callback=None,
+                 replicates=None):
 
         for (ind, node) in enumerate(nodes):
             if not isinstance(node, Node):
@@ -111,6 +132,158 @@ class VB():
         self.callback_output = None
         self.tol = tol
 
+        # Set by compile
+        self._names = None
+        self._schedule = None
+
+        # Set by set_update_skipping
+        self._skip_tol = None
+        self._blankets = None
+        self._frozen = set()
+        self._changes = {}
+        self.skipped_updates = np.array((), dtype=int)
+
+        # Independent replicates of the model along the leading plate axis
+        self.replicates = replicates
+        if replicates is not None:
+            for node in self.model:
+                if (isinstance(node, Stochastic) and
+                    (len(node.plates) == 0 or node.plates[0] != replicates)):
+                    raise ValueError("The leading plate axis of node %s "
+                                     "should be the replicate axis of length "
+                                     "%d, but the plates are %s"
+                                     % (node.name, replicates, node.plates))
+            self.L_replicates = np.zeros((0, replicates))
+            self._set_active_replicates(np.ones(replicates, dtype=bool))
+
+    @classmethod
+    def from_template(cls, factory, replicates=None, **kwargs):
+        """
+        Construct independent replicates of a model template.
+
+        The template is built by calling `factory`, which returns the nodes of
+        the model.  The constructor arguments of the nodes are recorded only
+        while the factory is called.  The nodes and their ancestors are
+        constructed again with the same arguments but with a leading replicate
+        plate axis of length `replicates` for every node depending on some
+        stochastic node.
+        Singleton plate axes are added after the replicate axis so that the
+        replicate axes of all nodes are aligned.  Nodes that do not depend on
+        any stochastic node are shared by the replicates.  Observations and
+        initializations of the template are not copied, thus observe the
+        replicated nodes, which are found by their names, e.g., ``Q['Y']``.
+
+        The other keyword arguments are passed to the constructor of VB.
+        """
+
+        if replicates is None:
+            raise ValueError("The number of replicates must be given")
+
+        # Build the template and record the arguments of the nodes
+        Node._record_constructor_args = True
+        try:
+            nodes = factory()
+        finally:
+            Node._record_constructor_args = False
+        if isinstance(nodes, Node):
+            nodes = [nodes]
+
+        # Resolve the template graph
+        graph = []
+        visited = set()
+        def visit(node):
+            if node in visited:
+                return
+            visited.add(node)
+            for parent in node.parents:
+                visit(parent)
+            (args, kwargs_node) = node._constructor_args or ((), {})
+            for arg in list(args) + list(kwargs_node.values()):
+                if isinstance(arg, Node):
+                    visit(arg)
+            graph.append(node)
+        for node in nodes:
+            visit(node)
+
+        # The nodes depending on some stochastic node are replicated
+        replicated = set()
+        for node in graph:
+            if (isinstance(node, Stochastic) or
+                any(parent in replicated for parent in node.parents)):
+                replicated.add(node)
+
+        # Solve the number of plate axes of each replicated node so that the
+        # replicate axis of each parent is mapped to the replicate axis of the
+        # child.  A child may remove some plate axes of a parent (e.g., the
+        # cluster axis of a mixture), which is probed with a long plate tuple.
+        probe = 32 * (1,)
+        edges = {node: [] for node in replicated}
+        for child in replicated:
+            for (index, parent) in enumerate(child.parents):
+                if parent in replicated:
+                    mapped = child._compute_plates_from_parent(
+                        index,
+                        probe + parent.plates
+                    )
+                    delta = len(probe + parent.plates) - len(mapped)
+                    edges[child].append((parent, delta))
+                    edges[parent].append((child, -delta))
+        plates = {}
+        for node in graph:
+            if node not in replicated or node in plates:
+                continue
+            # Relative number of plate axes in the connected component
+            ndims = {node: 0}
+            stack = [node]
+            while stack:
+                x = stack.pop()
+                for (y, delta) in edges[x]:
+                    if y not in ndims:
+                        ndims[y] = ndims[x] + delta
+                        stack.append(y)
+                    elif ndims[y] != ndims[x] + delta:
+                        raise ValueError("The replicate axes of nodes %s and "
+                                         "%s cannot be aligned"
+                                         % (x.name, y.name))
+            # Each node has at least the replicate axis and its own plates
+            shift = max(1 + len(x.plates) - n for (x, n) in ndims.items())
+            for (x, n) in ndims.items():
+                plates[x] = ((replicates,)
+                             + (n + shift - 1 - len(x.plates)) * (1,)
+                             + x.plates)
+
+        # Construct the replicated nodes
+        new_nodes = {}
+        def construct(arg):
+            if isinstance(arg, (list, tuple)):
+                return type(arg)(construct(a) for a in arg)
+            if not isinstance(arg, Node) or arg not in replicated:
+                return arg
+            if arg in new_nodes:
+                return new_nodes[arg]
+            if arg._constructor_args is None:
+                raise ValueError("Node %s was not constructed by the template "
+                                 "factory, thus it cannot be replicated"
+                                 % arg.name)
+            (args, kwargs_node) = arg._constructor_args
+            args = [construct(a) for a in args]
+            kwargs_node = {key: construct(value)
+                           for (key, value) in kwargs_node.items()}
+            if isinstance(arg, Stochastic):
+                kwargs_node['plates'] = plates[arg]
+            node = type(arg)(*args, **kwargs_node)
+            if node.plates != plates[arg]:
+                raise ValueError("Node %s could not be replicated, its plates "
+                                 "are %s instead of %s"
+                                 % (arg.name, node.plates, plates[arg]))
+            new_nodes[arg] = node
+            return node
+
+        return cls(*[construct(node) for node in nodes],
+                   replicates=replicates,
+                   **kwargs)
+
+
     def set_autosave(self, filename, iterations=None):
         self.autosave_filename = filename
         self.filename = filename
@@ -121,45 +294,447 @@ class VB():
     def set_callback(self, callback):
         self.callback = callback
 
-    def update(self, *nodes, repeat=1, plot=False, tol=None, verbose=True):
+    def update(self, *nodes, repeat=1, plot=False, tol=None, verbose=True,
+               accelerate=False):
+        """
+        Update the nodes by coordinate ascent.
+
+        Parameters
+        ----------
+
+        nodes : nodes or node names, optional
+
+            Nodes to update in the given order.  By default, all nodes of the
+            model (in the compiled order if `compile` has been called).
+
+        repeat : int, optional
+
+            Number of iterations.
+
+        accelerate : bool, optional
+
+            Use SQUAREM extrapolation of the natural parameters.  Each
+            iteration consists of two plain sweeps, an extrapolation step and
+            a stabilizing sweep.  If the extrapolation does not improve the
+            lower bound, the result of the plain sweeps is used, thus the
+            bound never decreases.
+        """
 
         # TODO/FIXME:
         #
         # If no nodes are given and thus everything is updated, the update order
         # should be from down to bottom. Or something similar..
 
-        # By default, update all nodes
+        # By default, update all nodes (using the compiled schedule if
+        # available)
         if len(nodes) == 0:
-            nodes = self.model
+            if self._schedule is not None:
+                schedule = self._schedule
+            else:
+                schedule = self._compute_schedule(self.model)
+        else:
+            schedule = self._compute_schedule(nodes)
 
         converged = False
 
         for i in range(repeat):
 
-            t = time.clock()
+            t = time.process_time()
 
             # Update nodes
-            for node in nodes:
-                X = self[node]
-                if hasattr(X, 'update') and callable(X.update):
-                    X.update()
+            if accelerate:
+                self._squarem_step(schedule)
+                if plot:
+                    self.plot(*schedule)
+            else:
+                skipped = 0
+                for X in schedule:
+                    if X in self._frozen:
+                        skipped += 1
+                        continue
+                    if self._skip_tol is None:
+                        X.update()
+                    else:
+                        self._changes[X] = self._update_and_measure(X)
                     if plot:
                         self.plot(X)
+                if self._skip_tol is not None:
+                    self._update_frozen()
+
+            cputime = time.process_time() - t
+            method = 'SQUAREM' if accelerate else None
+            converged = self._end_iteration_step(method, cputime, tol=tol,
+                                                 verbose=verbose)
+            if self._skip_tol is not None and not accelerate:
+                self.skipped_updates[self.iter] = skipped
+                if verbose:
+                    print("Skipped %d of %d node updates"
+                          % (skipped, len(schedule)))
+            if converged:
+                return
+
+
+    def set_update_skipping(self, tol=1e-6):
+        """
+        Skip the updates of nodes that have converged.
+
+        The relative change of the natural parameters of each node is measured
+        in each update.  If it is below `tol`, the node is frozen, that is,
+        its updates are skipped.  A frozen node is re-activated when the
+        natural parameters of some node in its Markov blanket (stochastic
+        parents, children and co-parents) change more than `tol`.  The number
+        of skipped node updates in each iteration is stored in
+        `skipped_updates`.  Skipping applies to plain updates, not to
+        accelerated ones.
+
+        If `tol` is None, all nodes are updated as usual.  The graph must not
+        be modified while skipping is in use.  Call this method again after
+        changing observations, because that does not re-activate the frozen
+        nodes.
+        """
+        self._skip_tol = tol
+        self._frozen = set()
+        self._changes = {}
+        if tol is None:
+            self._blankets = None
+            return
+
+        self._blankets = self._compute_markov_blankets()
+        return
+
 
-            cputime = time.clock() - t
-            if self._end_iteration_step(None, cputime, tol=tol, verbose=verbose):
+    def _compute_markov_blankets(self):
+        """
+        Return the Markov blankets of the nodes of the model.
+
+        The blanket of a node consists of its stochastic parents, children and
+        co-parents, found through the deterministic nodes.
+        """
+        in_model = set(self.model)
+        def stochastic_parents(node, parents):
+            for parent in node.parents:
+                if parent in in_model and isinstance(parent, Stochastic):
+                    parents.add(parent)
+                else:
+                    stochastic_parents(parent, parents)
+            return parents
+        def stochastic_children(node, children):
+            for (child, index) in node.children:
+                if child in in_model and isinstance(child, Stochastic):
+                    children.add(child)
+                else:
+                    stochastic_children(child, children)
+            return children
+
+        parents = {node: stochastic_parents(node, set())
+                   for node in self.model}
+        blankets = {}
+        for node in self.model:
+            children = stochastic_children(node, set())
+            blanket = parents[node] | children
+            for child in children:
+                blanket |= parents.get(child, set())
+            blanket.discard(node)
+            blankets[node] = blanket
+        return blankets
+
+
+    def update_residual(self, *nodes, repeat=1, tol=None, residual_tol=1e-6,
+                        verbose=True):
+        """
+        Update the nodes in the order of their residuals.
+
+        Instead of sweeping the nodes in a fixed order, the nodes are kept in
+        a priority queue keyed by their residual, that is, the summed relative
+        change of the natural parameters of their Markov blanket since their
+        own last update.  The node with the largest residual is updated first,
+        as in residual belief propagation.  One iteration consists of as many
+        node updates as there are nodes to update, thus the iterations are
+        comparable to those of `update`.  Fully observed nodes are not
+        updated at all.  Nodes whose residual is below `residual_tol` are not
+        updated and the remaining updates of the iteration are skipped; they
+        are counted in `skipped_updates`.
+
+        Parameters
+        ----------
+
+        nodes : nodes or node names, optional
+
+            Nodes to update.  By default, all nodes of the model.  Each call
+            starts by updating all of them in the given order.
+
+        repeat : int, optional
+
+            Number of iterations.
+
+        residual_tol : float, optional
+
+            Residual below which a node is considered converged.
+        """
+        if len(nodes) == 0:
+            if self._schedule is not None:
+                schedule = self._schedule
+            else:
+                schedule = self._compute_schedule(self.model)
+        else:
+            schedule = self._compute_schedule(nodes)
+        # Updating fully observed nodes has no effect
+        schedule = [X for X in schedule
+                    if not np.all(getattr(X, 'observed', False))]
+        if len(schedule) == 0:
+            return
+
+        blankets = self._compute_markov_blankets()
+        position = {X: n for (n, X) in enumerate(schedule)}
+
+        # Nodes that have never been updated have infinite residuals
+        residuals = {X: np.inf for X in schedule}
+
+        for i in range(repeat):
+
+            t = time.process_time()
+
+            # The heap contains (-residual, position, node) entries.  Entries
+            # whose residual is out of date are discarded when popped, and the
+            # heap is rebuilt from the residuals on each iteration so that
+            # such entries do not accumulate.
+            heap = [(-residuals[X], position[X], X) for X in schedule]
+            heapq.heapify(heap)
+
+            updates = 0
+            while updates < len(schedule) and heap:
+                (r, n, X) = heapq.heappop(heap)
+                if -r != residuals[X]:
+                    continue
+                if -r < residual_tol:
+                    heapq.heappush(heap, (r, n, X))
+                    break
+                change = self._update_and_measure(X)
+                updates += 1
+                residuals[X] = 0
+                for Y in blankets.get(X, ()):
+                    if Y in residuals and change > 0:
+                        residuals[Y] += change
+                        heapq.heappush(heap, (-residuals[Y], position[Y], Y))
+                heapq.heappush(heap, (0, n, X))
+
+            cputime = time.process_time() - t
+            converged = self._end_iteration_step('residual', cputime, tol=tol,
+                                                 verbose=verbose)
+            skipped = len(schedule) - updates
+            self.skipped_updates[self.iter] = skipped
+            if verbose:
+                print("Skipped %d of %d node updates"
+                      % (skipped, len(schedule)))
+            if converged:
                 return
 
+            # Stop if all residuals have converged
+            if updates == 0:
+                self.converged = True
+                if verbose:
+                    print("Converged at iteration %d." % (self.iter+1))
+                return
+
+
+    def _update_and_measure(self, X):
+        """
+        Update a node and return the relative change of its parameters.
+        """
+        if (not isinstance(X, ExponentialFamily)
+            or not all(isinstance(phi_i, (np.ndarray, np.number, float, int))
+                       for phi_i in X.phi)):
+            X.update()
+            return np.inf
+        # The parameter arrays may be updated in-place, thus copy
+        phi = [np.copy(phi_i) for phi_i in X.phi]
+        X.update()
+        change = 0
+        for (phi0, phi1) in zip(phi, X.phi):
+            norm = np.linalg.norm(np.ravel(phi1))
+            diff = np.linalg.norm(np.ravel(phi1 - phi0))
+            if diff > 0:
+                change = max(change,
+                             diff / norm if norm > 0 else np.inf)
+        return change
+
+
+    def _update_frozen(self):
+        """
+        Freeze the stabilized nodes and re-activate the nodes whose Markov
+        blanket changed.
+        """
+        changed = set(X for (X, change) in self._changes.items()
+                      if change >= self._skip_tol)
+        stable = set(X for (X, change) in self._changes.items()
+                     if change < self._skip_tol)
+        self._frozen = set(X for X in (self._frozen | stable)
+                           if X not in self._blankets
+                           or not (self._blankets[X] & changed))
+        self._changes = {}
+        return
+
+
+    def _squarem_step(self, schedule):
+        """
+        Run one SQUAREM cycle of updates.
+
+        Two sweeps of updates map the natural parameters p0 -> p1 -> p2.  With
+        r = p1 - p0 and v = p2 - p1 - r, the parameters are extrapolated to
+        p0 - 2*a*r + a**2*v using the steplength a = -|r|/|v| (scheme S3 of
+        Varadhan and Roland, 2008) and a stabilizing sweep is run.  Returns
+        True if the extrapolation was accepted.
+        """
+
+        def sweep():
+            for X in schedule:
+                X.update()
+
+        nodes = [X for X in schedule
+                 if isinstance(X, ExponentialFamily) and not np.all(X.observed)]
+
+        p0 = self.get_parameters(*nodes)
+        sweep()
+        p1 = self.get_parameters(*nodes)
+        sweep()
+
+        r = self.add(p1, p0, scale=-1)
+        v = self.add(self.add(self.get_parameters(*nodes), p1, scale=-1),
+                     r,
+                     scale=-1)
+        vv = self.dot(v, v)
+        if vv == 0:
+            return False
+        a = -np.sqrt(self.dot(r, r) / vv)
+        if a >= -1:
+            # The extrapolation would not go beyond p2
+            return False
+
+        p2 = self.get_parameters(*nodes)
+        L2 = self.compute_lowerbound()
+
+        # If the extrapolation fails, halve the steplength towards the plain
+        # sweeps (a=-1) a few times
+        while True:
+            p = self.add(self.add(p0, r, scale=-2*a), v, scale=a**2)
+            try:
+                # The extrapolated parameters may be invalid (e.g., negative
+                # definite precision matrices), which is seen from the bound
+                with np.errstate(all='ignore'), warnings.catch_warnings():
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    self.set_parameters(p, *nodes)
+                    sweep()
+                    L = self.compute_lowerbound()
+            except (np.linalg.LinAlgError, ValueError):
+                # E.g., Cholesky decomposition failed
+                L = np.nan
+            if L >= L2:
+                return True
+            a = 0.5 * (a - 1)
+            if a > -1.5:
+                break
+
+        self.set_parameters(p2, *nodes)
+        return False
+
+
+    def _compute_schedule(self, nodes):
+        """
+        Resolve the nodes to update, skipping nodes without an update method.
+        """
+        schedule = []
+        for node in nodes:
+            X = self[node]
+            if hasattr(X, 'update') and callable(X.update):
+                schedule.append(X)
+        return schedule
+
+
+    def compile(self, *nodes):
+        """
+        Freeze the model structure to speed up the iterations.
+
+        The quantities of the graph that do not change between iterations are
+        computed once: the update schedule, the mapping from node names to
+        nodes and the plate mappings and multipliers of each edge used in
+        message passing.  After compilation, `update` without explicit nodes
+        iterates the precomputed schedule.
+
+        The graph must not be modified (e.g., by creating new child nodes for
+        the nodes of the model) after compilation.  Call `decompile` before
+        modifying the graph.  Observing nodes is allowed, because observed
+        nodes skip their updates anyway.
+
+        Parameters
+        ----------
+
+        nodes : nodes or node names, optional
+
+            The update order.  By default, the order of the nodes in the
+            model, that is, the same order as `update` without explicit nodes
+            uses.
+        """
+
+        self._names = {node.name: node for node in self.model}
+
+        # Compile all nodes of the graph, including the deterministic and
+        # constant nodes between the nodes of the model
+        visited = set()
+        def compile_node(node):
+            if node in visited:
+                return
+            visited.add(node)
+            node._compile()
+            for parent in node.parents:
+                compile_node(parent)
+        for node in self.model:
+            compile_node(node)
+
+        if len(nodes) == 0:
+            nodes = self.model
+        self._schedule = self._compute_schedule(nodes)
+        return
+
+
+    def decompile(self):
+        """
+        Return to resolving the graph structure dynamically.
+        """
+        visited = set()
+        def decompile_node(node):
+            if node in visited:
+                return
+            visited.add(node)
+            node._decompile()
+            for parent in node.parents:
+                decompile_node(parent)
+        for node in self.model:
+            decompile_node(node)
+        self._names = None
+        self._schedule = None
+        return
+
 
     def has_converged(self, tol=None):
         return self.converged
 
 
 
-    def compute_lowerbound(self, ignore_masked=True):
+    def compute_lowerbound(self, ignore_masked=True, replicates=False):
+        """
+        Compute the VB lower bound.
+
+        If `replicates` is True, return the lower bound of each replicate of
+        the model.
+        """
         L = 0
         for node in self.model:
-            L += node.lower_bound_contribution(ignore_masked=ignore_masked)
+            if replicates:
+                L = L + node.lower_bound_contribution(
+                    ignore_masked=ignore_masked,
+                    replicates=True)
+            else:
+                L += node.lower_bound_contribution(ignore_masked=ignore_masked)
         return L
 
     def compute_lowerbound_terms(self, *nodes):
@@ -169,6 +744,15 @@ class VB():
                 for node in nodes}
 
     def loglikelihood_lowerbound(self):
+        if self.replicates is not None:
+            L = np.zeros(self.replicates)
+            for node in self.model:
+                lp = node.lower_bound_contribution(replicates=True)
+                L = L + lp
+                self.l[node][self.iter] = np.sum(lp)
+            self.L_replicates[self.iter] = L
+            return np.sum(L)
+
         L = 0
         for node in self.model:
             lp = node.lower_bound_contribution()
@@ -177,6 +761,134 @@ class VB():
             
         return L
 
+    def _set_active_replicates(self, active):
+        """
+        Set the replicates that are updated.
+        """
+        self.active_replicates = active
+        mask = None if np.all(active) else active
+        for node in self.model:
+            if isinstance(node, ExponentialFamily):
+                if mask is None:
+                    node.set_plates_to_update(None)
+                else:
+                    node.set_plates_to_update(
+                        misc.add_trailing_axes(mask, len(node.plates)-1))
+        return
+
+    def random(self, *nodes, samples=1):
+        """
+        Draw joint samples of the model.
+
+        Latent variables are sampled from their posterior approximation and
+        observed variables from their distribution given the sampled parents,
+        that is, observed variables are replicated from the posterior
+        predictive distribution. For partly observed nodes, the latent plates
+        are sampled from the posterior approximation and the observed plates
+        from the conditional distribution. The graph is traversed from parents to
+        children once and all samples are drawn simultaneously, thus each
+        sample array has a leading axis of length `samples`.
+
+        Parameters
+        ----------
+
+        nodes : nodes or node names, optional
+
+            Stochastic nodes to sample. By default, all stochastic nodes in the
+            model.
+
+        samples : int, optional
+
+            Number of samples.
+
+        Returns
+        -------
+
+        list of arrays
+
+            The samples of the nodes with shape (samples,)+plates+shape.
+        """
+
+        if len(nodes) == 0:
+            nodes = [node for node in self.model
+                     if isinstance(node, Stochastic)]
+        else:
+            nodes = [self[node] if isinstance(node, str) else node
+                     for node in nodes]
+
+        # The sampled values and moments of the visited nodes. The moments of
+        # a node have the sample axis as the first axis followed by the plates
+        # of the node if and only if the node is marked as sampled, that is, it
+        # depends on some stochastic node.
+        values = {}
+        moments = {}
+        sampled = {}
+
+        def sample_parents(node):
+            u_parents = []
+            for (index, parent) in enumerate(node.parents):
+                u = sample(parent)
+                if sampled[parent]:
+                    # Align the sample axis with the plates of this node by
+                    # adding singleton axes for the plates which the parent
+                    # does not have from the point of view of this node
+                    n = len(node.plates) - len(node._plates_from_parent(index))
+                    u = [np.reshape(u_i,
+                                    np.shape(u_i)[:1] + n*(1,) + np.shape(u_i)[1:])
+                         for u_i in u]
+                u_parents.append(u)
+            return u_parents
+
+        def sample_observed(node, x):
+            # Replace the values of the observed plates by samples from the
+            # conditional distribution given the sampled parents
+            u_parents = sample_parents(node)
+            phi = node._distribution.compute_phi_from_parents(*u_parents)
+            y = node._distribution.random(*phi,
+                                          plates=(samples,)+node.plates)
+            if x is None:
+                return y
+            observed = np.asanyarray(node.observed)
+            ndim = np.ndim(y) - 1 - len(node.plates)
+            observed = np.reshape(observed, np.shape(observed) + ndim*(1,))
+            return np.where(observed, y, x)
+
+        def sample(node):
+            if node in moments:
+                return moments[node]
+            if isinstance(node, Stochastic):
+                x = None
+                if not np.all(node.observed):
+                    # Sample the latent plates from the posterior approximation
+                    with node._cache_phi():
+                        x = node._distribution.random(
+                            *node.phi,
+                            plates=(samples,)+node.plates
+                        )
+                if np.any(node.observed):
+                    x = sample_observed(node, x)
+                (u, _) = node._distribution.compute_fixed_moments_and_f(x)
+                values[node] = x
+                sampled[node] = True
+            elif isinstance(node, Deterministic):
+                u_parents = sample_parents(node)
+                u = node._compute_moments(*u_parents)
+                sampled[node] = any(sampled[parent] for parent in node.parents)
+            else:
+                # Constant nodes
+                u = node._message_to_child()
+                sampled[node] = False
+            moments[node] = u
+            return u
+
+        for node in nodes:
+            if not isinstance(node, Stochastic):
+                raise ValueError("Node %s is not stochastic" % node.name)
+            sample(node)
+
+        return [values[node] for node in nodes]
+
+
     def plot_iteration_by_nodes(self, axes=None, diff=False):
         """
         Plot the cost function per node during the iteration.
@@ -315,6 +1027,8 @@ class VB():
     def __getitem__(self, name):
         if name in self.model:
             return name
+        elif self._names is not None:
+            return self._names[name]
         else:
             # Dictionary for mapping node names to nodes
             dictionary = {node.name: node for node in self.model}
@@ -423,10 +1137,26 @@ class VB():
         return v
 
 
+    def get_parameter_vector(self, *nodes):
+        """
+        Store the parameters of the nodes in one contiguous vector.
+
+        See `ParameterVector`.
+        """
+        return ParameterVector(*[self[node] for node in nodes])
+
+
     def optimize(self, *nodes, maxiter=10, verbose=True, method='fletcher-reeves',
                  riemannian=True, collapsed=None, tol=None):
         """
         Optimize nodes using Riemannian conjugate gradient
+
+        Other values of `method` are passed to `scipy.optimize.minimize`
+        (e.g., 'L-BFGS-B'), which then optimizes the bound with respect to the
+        flat vector of the natural parameters.  The collapsed nodes are
+        updated at each evaluation of the bound.  Because the solver requires
+        the gradient of its objective, the Euclidean gradient is used and
+        `riemannian` is ignored.
         """
 
         method = method.lower()
@@ -434,68 +1164,66 @@ class VB():
         if collapsed is None:
             collapsed = []
 
-        t = time.clock()
+        if method not in ('gradient', 'fletcher-reeves'):
+            return self._optimize_scipy(*nodes,
+                                        maxiter=maxiter,
+                                        verbose=verbose,
+                                        method=method,
+                                        collapsed=collapsed,
+                                        tol=tol)
+
+        t = time.process_time()
 
         # Current parameters
-        p = self.get_parameters(*nodes)
-        
-        # Get gradients
-        if riemannian and method == 'gradient':
-            rg = self.get_gradients(*nodes, euclidian=False)
-        else:
-            (rg, g) = self.get_gradients(*nodes, euclidian=True)
+        P = self.get_parameter_vector(*nodes)
+        p = P.get()
+        collapsed = [self[node] for node in collapsed]
 
-        if riemannian:
-            g1 = g
-            g2 = rg
-        else:
-            g1 = g
-            g2 = g
+        def gradients():
+            # Copy the gradients because the buffers are overwritten
+            if riemannian and method == 'gradient':
+                rg = np.copy(P.gradients(euclidian=False))
+                return (rg, rg)
+            (rg, g) = P.gradients(euclidian=True)
+            return (np.copy(g), np.copy(rg) if riemannian else np.copy(g))
+
+        # Get gradients
+        (g1, g2) = gradients()
 
         if method == 'gradient':
             pass
         elif method == 'fletcher-reeves':
-            dd_prev = self.dot(g1, g2)
+            dd_prev = np.dot(g1, g2)
         else:
             raise Exception("Unknown optimization method: %s" % (method))
 
         # Take a gradient ascending step
-        p_new = self.add(p, g2)
-        self.set_parameters(p_new, *nodes)
+        p_new = p + g2
+        P.set(p_new)
         p = p_new
 
         # Update collapsed variables
         for node in collapsed:
-            self[node].update()
+            node.update()
 
         L = self.compute_lowerbound()
 
         s = g2
-        cputime = time.clock() - t
+        cputime = time.process_time() - t
         
         self._end_iteration_step('OPT', cputime, tol=tol)
 
         for i in range(maxiter-1):
 
-            t = time.clock()
+            t = time.process_time()
 
             # Get gradients
-            if riemannian and method == 'gradient':
-                rg = self.get_gradients(*nodes, euclidian=False)
-            else:
-                (rg, g) = self.get_gradients(*nodes, euclidian=True)
-
-            if riemannian:
-                g1 = g
-                g2 = rg
-            else:
-                g1 = g
-                g2 = g
+            (g1, g2) = gradients()
 
             if method == 'gradient':
                 b = 0
             elif method == 'fletcher-reeves':
-                dd_curr = self.dot(g1, g2)
+                dd_curr = np.dot(g1, g2)
                 if dd_prev == 0:
                     b = 0
                 else:
@@ -505,17 +1233,17 @@ class VB():
                 raise Exception("Unknown optimization method: %s" % (method))
 
             if b:
-                s = self.add(g2, s, scale=b)
+                s = g2 + b*s
             else:
                 s = g2
 
             success = False
             while not success:
 
-                p_new = self.add(p, s)
+                p_new = p + s
 
                 try:
-                    self.set_parameters(p_new, *nodes)
+                    P.set(p_new)
                 except:
                     print("WARNING! CG update was unsuccessful, use gradient and reset CG")
                     s = g2
@@ -523,7 +1251,7 @@ class VB():
 
                 # Update collapsed variables
                 for node in collapsed:
-                    self[node].update()
+                    node.update()
 
                 L = self.compute_lowerbound()
 
@@ -536,11 +1264,70 @@ class VB():
 
             p = p_new
             
-            cputime = time.clock() - t
+            cputime = time.process_time() - t
             if self._end_iteration_step('OPT', cputime, tol=tol):
                 break
 
 
+    def _optimize_scipy(self, *nodes, maxiter=10, verbose=True, method=None,
+                        collapsed=None, tol=None):
+        """
+        Optimize the flat parameter vector of the nodes using scipy.
+        """
+
+        if collapsed is None:
+            collapsed = []
+
+        P = self.get_parameter_vector(*nodes)
+        collapsed = [self[node] for node in collapsed]
+
+        def fun(x):
+            try:
+                with np.errstate(all='ignore'), warnings.catch_warnings():
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    P.set(x)
+                    for node in collapsed:
+                        node.update()
+                    L = self.compute_lowerbound()
+                    (_, g) = P.gradients(euclidian=True)
+            except Exception:
+                # Invalid parameters (e.g., the Cholesky decomposition failed)
+                return (np.inf, np.zeros(P.size))
+            if not np.isfinite(L):
+                return (np.inf, np.zeros(P.size))
+            return (-L, -g)
+
+        t = [time.process_time()]
+        converged = [False]
+        def callback(x):
+            cputime = time.process_time() - t[0]
+            converged[0] = self._end_iteration_step(method.upper(),
+                                                    cputime,
+                                                    tol=tol,
+                                                    verbose=verbose)
+            t[0] = time.process_time()
+            if converged[0]:
+                raise StopIteration()
+
+        x = P.get()
+        try:
+            res = scipy.optimize.minimize(fun,
+                                          x,
+                                          method=method,
+                                          jac=True,
+                                          callback=callback,
+                                          options={'maxiter': maxiter})
+            x = res.x
+        except StopIteration:
+            x = P.get()
+
+        # Make sure the nodes are in the state of the solution
+        P.set(x)
+        for node in collapsed:
+            node.update()
+        return
+
+
     def pattern_search(self, *nodes, collapsed=None, maxiter=3):
         """Perform simple pattern search :cite:`Honkela:2003`.
 
@@ -550,7 +1337,7 @@ class VB():
         if collapsed is None:
             collapsed = []
 
-        t = time.clock()
+        t = time.process_time()
 
         # Update all nodes
         for x in nodes:
@@ -594,7 +1381,7 @@ class VB():
         for x in collapsed:
             self[x].update()
 
-        cputime = time.clock() - t
+        cputime = time.process_time() - t
         self._end_iteration_step('PS', cputime)
 
 
@@ -612,6 +1399,103 @@ class VB():
             node.annealing = annealing
         self.annealing_changed = True
         self.converged = False
+        self._frozen = set()
+        if self.replicates is not None:
+            self._set_active_replicates(np.ones(self.replicates, dtype=bool))
+        return
+
+
+    def anneal(self, *nodes, repeat=100, start=0.01, step=0.2, max_step=None,
+               tol=1e-4, patience=10, final=None, verbose=True):
+        """
+        Update the nodes using an adaptive deterministic annealing schedule.
+
+        The annealing coefficient starts from `start` and is increased towards
+        1 by adding `step` to its logarithm.  At each annealing level, the
+        nodes are updated until the relative change of the annealed lower
+        bound is below `tol` or `patience` iterations have been used.  If the
+        level converged in less than half of the patience, the step is
+        doubled up to `max_step` (by default, twice the initial step), and if
+        the patience ran out, the step is halved down to the initial step.
+        Thus, the coefficient is raised quickly while the posterior changes
+        smoothly and slowly around phase transitions.  Large steps may jump
+        over the phase transitions of mixture models, thus `max_step` should
+        be kept moderate.  Once the coefficient is 1, the nodes are updated
+        normally until convergence.
+
+        `repeat` is the maximum total number of iterations.  The last `final`
+        iterations (by default, a fifth of `repeat`) are reserved for the
+        updates without annealing: if the coefficient has not reached 1 when
+        only they remain, it is set to 1 with a warning.  Thus, the annealing
+        coefficient is always 1 on return.
+        """
+        if max_step is None:
+            max_step = 2 * step
+        min_step = step
+        if final is None:
+            final = max(1, repeat // 5)
+        final = min(final, repeat)
+        beta = start
+        self.set_annealing(beta)
+        level = 0
+        i = 0
+        while beta < 1 and i < repeat - final:
+            self.update(*nodes, repeat=1, tol=tol, verbose=verbose)
+            i += 1
+            level += 1
+            if self.converged or level >= patience:
+                if not self.converged:
+                    step = max(0.5 * step, min_step)
+                elif level < 0.5 * patience:
+                    step = min(2 * step, max_step)
+                beta = min(1.0, beta * np.exp(step))
+                if verbose:
+                    print("Set annealing to %.3f" % beta)
+                self.set_annealing(beta)
+                level = 0
+        if beta < 1:
+            warnings.warn("Annealing reached only %g in %d iterations, thus "
+                          "it was set to 1 for the remaining %d iterations"
+                          % (beta, i, repeat - i))
+            if verbose:
+                print("Set annealing to 1.000")
+            self.set_annealing(1.0)
+        if repeat > i:
+            self.update(*nodes, repeat=repeat-i, verbose=verbose)
+        return
+
+
+    def set_validate_once(self, validate_once=True):
+        """
+        Run the runtime shape checks of the nodes only until they have passed.
+
+        Once a model has been debugged, the shape checks in message passing
+        are pure overhead.  This sets the mode for the nodes of the model and
+        the deterministic nodes between them.
+        """
+        visited = set()
+        def set_node(node):
+            if node in visited:
+                return
+            visited.add(node)
+            node.set_validate_once(validate_once)
+            for parent in node.parents:
+                if not isinstance(parent, Stochastic):
+                    set_node(parent)
+        for node in self.model:
+            set_node(node)
+        return
+
+
+    def set_buffer_reuse(self, reuse=True):
+        """
+        Update the nodes of the model in-place using preallocated arrays.
+
+        See `Node.set_buffer_reuse`.  The arrays of the natural parameters are
+        overwritten on each update, thus copy them if you need to keep them.
+        """
+        for node in self.model:
+            node.set_buffer_reuse(reuse)
         return
 
 
@@ -620,6 +1504,12 @@ class VB():
         Append some arrays for more iterations
         """
         self.L = np.append(self.L, misc.nans(iters))
+        self.skipped_updates = np.append(self.skipped_updates,
+                                         np.zeros(iters, dtype=int))
+        if self.replicates is not None:
+            self.L_replicates = np.append(self.L_replicates,
+                                          misc.nans((iters, self.replicates)),
+                                          axis=0)
         self.cputime = np.append(self.cputime, misc.nans(iters))
         for (node, l) in self.l.items():
             self.l[node] = np.append(l, misc.nans(iters))
@@ -675,7 +1565,21 @@ class VB():
             if tol is None:
                 tol = self.tol
             div = 0.5 * (abs(L0) + abs(L1))
-            if (L1 - L0) / div < tol:
+            if self.replicates is not None:
+                # Stop updating the replicates that have converged
+                L0 = self.L_replicates[self.iter-1]
+                L1 = self.L_replicates[self.iter]
+                div = 0.5 * (np.abs(L0) + np.abs(L1))
+                active = np.logical_and(self.active_replicates,
+                                        (L1 - L0) / div >= tol)
+                if np.any(active != self.active_replicates):
+                    self._set_active_replicates(active)
+                if not np.any(active):
+                    if verbose:
+                        print("All replicates converged at iteration %d."
+                              % (self.iter+1))
+                    self.converged = True
+            elif (L1 - L0) / div < tol:
             #if (L1 - L0) / div < tol or L1 - L0 <= 0:
                 if verbose:
                     print("Converged at iteration %d." % (self.iter+1))
@@ -692,3 +1596,275 @@ class VB():
         self.annealing_changed = False
 
         return self.converged
+
+
+
+class ParameterVector():
+    r"""
+    Natural parameters of nodes as one contiguous vector.
+
+    The parameters of the nodes are stored in a flat buffer.  The offset table
+    `offsets` gives a list of (start, stop, shape) for each parameter array of
+    each node, and the natural parameters of the nodes are zero-copy views to
+    the buffer.  The parameter arrays are broadcasted to their full shape
+    (plates and dimensions).
+
+    This is meant for driving optimizers which operate on vectors, such as
+    those in `scipy.optimize`.  Note that updating the nodes by other means
+    replaces their parameter arrays, thus `get` returns the parameters of the
+    nodes when they were last set through this object.
+    """
+
+
+    def __init__(self, *nodes):
+        self.nodes = nodes
+        self.offsets = []
+        size = 0
+        for node in nodes:
+            table = []
+            for i in range(len(node.phi)):
+                shape = node.get_shape(i)
+                n = int(np.prod(shape))
+                table.append((size, size+n, shape))
+                size += n
+            self.offsets.append(table)
+        self.size = size
+        self.x = np.empty(size)
+        self.rg = np.empty(size)
+        self.g = np.empty(size)
+        self._views = self._split(self.x)
+        self._riemannian_gradient_views = self._split(self.rg)
+        self._gradient_views = self._split(self.g)
+        # Use the current parameters of the nodes
+        for (node, views) in zip(self.nodes, self._views):
+            for (view, phi) in zip(views, node.phi):
+                view[...] = phi
+        self.set(self.x)
+
+
+    def _split(self, x):
+        return [[np.reshape(x[start:stop], shape)
+                 for (start, stop, shape) in table]
+                for table in self.offsets]
+
+
+    def get(self):
+        """
+        Return a copy of the parameter vector.
+        """
+        return np.copy(self.x)
+
+
+    def set(self, x):
+        """
+        Set the parameters of the nodes from a vector.
+        """
+        if x is not self.x:
+            np.copyto(self.x, x)
+        for (node, views) in zip(self.nodes, self._views):
+            node.phi = list(views)
+            node._update_moments_and_cgf()
+
+
+    def gradients(self, euclidian=False):
+        """
+        Compute the gradients of the lower bound as vectors.
+
+        Returns the Riemannian gradient and, if `euclidian`, also the
+        Euclidean gradient as in `VB.get_gradients`.  The vectors are
+        overwritten in the next call, thus copy them if needed.
+        """
+        for (node, rg_views, g_views) in zip(self.nodes,
+                                             self._riemannian_gradient_views,
+                                             self._gradient_views):
+            rg = node.get_riemannian_gradient()
+            for (view, rg_i) in zip(rg_views, rg):
+                view[...] = rg_i
+            if euclidian:
+                g = node.get_gradient(rg)
+                for (view, g_i) in zip(g_views, g):
+                    view[...] = g_i
+        if euclidian:
+            return (self.rg, self.g)
+        return self.rg
+
+
+def _posterior_nodes(Q):
+    """
+    Return the nodes of the model that have a posterior approximation.
+    """
+    return [node for node in Q.model
+            if isinstance(node, ExponentialFamily)
+            and not np.all(node.observed)]
+
+
+def _restart_worker(factory, seeds, counter, best, winner, shared, messages,
+                    maxiter, tol, early_stop):
+    """
+    Run restarts in a worker process until all restarts have been taken.
+    """
+    while True:
+        with counter.get_lock():
+            i = counter.value
+            counter.value += 1
+        if i >= len(seeds):
+            return
+        try:
+            np.random.seed(seeds[i])
+            Q = factory()
+            status = 'maxiter'
+            L_prev = None
+            for n in range(maxiter):
+                Q.update(repeat=1, tol=tol, verbose=False)
+                L = Q.L[Q.iter]
+                messages.put(('bound', i, L))
+                if Q.converged:
+                    status = 'converged'
+                    break
+                # Terminate if the bound cannot reach the best one even if it
+                # improved faster than currently
+                if (early_stop is not None and L_prev is not None
+                    and (L + early_stop * (maxiter-n-1) * (L-L_prev)
+                         < best.value)):
+                    status = 'terminated'
+                    break
+                L_prev = L
+            if status != 'terminated':
+                # Only the best posterior so far is copied to the shared
+                # memory
+                with best.get_lock():
+                    if L > best.value:
+                        x = ParameterVector(*_posterior_nodes(Q)).x
+                        np.frombuffer(shared)[:] = x
+                        best.value = L
+                        winner.value = i
+            messages.put(('done', i, status))
+        except Exception:
+            messages.put(('error', i, traceback.format_exc()))
+
+
+def run_restarts(factory, restarts, processes=None, maxiter=100, tol=None,
+                 seed=None, early_stop=10, verbose=False):
+    r"""
+    Run VB inference from several initializations in parallel processes.
+
+    Multimodal models, such as mixtures and hidden Markov models, are often
+    fitted from several random initializations and the result with the best
+    lower bound is used.  The restarts are run in forked worker processes.
+    Each worker seeds NumPy's random number generator, builds the model by
+    calling `factory` and updates it until convergence.  The lower bounds are
+    streamed back to this process.  Only the natural parameters of the best
+    posterior approximation are passed back, via shared memory.
+
+    Parameters
+    ----------
+
+    factory : callable
+
+        Function which constructs and initializes (e.g., using
+        `initialize_from_random`) the model and returns its `VB` object.  The
+        structure of the model must not depend on the random numbers.
+
+    restarts : int
+
+        Number of restarts
+
+    processes : int, optional
+
+        Number of worker processes.  By default, the number of CPUs.
+
+    maxiter : int, optional
+
+        Maximum number of iterations for each restart
+
+    tol : float, optional
+
+        Convergence tolerance as in `VB.update`
+
+    seed : int, optional
+
+        Seed for drawing the seeds of the restarts
+
+    early_stop : float, optional
+
+        Terminate a restart if its lower bound could not reach the best
+        finished restart even if the bound increased `early_stop` times
+        faster than currently for the remaining iterations.  This is a
+        heuristic, because the bounds of multimodal models may stall and then
+        improve again.  If None, the restarts are not terminated early.
+
+    Returns
+    -------
+
+    Q : VB
+
+        The model constructed by `factory` in this process, set to the
+        posterior approximation of the best restart
+
+    L : list of arrays
+
+        The lower bound after each iteration for each restart
+
+    best : int
+
+        Index of the best restart
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, restarts))
+    seeds = np.random.RandomState(seed).randint(2**31-1, size=restarts)
+
+    # The model of this process defines the layout of the shared memory
+    Q = factory()
+    nodes = _posterior_nodes(Q)
+    parameters = ParameterVector(*nodes)
+
+    context = multiprocessing.get_context('fork')
+    counter = context.Value('i', 0)
+    best = context.Value('d', -np.inf)
+    winner = context.Value('i', -1)
+    shared = context.RawArray('d', max(parameters.size, 1))
+    messages = context.Queue()
+    workers = [context.Process(target=_restart_worker,
+                               args=(factory, seeds, counter, best, winner,
+                                     shared, messages, maxiter, tol,
+                                     early_stop))
+               for n in range(processes)]
+    for worker in workers:
+        worker.start()
+
+    L = [[] for i in range(restarts)]
+    finished = 0
+    error = None
+    while finished < restarts:
+        try:
+            (kind, i, value) = messages.get(timeout=0.1)
+        except queue.Empty:
+            if not any(worker.is_alive() for worker in workers):
+                break
+            continue
+        if kind == 'bound':
+            L[i].append(value)
+        else:
+            finished += 1
+            if kind == 'error':
+                error = value
+                break
+            if verbose:
+                print("Restart %d %s at iteration %d: loglike=%e"
+                      % (i+1, value, len(L[i]), L[i][-1]))
+
+    for worker in workers:
+        if error is not None:
+            worker.terminate()
+        worker.join()
+    if error is not None:
+        raise RuntimeError("A restart failed:\n%s" % error)
+    if winner.value < 0:
+        raise RuntimeError("None of the restarts finished")
+
+    parameters.set(np.frombuffer(shared)[:parameters.size])
+    if verbose:
+        print("Best restart: %d (loglike=%e)" % (winner.value+1, best.value))
+
+    return (Q, [np.array(l) for l in L], winner.value)
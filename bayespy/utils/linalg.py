@@ -27,6 +27,10 @@ General numerical functions and methods.
 """
 
 import itertools
+import collections
+import contextlib
+import threading
+import weakref
 import numpy as np
 import scipy as sp
 #import scipy.linalg.decomp_cholesky as decomp
@@ -176,6 +180,376 @@ def logdet_tri(R):
 def logdet_cov(C):
     return logdet_chol(chol(C))
 
+class CholeskyCache():
+    """
+    Cache of Cholesky factors keyed by an owner and a version.
+
+    The owner (e.g., a node) increments its version whenever the matrices it
+    factorizes are modified, so a factor is reused only for the version it
+    was computed for and the matrices can be modified in-place.  Only the
+    factor of the latest version is kept for each owner and it is removed
+    when the owner is garbage collected.
+
+    The factors are cached only for the computations run in the context
+    given by `key`, because the cache can be shared by several owners, e.g.,
+    in a distribution object shared by the nodes of a class.
+    """
+
+    CacheInfo = collections.namedtuple('CacheInfo',
+                                       ['hits', 'misses', 'currsize'])
+
+    def __init__(self):
+        self._factors = weakref.WeakKeyDictionary()
+        # The current key of each thread
+        self._keys = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # Weak references cannot be pickled and the cached factors are not
+        # needed in a copy
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def __setstate__(self, state):
+        self.__init__()
+        self.hits = state['hits']
+        self.misses = state['misses']
+
+    @contextlib.contextmanager
+    def key(self, owner, version):
+        """
+        Cache the factors computed in the context for the owner and version.
+        """
+        thread = threading.get_ident()
+        previous = self._keys.get(thread)
+        self._keys[thread] = (owner, version)
+        try:
+            yield
+        finally:
+            if previous is None:
+                del self._keys[thread]
+            else:
+                self._keys[thread] = previous
+
+    def chol(self, C):
+        """
+        Return the Cholesky factor of C.
+
+        `C` can be a function of no arguments, in which case it is called
+        only if the factor is not in the cache.  Outside of a `key` context
+        the factor is computed without caching.
+        """
+        key = self._keys.get(threading.get_ident())
+        if key is not None:
+            (owner, version) = key
+            entry = self._factors.get(owner)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+        self.misses += 1
+        factor = chol(C() if callable(C) else C)
+        if key is not None:
+            self._factors[owner] = (version, factor)
+        return factor
+
+    def cache_info(self):
+        """
+        Return the number of hits, misses and cached factors.
+        """
+        return self.CacheInfo(self.hits, self.misses, len(self._factors))
+
+    def clear(self):
+        """
+        Remove all factors and reset the statistics.
+        """
+        self._factors.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class DiagonalPlusLowRank():
+    r"""
+    Symmetric matrix represented as a diagonal plus a low-rank term.
+
+    The matrix is
+
+    .. math::
+
+        \mathbf{A} = \mathrm{diag}(\mathbf{d}) + \mathbf{UCU}^{\mathrm{T}},
+
+    where :math:`\mathbf{d}` has shape (...,D), :math:`\mathbf{U}` has shape
+    (...,D,K) and :math:`\mathbf{C}` is a symmetric (...,K,K) matrix (identity
+    by default).  The leading axes are broadcasted.  Solves, inverses and
+    log-determinants use the Woodbury identity and the matrix determinant
+    lemma, so their cost is :math:`O(DK^2)` instead of :math:`O(D^3)`.
+
+    The representation is closed under addition, scaling and inversion, thus
+    it can be passed through natural parameters, messages and moments.  Other
+    operations fall back to the dense matrix.  Addition stacks the low-rank
+    factors, so the factors are re-compressed when the rank would exceed
+    min(D, `max_rank`).  If `max_rank` is smaller than the numerical rank,
+    the terms of the smallest magnitude are dropped, which is an
+    approximation.
+    """
+
+    def __init__(self, d, U, C=None, max_rank=None):
+        self.max_rank = max_rank
+        self.d = np.asanyarray(d)
+        self.U = np.asanyarray(U)
+        K = np.shape(self.U)[-1]
+        if C is None:
+            C = np.identity(K)
+        self.C = np.asanyarray(C)
+        if np.shape(self.U)[-2] != np.shape(self.d)[-1]:
+            raise ValueError("Diagonal and low-rank factor have inconsistent "
+                             "dimensionality")
+        if np.shape(self.C)[-2:] != (K, K):
+            raise ValueError("Low-rank core matrix has wrong shape")
+        D = np.shape(self.d)[-1]
+        self.shape = misc.broadcasted_shape(np.shape(self.d)[:-1],
+                                            np.shape(self.U)[:-2],
+                                            np.shape(self.C)[:-2]) + (D, D)
+        self.ndim = len(self.shape)
+
+    def __repr__(self):
+        return ("DiagonalPlusLowRank(shape=%s, rank=%d)"
+                % (self.shape, np.shape(self.U)[-1]))
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self.dense(), dtype=dtype)
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        # Keep the structure in the arithmetic operators and fall back to the
+        # dense matrix in other ufuncs
+        if method == '__call__' and ufunc in (np.add, np.subtract,
+                                              np.multiply, np.true_divide,
+                                              np.negative):
+            if len(kwargs) > 0:
+                # In-place arithmetic is not supported, as with the operators
+                return NotImplemented
+            if ufunc is np.negative:
+                return -self
+            (x, y) = inputs
+            if ufunc is np.add:
+                return self.__add__(y if x is self else x)
+            if ufunc is np.multiply:
+                return self.__mul__(y if x is self else x)
+            if ufunc is np.subtract:
+                return self.__sub__(y) if x is self else self.__rsub__(x)
+            if x is self:
+                return self.__truediv__(y)
+        inputs = tuple(np.asarray(x) if isinstance(x, DiagonalPlusLowRank)
+                       else x
+                       for x in inputs)
+        return getattr(ufunc, method)(*inputs, **kwargs)
+
+    def _broadcast(self):
+        """
+        Broadcast the factors to the same leading shape.
+        """
+        plates = self.shape[:-2]
+        d = np.broadcast_to(self.d, plates + np.shape(self.d)[-1:])
+        U = np.broadcast_to(self.U, plates + np.shape(self.U)[-2:])
+        C = np.broadcast_to(self.C, plates + np.shape(self.C)[-2:])
+        return (d, U, C)
+
+    def dense(self):
+        """
+        Return the matrix as a full array.
+        """
+        A = np.matmul(np.matmul(self.U, self.C), transpose(self.U))
+        return A + misc.diag(self.d)
+
+    def reshape(self, shape):
+        """
+        Reshape the leading axes of the matrix.
+        """
+        if tuple(shape[-2:]) != self.shape[-2:]:
+            raise ValueError("Only the leading axes can be reshaped")
+        (d, U, C) = self._broadcast()
+        plates = tuple(shape[:-2])
+        return DiagonalPlusLowRank(np.reshape(d, plates + np.shape(d)[-1:]),
+                                   np.reshape(U, plates + np.shape(U)[-2:]),
+                                   np.reshape(C, plates + np.shape(C)[-2:]),
+                                   max_rank=self.max_rank)
+
+    def compress(self, max_rank=None):
+        """
+        Return the matrix with the low-rank term in its minimal rank.
+
+        The low-rank factor is orthonormalized and the core is diagonalized,
+        so the rank is at most D.  The rank is the largest numerical rank over
+        the plates, truncated to `max_rank` if given.
+        """
+        (d, U, C) = self._broadcast()
+        (Q, R) = np.linalg.qr(U)
+        (w, V) = np.linalg.eigh(np.matmul(np.matmul(R, C), transpose(R)))
+        # Order the terms by decreasing magnitude
+        order = np.argsort(-np.abs(w), axis=-1)
+        w = np.take_along_axis(w, order, axis=-1)
+        V = np.take_along_axis(V, order[...,None,:], axis=-1)
+        w_max = np.max(np.abs(w), axis=-1, keepdims=True)
+        tol = np.shape(w)[-1] * np.finfo(float).eps * w_max
+        rank = int(np.max(np.sum(np.abs(w) > tol, axis=-1), initial=0))
+        if max_rank is not None:
+            rank = min(rank, max_rank)
+        return DiagonalPlusLowRank(d,
+                                   np.matmul(Q, V[...,:rank]),
+                                   misc.diag(w[...,:rank]),
+                                   max_rank=self.max_rank)
+
+    def __mul__(self, other):
+        if isinstance(other, DiagonalPlusLowRank):
+            return self.dense() * other.dense()
+        other = np.asanyarray(other)
+        if np.ndim(other) == 0:
+            s = other
+        elif np.ndim(other) >= 2 and np.shape(other)[-2:] == (1, 1):
+            # Scaling of the whole matrices
+            s = other[...,0,0]
+        else:
+            return self.dense() * other
+        return DiagonalPlusLowRank(self.d * s[...,None],
+                                   self.U,
+                                   self.C * s[...,None,None],
+                                   max_rank=self.max_rank)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        return self * (1 / np.asanyarray(other))
+
+    def __neg__(self):
+        return -1 * self
+
+    def __add__(self, other):
+        if isinstance(other, DiagonalPlusLowRank):
+            # Stack the low-rank factors and use a block-diagonal core
+            plates = misc.broadcasted_shape(self.shape[:-2], other.shape[:-2])
+            U1 = np.broadcast_to(self.U, plates + np.shape(self.U)[-2:])
+            U2 = np.broadcast_to(other.U, plates + np.shape(other.U)[-2:])
+            K1 = np.shape(U1)[-1]
+            K2 = np.shape(U2)[-1]
+            C = np.zeros(plates + (K1+K2, K1+K2))
+            C[...,:K1,:K1] = self.C
+            C[...,K1:,K1:] = other.C
+            ranks = [r for r in (self.max_rank, other.max_rank)
+                     if r is not None]
+            max_rank = min(ranks) if ranks else None
+            A = DiagonalPlusLowRank(self.d + other.d,
+                                    np.concatenate([U1, U2], axis=-1),
+                                    C,
+                                    max_rank=max_rank)
+            if K1 + K2 > min([self.shape[-1]] + ranks):
+                return A.compress(max_rank)
+            return A
+        if not np.any(other):
+            # Adding zeros, only the shape may change
+            sh = misc.broadcasted_shape(self.shape, np.shape(other))
+            if sh == self.shape:
+                return self
+            return self.reshape(sh)
+        return self.dense() + other
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __rsub__(self, other):
+        return (-self) + other
+
+    def _capacitance(self):
+        r"""
+        Return :math:`\mathbf{D}^{-1}\mathbf{U}` and the capacitance matrix
+        :math:`\mathbf{I} + \mathbf{CU}^{\mathrm{T}}\mathbf{D}^{-1}\mathbf{U}`.
+        """
+        invD_U = self.U / self.d[...,:,None]
+        K = np.shape(self.U)[-1]
+        S = np.identity(K) + np.matmul(self.C,
+                                       np.matmul(transpose(self.U), invD_U))
+        return (invD_U, S)
+
+    def solve(self, b):
+        r"""
+        Solve :math:`\mathbf{Ax}=\mathbf{b}` for vectors b of shape (...,D).
+        """
+        (invD_U, S) = self._capacitance()
+        invD_b = b / self.d
+        CUb = np.einsum('...kl,...il,...i->...k', self.C, self.U, invD_b)
+        z = np.linalg.solve(S, CUb[...,None])[...,0]
+        return invD_b - np.einsum('...ik,...k->...i', invD_U, z)
+
+    def inv(self):
+        r"""
+        Compute the inverse matrix in the factored form.
+
+        By the Woodbury identity, the inverse is
+        :math:`\mathbf{D}^{-1} - \mathbf{D}^{-1}\mathbf{US}^{-1}\mathbf{C}
+        \mathbf{U}^{\mathrm{T}}\mathbf{D}^{-1}`, where :math:`\mathbf{S}` is
+        the capacitance matrix.
+        """
+        (invD_U, S) = self._capacitance()
+        C = -np.linalg.solve(S, self.C)
+        return DiagonalPlusLowRank(1 / self.d,
+                                   invD_U,
+                                   0.5 * (C + transpose(C)),
+                                   max_rank=self.max_rank)
+
+    def logdet(self):
+        """
+        Compute the log-determinant using the matrix determinant lemma.
+        """
+        (_, S) = self._capacitance()
+        return (np.sum(np.log(self.d), axis=-1)
+                + np.linalg.slogdet(S)[1])
+
+    def dot(self, x):
+        """
+        Compute the matrix-vector product for vectors x of shape (...,D).
+        """
+        Ux = np.einsum('...ik,...i->...k', self.U, x)
+        return (self.d * x
+                + np.einsum('...ik,...kl,...l->...i', self.U, self.C, Ux))
+
+    def trace_dot(self, X):
+        r"""
+        Compute :math:`\mathrm{tr}(\mathbf{AX})` for matrices X of shape (...,D,D).
+
+        X can also be a symmetric diagonal-plus-low-rank matrix, in which case
+        the dense matrices are not formed.
+        """
+        if isinstance(X, DiagonalPlusLowRank):
+            UU = np.matmul(transpose(self.U), X.U)
+            return (np.einsum('...i,...i->...', self.d, X.d)
+                    + np.einsum('...kl,...ik,...i,...il->...',
+                                self.C, self.U, X.d, self.U)
+                    + np.einsum('...kl,...ik,...i,...il->...',
+                                X.C, X.U, self.d, X.U)
+                    + np.einsum('...kl,...lm,...mn,...kn->...',
+                                self.C, UU, X.C, UU))
+        UXU = np.matmul(np.matmul(transpose(self.U), X), self.U)
+        return (np.einsum('...i,...ii->...', self.d, X)
+                + np.einsum('...kl,...kl->...', self.C, UXU))
+
+    def random_normal(self, size=()):
+        """
+        Draw samples from a zero-mean normal distribution with covariance A.
+
+        The core matrix C must be positive semi-definite.
+        """
+        (d, U, C) = self._broadcast()
+        plates = misc.broadcasted_shape(tuple(size), self.shape[:-2])
+        K = np.shape(U)[-1]
+        # Square root of the (possibly singular) core matrix
+        (w, V) = np.linalg.eigh(C)
+        L = V * np.sqrt(np.clip(w, 0, None))[...,None,:]
+        z1 = np.random.normal(0, 1, plates + self.shape[-1:])
+        z2 = np.random.normal(0, 1, plates + (K,))
+        return (np.sqrt(d) * z1
+                + np.einsum('...ik,...kl,...l->...i', U, L, z2))
+
+
 def solve_triangular(U, B, **kwargs):
     # Allocate memory
     U = np.atleast_2d(U)
@@ -235,6 +609,12 @@ def inner(*args, ndim=1):
 
     The number of arrays is arbitrary.  The number of dimensions is arbitrary.
     """
+    if ndim == 2 and len(args) == 2:
+        # Trace of a product with a structured symmetric matrix
+        if isinstance(args[0], DiagonalPlusLowRank):
+            return args[0].trace_dot(args[1])
+        if isinstance(args[1], DiagonalPlusLowRank):
+            return args[1].trace_dot(args[0])
     axes = tuple(range(-ndim,0))
     return misc.sum_product(*args, axes_to_sum=axes)
 
@@ -271,22 +651,13 @@ def _dot(A, B):
     """
     Dot product which handles broadcasting properly.
 
-    Future NumPy will have a better built-in implementation for this.
+    The plate axes are broadcast in compiled code by `numpy.matmul`, so the
+    cost of a plated product does not include a Python-level loop over the
+    plates.
     """
-    A_plates = np.shape(A)[:-2]
-    B_plates = np.shape(B)[:-2]
-    M = np.shape(A)[-2]
-    N = np.shape(B)[-1]
-    Y_plates = misc.broadcasted_shape(A_plates, B_plates)
-    if Y_plates == ():
+    if np.ndim(A) == 2 and np.ndim(B) == 2:
         return np.dot(A, B)
-    indices = misc.nested_iterator(Y_plates)
-    Y_shape = Y_plates + (M, N)
-    Y = np.zeros(Y_shape)
-    for i in indices:
-        Y[i] = np.dot(A[misc.safe_indices(i, A_plates)],
-                      B[misc.safe_indices(i, B_plates)])
-    return Y
+    return np.matmul(A, B)
 
 def dot(*arrays):
     """
@@ -306,10 +677,7 @@ def dot(*arrays):
                 raise ValueError("Must be at least 2-D arrays")
             if np.shape(Y)[-1] != np.shape(X)[-2]:
                 raise ValueError("Dimensions do not match")
-            # Replace this with numpy.dot when NumPy implements broadcasting in dot
             Y = _dot(Y, X)
-            #Y = np.einsum('...ik,...kj->...ij', Y, X)
-            #Y = gula.matrix_multiply(Y, X)
         return Y
 
 def tracedot(A, B):
@@ -350,6 +718,8 @@ def mvdot(A, b, ndim=1):
     # return gula.inner1d(A, b[...,np.newaxis,:])
     # 
     # Use einsum instead:
+    if ndim == 1 and isinstance(A, DiagonalPlusLowRank):
+        return A.dot(b)
     if ndim > 0:
         b = misc.add_axes(b, num=ndim, axis=-1-ndim)
 
@@ -41,6 +41,28 @@ import unittest
 from numpy import testing
 
 
+def memoize_shapes(func):
+    """
+    Memoize a pure function of shape tuples with a bounded LRU cache.
+
+    Shape calculations are called many times for each message but only with a
+    few different arguments.  Arguments that are not hashable (e.g., lists) are
+    passed to the function without caching.  The decorated function has
+    `cache_info` and `cache_clear` methods.
+    """
+    cached = functools.lru_cache(maxsize=4096)(func)
+    @functools.wraps(func)
+    def wrapper(*args):
+        try:
+            hash(args)
+        except TypeError:
+            return func(*args)
+        return cached(*args)
+    wrapper.cache_info = cached.cache_info
+    wrapper.cache_clear = cached.cache_clear
+    return wrapper
+
+
 def composite_function(function_list):
     """
     Construct a function composition from a list of functions.
@@ -395,6 +417,7 @@ def isinteger(x):
 def is_string(s):
     return isinstance(s, str)
 
+@memoize_shapes
 def multiply_shapes(*shapes):
     """
     Compute element-wise product of lists/tuples.
@@ -412,6 +435,7 @@ def multiply_shapes(*shapes):
 
     return tuple(shape)
 
+@memoize_shapes
 def make_equal_length(*shapes):
     """
     Make tuples equal length.
@@ -423,7 +447,8 @@ def make_equal_length(*shapes):
     max_len = max((len(shape) for shape in shapes))
 
     # Make the shapes equal length
-    shapes = ((1,)*(max_len-len(shape)) + tuple(shape) for shape in shapes)
+    shapes = tuple((1,)*(max_len-len(shape)) + tuple(shape)
+                   for shape in shapes)
 
     return shapes
 
@@ -450,6 +475,7 @@ def sum_to_dim(A, dim):
     return A
 
 
+@memoize_shapes
 def broadcasting_multiplier(plates, *args):
     """
     Compute the plate multiplier for given shapes.
@@ -677,6 +703,7 @@ def safe_indices(inds, shape):
     return tuple(np.fmin(inds, maxinds))
 
 
+@memoize_shapes
 def broadcasted_shape(*shapes):
     """
     Computes the resulting broadcasted shape for a given set of shapes.
@@ -710,6 +737,7 @@ def broadcasted_shape_from_arrays(*arrays):
     return broadcasted_shape(*shapes)
 
 
+@memoize_shapes
 def is_shape_subset(sub_shape, full_shape):
     """
     """
@@ -775,6 +803,22 @@ def squeeze_to_dim(X, dim):
     return np.squeeze(X, axis=s)
 
 
+def collapse_broadcast_axes(X, ndim=0):
+    """
+    Collapse leading axes along which the array is broadcast to unit length.
+
+    An axis is broadcast if its stride is zero, thus the values are not
+    compared.  The last `ndim` axes are not collapsed.  The result broadcasts
+    back to the original array.  For instance, if X is a (D,D) matrix
+    broadcast to shape (N,D,D), the result has shape (1,D,D).
+    """
+    X = np.asanyarray(X)
+    index = tuple(slice(0,1) if X.strides[axis] == 0 else slice(None)
+                  for axis in range(np.ndim(X)-ndim))
+    return X[index]
+
+
+@memoize_shapes
 def axes_to_collapse(shape_x, shape_to):
     # Solves which axes of shape shape_x need to be collapsed in order
     # to get the shape shape_to
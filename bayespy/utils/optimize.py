@@ -24,7 +24,7 @@
 import numpy as np
 from scipy import optimize
 
-def minimize(f, x0, maxiter=None, verbose=False):
+def minimize(f, x0, maxiter=None, verbose=False, method='CG'):
     """
     Simple wrapper for SciPy's optimize.
 
@@ -33,9 +33,101 @@ def minimize(f, x0, maxiter=None, verbose=False):
     options = {'disp': verbose}
     if maxiter is not None:
         options['maxiter'] = maxiter
-    opt = optimize.minimize(f, x0, jac=True, method='CG', options=options)
+    opt = optimize.minimize(f, x0, jac=True, method=method, options=options)
     return opt.x
 
+def bfgs(f, x0, H=None, maxiter=None, gtol=1e-5, ftol=1e-12, verbose=False):
+    """
+    Minimize a function with the BFGS quasi-Newton method.
+
+    The given function must return a tuple: (value, gradient).
+
+    Unlike SciPy's BFGS, the initial inverse Hessian approximation `H` can be
+    given.  Thus, the curvature information can be carried over from one
+    optimization to another similar one.  If `H` is not given, the
+    optimization starts from a scaled identity matrix.
+
+    The iteration stops when the largest absolute gradient element is below
+    `gtol` or the predicted relative decrease of the function value is below
+    `ftol`.
+
+    Returns a tuple of the optimum and the final inverse Hessian
+    approximation.
+    """
+    x = np.array(x0, dtype=float)
+    n = np.size(x)
+    scale = (H is None)
+    if H is None:
+        H = np.identity(n)
+    else:
+        H = np.array(H, dtype=float)
+    if maxiter is None:
+        maxiter = 200 * n
+
+    def safe_f(x):
+        try:
+            (c, g) = f(x)
+        except np.linalg.LinAlgError:
+            return (np.inf, None)
+        if not np.isfinite(c):
+            return (np.inf, None)
+        return (c, g)
+
+    (c, g) = f(x)
+    iteration = 0
+    for iteration in range(maxiter):
+        if np.max(np.abs(g)) <= gtol:
+            break
+
+        p = -np.dot(H, g)
+        slope = np.dot(g, p)
+        if slope >= 0:
+            # Not a descent direction, forget the curvature
+            H = np.identity(n)
+            p = -g
+            slope = -np.dot(g, g)
+            scale = True
+
+        # Stop if the predicted decrease is negligible compared to the
+        # function value, because rounding errors would make the line search
+        # fail anyway
+        if -slope <= ftol * max(1, abs(c)):
+            break
+
+        # Backtracking line search with Armijo condition
+        step = 1.0
+        for k in range(30):
+            (c_new, g_new) = safe_f(x + step*p)
+            if c_new <= c + 1e-4 * step * slope:
+                break
+            step *= 0.5
+        else:
+            if verbose:
+                print("Line search failed after %d iterations" % iteration)
+            break
+
+        s = step * p
+        y = g_new - g
+        x = x + s
+        (c, g) = (c_new, g_new)
+
+        # Update the inverse Hessian approximation if the curvature
+        # condition holds
+        ys = np.dot(y, s)
+        if ys > 0:
+            if scale:
+                H = ys / np.dot(y, y) * np.identity(n)
+                scale = False
+            rho = 1 / ys
+            V = np.identity(n) - rho * np.outer(s, y)
+            H = np.dot(V, np.dot(H, V.T)) + rho * np.outer(s, s)
+
+    if verbose:
+        print("BFGS stopped after %d iterations with value %g"
+              % (iteration, c))
+
+    return (x, H)
+
 def check_gradient(f, x0, verbose=True):
     """
     Simple wrapper for SciPy's gradient checker.
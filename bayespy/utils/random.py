@@ -287,20 +287,111 @@ def categorical(p, size=None):
     # Draw samples from interval [0,1]
     x = np.random.rand(*size)
 
-    # For simplicity, repeat p to the size of the output (plus probability axis)
+    # The sample is the number of cumulative probabilities smaller than the
+    # uniform random number, which is found by binary search.  The last
+    # cumulative probability is ignored in order to avoid invalid indices
+    # because of rounding errors.
+    if np.ndim(P) == 1:
+        z = np.searchsorted(P[:-1], x)
+    else:
+        z = _searchsorted_rows(P[...,:-1], x)
+
+    return z
+
+
+def _searchsorted_rows(P, x):
+    """
+    Count the elements smaller than x in each sorted row of P.
+
+    The binary search is vectorized over the rows, thus it takes
+    O(log(K)) vectorized steps for rows of length K.
+    """
+    x = np.asarray(x)
+    K = np.shape(P)[-1]
+    P = np.broadcast_to(P, np.shape(x) + (K,))
+    lo = np.zeros(np.shape(x), dtype=int)
+    hi = np.full(np.shape(x), K)
+    while np.any(lo < hi):
+        active = lo < hi
+        mid = (lo + hi) // 2
+        P_mid = np.take_along_axis(P, np.minimum(mid, K-1)[...,None], axis=-1)
+        less = P_mid[...,0] < x
+        lo = np.where(active & less, mid + 1, lo)
+        hi = np.where(active & ~less, mid, hi)
+    return lo
+
+
+def alias_table(p):
+    r"""
+    Construct alias tables for categorical distributions.
+
+    The alias table allows drawing samples from a categorical distribution
+    in constant time per sample. Thus, it is useful when drawing samples
+    repeatedly from the same distribution. The table is built by pairing the
+    smallest and the largest remaining scaled probabilities, which can be
+    done for all distributions in `p` simultaneously.
+
+    Returns the acceptance probabilities and the aliases, both with the same
+    shape as `p`. Use :func:`alias_categorical` to draw samples.
+    """
+    p = np.asanyarray(p, dtype=float)
+    if np.any(p < 0):
+        raise ValueError("Array contains negative probabilities")
+
     K = np.shape(p)[-1]
-    P = P * np.ones(tuple(size)+(K,))
+    plates = np.shape(p)[:-1]
 
-    if size == ():
-        z = np.searchsorted(P, x)
-    else:
-        # Seach the indices
-        z = np.zeros(size)
-        inds = misc.nested_iterator(size)
-        for ind in inds:
-            z[ind] = np.searchsorted(P[ind], x[ind])
+    # Scaled probabilities, their average is one
+    q = K * p / np.sum(p, axis=-1, keepdims=True)
+
+    prob = np.ones(np.shape(p))
+    alias = np.zeros(np.shape(p), dtype=int)
+    alias[...] = np.arange(K)
+    done = np.zeros(np.shape(p), dtype=bool)
+
+    for k in range(K-1):
+        # The smallest remaining is at most one and the largest remaining is
+        # at least one
+        small = np.argmin(np.where(done, np.inf, q), axis=-1)[...,None]
+        large = np.argmax(np.where(done, -np.inf, q), axis=-1)[...,None]
+        q_small = np.take_along_axis(q, small, axis=-1)
+        q_large = np.take_along_axis(q, large, axis=-1)
+        np.put_along_axis(prob, small, q_small, axis=-1)
+        np.put_along_axis(alias, small, large, axis=-1)
+        np.put_along_axis(done, small, True, axis=-1)
+        np.put_along_axis(q, large, q_large - (1 - q_small), axis=-1)
+
+    return (prob, alias)
+
+
+def alias_categorical(prob, alias, size=None):
+    r"""
+    Draw random samples from categorical distributions using alias tables.
+
+    The alias tables are constructed with :func:`alias_table`.
+    """
+    if size is None:
+        size = np.shape(prob)[:-1]
+    if isinstance(size, int):
+        size = (size,)
+
+    if not misc.is_shape_subset(np.shape(prob)[:-1], size):
+        raise ValueError("Alias table shape and requested size are "
+                         "inconsistent")
+
+    size = tuple(size)
+    K = np.shape(prob)[-1]
+
+    # Draw a column uniformly and then either the column or its alias
+    k = np.minimum(np.floor(np.random.rand(*size) * K).astype(int), K-1)
+    k = k[...,None]
+    prob = np.take_along_axis(np.broadcast_to(prob, size+(K,)), k, axis=-1)
+    alias = np.take_along_axis(np.broadcast_to(alias, size+(K,)), k, axis=-1)
+    z = np.where(np.random.rand(*size) < prob[...,0],
+                 k[...,0],
+                 alias[...,0])
 
-    return z.astype(np.int)
+    return z
 
 
 def dirichlet(alpha, size=None):
@@ -393,6 +484,51 @@ def alpha_beta_recursion(logp0, logP):
     return (z0, zz, g)
 
 
+def viterbi(logp0, logP):
+    r"""
+    Compute the most probable state sequence of a Markov chain
+
+    The inputs are interpreted as in :func:`alpha_beta_recursion`:
+
+    logp0 = log P(z_0) + log P(y_0|z_0)
+    logP[...,n,:,:] = log P(z_{n+1}|z_n) + log P(y_{n+1}|z_{n+1})
+
+    Returns the state indices with shape (...,N+1), where N is the number of
+    transitions.
+    """
+
+    logp0 = misc.atleast_nd(logp0, 1)
+    logP = misc.atleast_nd(logP, 3)
+
+    D = np.shape(logp0)[-1]
+    N = np.shape(logP)[-3]
+    plates = misc.broadcasted_shape(np.shape(logp0)[:-1], np.shape(logP)[:-3])
+
+    if np.shape(logP)[-2:] != (D,D):
+        raise ValueError("Dimension mismatch %s != %s"
+                         % (np.shape(logP)[-2:],
+                            (D,D)))
+
+    # Forward pass: the log-probability of the best path ending in each state
+    # and the best previous state for each state
+    logdelta = logp0 * np.ones(plates+(D,))
+    psi = np.zeros(plates+(N,D), dtype=int)
+    for n in range(N):
+        v = logdelta[...,:,None] + logP[...,n,:,:]
+        psi[...,n,:] = np.argmax(v, axis=-2)
+        logdelta = np.amax(v, axis=-2)
+
+    # Backtracking
+    z = np.zeros(plates+(N+1,), dtype=int)
+    z[...,N] = np.argmax(logdelta, axis=-1)
+    for n in reversed(range(N)):
+        z[...,n] = np.take_along_axis(psi[...,n,:],
+                                      z[...,n+1,None],
+                                      axis=-1)[...,0]
+
+    return z
+
+
 def gaussian_gamma_to_t(mu, Cov, a, b, ndim=1):
     r"""
     Integrates gamma distribution to obtain parameters of t distribution
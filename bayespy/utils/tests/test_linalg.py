@@ -199,3 +199,118 @@ class TestBandedSolve(misc.TestCase):
         # Check the log determinant
         self.assertAlmostEqual(ldet/np.linalg.slogdet(C)[1], 1)
 
+
+
+class TestCholeskyCache(misc.TestCase):
+
+    def test_chol(self):
+        """
+        Test caching of Cholesky factors
+        """
+
+        class Owner():
+            pass
+
+        cache = linalg.CholeskyCache()
+        C = np.array([[4.0, 2.0],
+                      [2.0, 3.0]])
+        owner = Owner()
+
+        # First call computes the factor
+        with cache.key(owner, 0):
+            U = cache.chol(lambda: 2*C)
+        U = np.triu(U)
+        self.assertAllClose(np.einsum('ki,kj->ij', U, U), 2*C)
+        self.assertEqual(cache.cache_info(), (0, 1, 1))
+
+        # Second call with the same key uses the cache
+        with cache.key(owner, 0):
+            V = cache.chol(lambda: 2*C)
+            self.assertIs(cache.chol(C), V)
+        self.assertEqual(cache.cache_info(), (2, 1, 1))
+
+        # A new version replaces the factor of the owner
+        C[0,0] = 5.0
+        with cache.key(owner, 1):
+            V = cache.chol(C)
+        self.assertAllClose(np.einsum('ki,kj->ij', np.triu(V), np.triu(V)),
+                            C)
+        self.assertEqual(cache.cache_info(), (2, 2, 1))
+
+        # Without a key nothing is cached
+        cache.chol(C)
+        self.assertEqual(cache.cache_info(), (2, 3, 1))
+
+        # Entries are removed when the owner is removed
+        del owner
+        self.assertEqual(cache.cache_info().currsize, 0)
+
+        cache.clear()
+        self.assertEqual(cache.cache_info(), (0, 0, 0))
+
+        pass
+
+
+class TestDiagonalPlusLowRank(misc.TestCase):
+
+    def test_algebra(self):
+        """
+        Test the structured diagonal-plus-low-rank matrix
+        """
+
+        d = np.array([1.0, 2.0, 3.0, 4.0])
+        U = np.array([[1.0, 0.5],
+                      [0.0, 1.0],
+                      [2.0, 0.0],
+                      [1.0, 1.0]])
+        C = np.array([[2.0, 0.5],
+                      [0.5, 1.0]])
+        A = linalg.DiagonalPlusLowRank(d, U, C)
+        A_dense = np.diag(d) + np.dot(np.dot(U, C), U.T)
+
+        self.assertEqual(np.shape(A), (4,4))
+        self.assertAllClose(A.dense(), A_dense)
+
+        # Woodbury identity and determinant lemma
+        b = np.array([1.0, -1.0, 2.0, 0.5])
+        self.assertAllClose(np.dot(A_dense, A.solve(b)), b)
+        self.assertIsInstance(A.inv(), linalg.DiagonalPlusLowRank)
+        self.assertAllClose(np.dot(A_dense, A.inv()), np.identity(4),
+                            atol=1e-10)
+        self.assertAllClose(A.logdet(), np.linalg.slogdet(A_dense)[1])
+
+        # Products
+        X = np.outer(b, b)
+        self.assertAllClose(linalg.mvdot(A, b), np.dot(A_dense, b))
+        self.assertAllClose(linalg.inner(A, X, ndim=2),
+                            np.sum(A_dense*X))
+        self.assertAllClose(linalg.inner(A, A.inv(), ndim=2), 4)
+
+        # Structure is kept in scaling and addition
+        B = -0.5*A + A
+        self.assertIsInstance(B, linalg.DiagonalPlusLowRank)
+        self.assertAllClose(B.dense(), 0.5*A_dense)
+        self.assertIs(A + np.zeros((4,4)), A)
+        self.assertAllClose(A + np.ones((4,4)), A_dense + 1)
+        self.assertAllClose(np.zeros((4,4)) - A, -A_dense)
+        self.assertIsInstance(np.ones(4) * A, np.ndarray)
+
+        # The rank does not grow beyond the dimensionality in additions
+        B = A
+        for i in range(3):
+            B = B + A
+        self.assertEqual(np.shape(B.U), (4,4))
+        self.assertAllClose(B.dense(), 4*A_dense)
+        E = linalg.DiagonalPlusLowRank(d, U[:,:1], max_rank=1)
+        self.assertEqual(np.shape((E + E).U), (4,1))
+        self.assertAllClose((E + E).dense(), 2*E.dense())
+
+        # Broadcasted plates
+        A = linalg.DiagonalPlusLowRank(d, U[None,:,:]*[[[1]],[[2]]], C)
+        self.assertEqual(np.shape(A), (2,4,4))
+        self.assertAllClose(A.logdet()[1],
+                            np.linalg.slogdet(np.diag(d)
+                                              + 4*np.dot(np.dot(U, C),
+                                                         U.T))[1])
+
+        pass
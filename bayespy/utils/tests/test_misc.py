@@ -449,3 +449,69 @@ class TestMean(misc.TestCase):
                             [[2.5]])
         
         pass
+
+
+class TestCollapseBroadcastAxes(misc.TestCase):
+
+    def test_collapse_broadcast_axes(self):
+        """
+        Test collapsing broadcast leading axes
+        """
+
+        # Broadcast axis is collapsed
+        X = np.broadcast_to(np.array([[1,2],[3,4]]), (4,2,2))
+        Y = misc.collapse_broadcast_axes(X, ndim=2)
+        self.assertEqual(np.shape(Y), (1,2,2))
+        self.assertAllClose(Y, X[:1])
+
+        # Materialized axes are kept even if constant
+        X = np.ones((4,1,1)) * np.array([[1,2],[3,4]])
+        Y = misc.collapse_broadcast_axes(X, ndim=2)
+        self.assertEqual(np.shape(Y), (4,2,2))
+
+        # Only the broadcast axis among several
+        X = np.broadcast_to(np.array([[1],[2]]), (3,2,1))
+        Y = misc.collapse_broadcast_axes(X, ndim=0)
+        self.assertEqual(np.shape(Y), (1,2,1))
+        self.assertAllClose(Y*np.ones((3,1,1)), X)
+
+        # Trailing axes are not collapsed
+        X = np.broadcast_to(np.array([1,2]), (3,4,2))
+        Y = misc.collapse_broadcast_axes(X, ndim=2)
+        self.assertEqual(np.shape(Y), (1,4,2))
+
+        pass
+
+
+class TestMemoizeShapes(misc.TestCase):
+
+    def test_memoize_shapes(self):
+        """
+        Test memoized shape calculations
+        """
+
+        misc.broadcasted_shape.cache_clear()
+        self.assertEqual(misc.broadcasted_shape((3,1), (4,)), (3,4))
+        self.assertEqual(misc.broadcasted_shape((3,1), (4,)), (3,4))
+        info = misc.broadcasted_shape.cache_info()
+        self.assertEqual(info.hits, 1)
+        self.assertEqual(info.misses, 1)
+
+        # Unhashable arguments are not cached
+        self.assertEqual(misc.broadcasted_shape([3,1], [4]), (3,4))
+        self.assertEqual(misc.broadcasted_shape.cache_info().currsize, 1)
+
+        # Errors are raised every time
+        for i in range(2):
+            self.assertRaises(ValueError,
+                              misc.broadcasted_shape,
+                              (3,),
+                              (4,))
+
+        # Cached results can be iterated several times
+        self.assertEqual(tuple(misc.make_equal_length((2,), (3,4))),
+                         ((1,2), (3,4)))
+        self.assertEqual(tuple(misc.make_equal_length((2,), (3,4))),
+                         ((1,2), (3,4)))
+
+        pass
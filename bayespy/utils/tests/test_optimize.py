@@ -0,0 +1,66 @@
+######################################################################
+# Copyright (C) 2014 Jaakko Luttinen
+#
+# This file is licensed under Version 3.0 of the GNU General Public
+# License. See LICENSE for a text of the license.
+######################################################################
+
+######################################################################
+# This file is part of BayesPy.
+#
+# BayesPy is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License version 3 as
+# published by the Free Software Foundation.
+#
+# BayesPy is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BayesPy.  If not, see <http://www.gnu.org/licenses/>.
+######################################################################
+
+"""
+Unit tests for bayespy.utils.optimize module.
+"""
+
+import numpy as np
+
+from .. import misc
+from .. import optimize
+
+class TestBFGS(misc.TestCase):
+
+    def test_bfgs(self):
+        """
+        Test BFGS with and without initial inverse Hessian
+        """
+
+        A = np.array([[3.0, 1.0, 0.0],
+                      [1.0, 2.0, 0.5],
+                      [0.0, 0.5, 1.0]])
+        b = np.array([1.0, -2.0, 3.0])
+        x_opt = np.linalg.solve(A, b)
+
+        calls = [0]
+        def f(x):
+            calls[0] += 1
+            return (0.5*np.dot(x, np.dot(A, x)) - np.dot(b, x),
+                    np.dot(A, x) - b)
+
+        # Start from scratch
+        (x, H) = optimize.bfgs(f, np.zeros(3))
+        self.assertAllClose(x, x_opt, atol=1e-5)
+
+        # Exact curvature finds the optimum with one step
+        calls[0] = 0
+        (x, H) = optimize.bfgs(f, np.zeros(3), H=np.linalg.inv(A))
+        self.assertAllClose(x, x_opt)
+        self.assertEqual(calls[0], 2)
+
+        # Maximum number of iterations
+        (x, H) = optimize.bfgs(f, np.zeros(3), maxiter=0)
+        self.assertAllClose(x, np.zeros(3))
+
+        pass
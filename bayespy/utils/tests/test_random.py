@@ -61,6 +61,19 @@ class TestCeilDiv(misc.TestCase):
         y = random.categorical([0,1,0], size=(4,))
         self.assertArrayEqual(y, [1,1,1,1])
 
+        # The binary search over rows equals counting the smaller cumulative
+        # probabilities
+        np.random.seed(1)
+        p = np.random.dirichlet(np.ones(7), size=(5,1))
+        p[0,0,3] = 0
+        p[1,0,-2:] = 0
+        np.random.seed(2)
+        y = random.categorical(p, size=(5,20))
+        np.random.seed(2)
+        x = np.random.rand(5,20)
+        P = np.cumsum(p / np.sum(p, axis=-1, keepdims=True), axis=-1)
+        self.assertArrayEqual(y, np.sum(P[...,:-1] < x[...,None], axis=-1))
+
         #
         # ERRORS
         #
@@ -278,3 +291,85 @@ class TestAlphaBetaRecursion(misc.TestCase):
                         msg="Nans in results, algorithm not stable")
 
         pass
+
+
+class TestViterbi(misc.TestCase):
+
+    def test(self):
+        """
+        Test the most probable path of Markov chains
+        """
+
+        # Deterministic oscillator
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            p0 = np.array([1.0, 0.0])
+            P = np.array(3*[[[0.0, 1.0],
+                             [1.0, 0.0]]])
+            z = random.viterbi(np.log(p0), np.log(P))
+        self.assertArrayEqual(z, [0, 1, 0, 1])
+
+        # Compare to brute force
+        np.random.seed(42)
+        logp0 = np.random.randn(3)
+        logP = np.random.randn(2,3,3)
+        L = (logp0[:,None,None]
+             + logP[0][:,:,None]
+             + logP[1][None,:,:])
+        z = random.viterbi(logp0, logP)
+        self.assertArrayEqual(z, np.unravel_index(np.argmax(L), L.shape))
+
+        # Plates
+        logp0 = np.log([[0.9, 0.1],
+                        [0.1, 0.9]])
+        logP = np.log([[[0.9, 0.1],
+                        [0.1, 0.9]]])
+        z = random.viterbi(logp0, logP)
+        self.assertArrayEqual(z, [[0, 0],
+                                  [1, 1]])
+
+        pass
+
+
+class TestAliasTable(misc.TestCase):
+
+    def test(self):
+        """
+        Test sampling from categorical distributions using alias tables
+        """
+
+        # Deterministic distributions
+        (prob, alias) = random.alias_table([ [1,0,0], [0,0,1], [0,1,0] ])
+        y = random.alias_categorical(prob, alias)
+        self.assertArrayEqual(y, [0,2,1])
+
+        # Multiple samples with un-normalized probabilities
+        (prob, alias) = random.alias_table([0, 0.1234, 0])
+        y = random.alias_categorical(prob, alias, size=(4,))
+        self.assertArrayEqual(y, [1,1,1,1])
+
+        # The table represents the distribution exactly
+        np.random.seed(42)
+        p = np.random.dirichlet(np.ones(6), size=(3,))
+        (prob, alias) = random.alias_table(p)
+        q = prob / 6
+        for k in range(6):
+            q = q + np.sum(np.where(alias == k, 1 - prob, 0),
+                           axis=-1,
+                           keepdims=True) / 6 * (np.arange(6) == k)
+        self.assertAllClose(q, p)
+
+        # Negative probablities
+        self.assertRaises(ValueError,
+                          random.alias_table,
+                          [0, -1])
+
+        # Requested size and table size mismatch
+        (prob, alias) = random.alias_table([[1,0],[0,1]])
+        self.assertRaises(ValueError,
+                          random.alias_categorical,
+                          prob,
+                          alias,
+                          size=(3,))
+
+        pass
@@ -46,7 +46,8 @@ if __name__ == "__main__":
     
     # Setup for BayesPy
     setup(
-          install_requires = ['numpy>=1.8.0', # 1.8 implements broadcasting in numpy.linalg
+          python_requires  = '>=3.7', # 3.7 implements contextlib.nullcontext
+          install_requires = ['numpy>=1.22.0', # 1.22 implements broadcasting in numpy.linalg.qr
                               'scipy>=0.13.0', # <0.13 have a bug in special.multigammaln
                               'matplotlib>=1.2.0',
                               'h5py'],
@@ -72,8 +73,8 @@ if __name__ == "__main__":
           classifiers =
             [ 
               'Programming Language :: Python :: 3 :: Only',
-              'Programming Language :: Python :: 3.3',
-              'Programming Language :: Python :: 3.4',
+              'Programming Language :: Python :: 3.7',
+              'Programming Language :: Python :: 3.8',
               'Development Status :: 4 - Beta',
               'Environment :: Console',
               'Intended Audience :: Developers',